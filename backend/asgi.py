@@ -13,4 +13,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+if os.environ.get('CORS_PROFILE_IMPORTS'):
+    # Cold-start profile mode: report import time per heavy module
+    import time
+    from cors_app.profiling import profile_imports, report_cold_start
+
+    import_timings = profile_imports()
+    start = time.perf_counter()
+    application = get_asgi_application()
+    report_cold_start(import_timings, time.perf_counter() - start)
+else:
+    application = get_asgi_application()
+
+# Keep dataset indexes current in the background (see DatasetManager);
+# the first poll waits CORS_DATASET_POLL_INTERVAL, so start-up stays cheap
+from cors_app.views import dataset_manager
+dataset_manager.start()
@@ -11,12 +11,16 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 
+import os
+import tempfile
 from pathlib import Path
+from corsheaders.defaults import default_headers
 from decouple import config
 
-AWS_DEFAULT_REGION = config('AWS_DEFAULT_REGION')
-AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID')
-AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY')
+# Optional: when unset, boto3 falls back to its default credential chain
+AWS_DEFAULT_REGION = config('AWS_DEFAULT_REGION', default=None)
+AWS_ACCESS_KEY_ID = config('AWS_ACCESS_KEY_ID', default=None)
+AWS_SECRET_ACCESS_KEY = config('AWS_SECRET_ACCESS_KEY', default=None)
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -49,6 +53,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'cors_app.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -121,6 +126,11 @@ CORS_ORIGIN_WHITELIST = (
     'https://cors-dashboard-frontend-4.vercel.app/',
 )
 
+# The dashboards are on other origins: let them send conditional requests
+# (for 304 responses) and read the caching and timing headers
+CORS_ALLOW_HEADERS = (*default_headers, 'if-none-match', 'if-modified-since')
+CORS_EXPOSE_HEADERS = ['ETag', 'Last-Modified', 'Server-Timing']
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -138,6 +148,68 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
+# Derived data (parsed STACOV sidecars and the like). Defaults to the
+# system temp directory, which is the only writable location on Vercel.
+CORS_CACHE_DIR = config('CORS_CACHE_DIR', default=os.path.join(tempfile.gettempdir(), 'cors_dashboard'))
+
+# Number of parsed STACOV days kept in process memory
+STACOV_CACHE_SIZE = config('STACOV_CACHE_SIZE', default=16, cast=int)
+
+# Serialized GeoJSON responses kept in memory, optionally pre-gzipped
+RESPONSE_CACHE_SIZE = config('RESPONSE_CACHE_SIZE', default=128, cast=int)
+RESPONSE_CACHE_GZIP = config('RESPONSE_CACHE_GZIP', default=True, cast=bool)
+
+# Multi-day range responses are several MB each, so fewer are kept
+RANGE_CACHE_SIZE = config('RANGE_CACHE_SIZE', default=8, cast=int)
+
+# Vector tiles are small and numerous
+TILE_CACHE_SIZE = config('TILE_CACHE_SIZE', default=4096, cast=int)
+
+# Precomputed layer artifacts (see precompute_layers) kept in memory once
+# read from disk
+ARTIFACT_CACHE_SIZE = config('ARTIFACT_CACHE_SIZE', default=256, cast=int)
+
+# Send a Server-Timing header with per-stage durations on every response.
+# With CORS_PROFILING on, a request with ?profile returns its cProfile
+# statistics instead; never enable that in production.
+CORS_SERVER_TIMING = config('CORS_SERVER_TIMING', default=True, cast=bool)
+CORS_PROFILING = config('CORS_PROFILING', default=False, cast=bool)
+
+# MYCS2 predictions whose station code is not a known site are paired with
+# the nearest site no further than this (metres)
+CORS_MATCH_MAX_DISTANCE = config('CORS_MATCH_MAX_DISTANCE', default=5000, cast=float)
+# Largest max_distance a request may ask for; half the Earth's
+# circumference already reaches every site
+CORS_MATCH_MAX_DISTANCE_LIMIT = config('CORS_MATCH_MAX_DISTANCE_LIMIT', default=20_000_000, cast=float)
+
+# Map requests with a bbox below this zoom level get clustered points
+CORS_CLUSTER_MAX_ZOOM = config('CORS_CLUSTER_MAX_ZOOM', default=6, cast=int)
+
+# Where the CSV datasets are read from: 's3' (cached on local disk and
+# revalidated by ETag once the TTL in seconds expires) or 'local' (files
+# under CORS_STORAGE_ROOT, e.g. a mirror of the bucket)
+CORS_STORAGE_BACKEND = config('CORS_STORAGE_BACKEND', default='s3')
+CORS_STORAGE_ROOT = config('CORS_STORAGE_ROOT', default=str(BASE_DIR / 'static'))
+CORS_S3_BUCKET = config('CORS_S3_BUCKET', default='cors-dashboard-dataset')
+CORS_S3_CACHE_TTL = config('CORS_S3_CACHE_TTL', default=300, cast=int)
+
+# Connection pool, keep-alive, timeouts and retries of the shared S3 client
+CORS_S3_MAX_POOL_CONNECTIONS = config('CORS_S3_MAX_POOL_CONNECTIONS', default=20, cast=int)
+CORS_S3_MAX_ATTEMPTS = config('CORS_S3_MAX_ATTEMPTS', default=4, cast=int)
+CORS_S3_CONNECT_TIMEOUT = config('CORS_S3_CONNECT_TIMEOUT', default=5, cast=float)
+CORS_S3_READ_TIMEOUT = config('CORS_S3_READ_TIMEOUT', default=30, cast=float)
+
+# Seconds between background checks for new or changed datasets, STACOV
+# and site files (see DatasetManager); 0 leaves it to each request. The
+# first check runs one interval after start-up, so cold starts (e.g. on
+# serverless hosts) are not slowed by it and requests fetch on demand
+CORS_DATASET_POLL_INTERVAL = config('CORS_DATASET_POLL_INTERVAL', default=60, cast=int)
+
+# Worker threads behind the async endpoint for S3/disk waits and for
+# parsing/encoding
+CORS_ASYNC_IO_WORKERS = config('CORS_ASYNC_IO_WORKERS', default=16, cast=int)
+CORS_ASYNC_CPU_WORKERS = config('CORS_ASYNC_CPU_WORKERS', default=4, cast=int)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class CorsAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cors_app'
+
+    def ready(self):
+        # Load the static site tables once per process, before any request
+        from .registry import load_site_registry
+        load_site_registry()
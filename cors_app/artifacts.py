@@ -0,0 +1,91 @@
+import glob
+import gzip
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+
+from .cache import CachedResponse, LRUCache, cache_path, file_signature
+from .timing import count_cache, stage
+
+# Bumped whenever the layer encoders' output changes, so artifacts written
+# by an older version are rebuilt rather than served
+ARTIFACT_FORMAT = 2
+
+
+class ArtifactStore:
+    """
+    Pre-built, gzip-compressed layer responses on disk, written by the
+    precompute_layers command. An artifact is named after its layer, day
+    (None for layers without one) and format, plus a digest of the source
+    files' versions, so a changed input simply stops matching and the
+    view falls back to building the layer live. A source's version is its
+    mtime/size unless versions maps it to one from storage (the S3 ETag of
+    a downloaded dataset), which stays the same across re-downloads and
+    hosts.
+
+    Loaded artifacts are kept in memory under an LRU limit.
+    """
+
+    def __init__(self, maxsize, artifact_dir='artifacts'):
+        self.artifact_dir = artifact_dir
+        self._memory = LRUCache(maxsize)
+
+    def path(self, name, day, response_format, sources, versions=None):
+        versions = versions or {}
+        signature = [(os.path.basename(source),) + ((versions[source],) if source in versions
+                                                    else file_signature(source))
+                     for source in sources]
+        digest = hashlib.sha1(repr((ARTIFACT_FORMAT, signature)).encode('utf-8')).hexdigest()[:16]
+        return cache_path(self.artifact_dir, name, f'{day or "all"}-{digest}.{response_format}.gz')
+
+    def get(self, name, day, response_format, sources, versions=None):
+        """
+        Return the CachedResponse for the current version of sources, or
+        None if it has not been precomputed.
+        """
+        path = self.path(name, day, response_format, sources, versions)
+        entry = self._memory.get(path)
+        if entry is not None:
+            count_cache('artifact', 'memory')
+            return entry
+
+        try:
+            with stage('artifact_read'), open(path, 'rb') as file:
+                gzip_body = file.read()
+        except OSError:
+            count_cache('artifact', 'miss')
+            return None
+        count_cache('artifact', 'disk')
+        last_modified = max(os.stat(source).st_mtime_ns for source in sources) // 10**9
+        entry = CachedResponse(gzip.decompress(gzip_body), None, last_modified, gzip_body=gzip_body)
+        self._memory.put(path, entry)
+        return entry
+
+    def exists(self, name, day, response_format, sources, versions=None):
+        return os.path.exists(self.path(name, day, response_format, sources, versions))
+
+    def write(self, name, day, response_format, sources, body, versions=None):
+        """
+        Store body as the artifact for the current version of sources and
+        remove artifacts built from earlier versions of the same day.
+        """
+        path = self.path(name, day, response_format, sources, versions)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as tmp:
+            tmp.write(gzip.compress(body, compresslevel=9))
+        os.replace(tmp_path, path)
+
+        pattern = os.path.join(os.path.dirname(path), f'{day or "all"}-*.{response_format}.gz')
+        for stale in glob.glob(pattern):
+            if stale != path:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return path
+
+
+artifact_store = ArtifactStore(settings.ARTIFACT_CACHE_SIZE)
@@ -0,0 +1,274 @@
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .models import read_stacov
+from .timing import count_cache, stage
+
+# Bumped whenever read_stacov's output changes, so sidecars written by an
+# older version are rebuilt rather than served with missing columns or
+# stale values
+STACOV_SIDECAR_FORMAT = 3
+
+
+def cache_path(*parts):
+    """
+    Return a path under CORS_CACHE_DIR.
+    """
+    return os.path.join(settings.CORS_CACHE_DIR, *parts)
+
+
+def publish_version(path, write):
+    """
+    Build a versioned cache directory and make it visible atomically.
+
+    write(tmp_path) creates the directory at tmp_path, inside a temporary
+    directory next to path; it is then moved to path in one rename, so
+    readers in other processes never see a partial build. The most
+    recent earlier version is kept for readers that still have it open;
+    older sibling directories are removed afterwards.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent, prefix='.build-')
+    try:
+        write(os.path.join(tmp_dir, 'build'))
+        try:
+            os.rename(os.path.join(tmp_dir, 'build'), path)
+        except OSError:
+            # Another worker finished the same version first
+            if not os.path.exists(os.path.join(path, 'meta.json')):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    earlier = []
+    for entry in os.listdir(parent):
+        entry_path = os.path.join(parent, entry)
+        if entry_path != path and not entry.startswith('.'):
+            try:
+                earlier.append((os.stat(entry_path).st_mtime_ns, entry_path))
+            except OSError:
+                pass
+    for _, entry_path in sorted(earlier)[:-1]:
+        shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def file_signature(file_path):
+    """
+    Identify a version of a file by its modification time and size.
+    """
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class LRUCache:
+    """
+    Thread-safe mapping that evicts the least recently used entry once
+    it holds more than maxsize items.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def write_stacov_sidecar(path, signature, cdate, nsta, df_xyz):
+    """
+    Store a parsed STACOV result as an .npz file tagged with the source
+    file's signature. The file is written to a temporary name first so
+    concurrent readers never see a partial sidecar.
+    """
+    arrays = {
+        'format': np.array(STACOV_SIDECAR_FORMAT),
+        'signature': np.array(signature, dtype=np.int64),
+        'cdate': np.array(cdate),
+        'nsta': np.array(nsta),
+        'columns': np.array(list(df_xyz.columns)),
+    }
+    for i, column in enumerate(df_xyz.columns):
+        values = df_xyz[column].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f'column_{i}'] = values
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as tmp:
+        np.savez(tmp, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_stacov_sidecar(path, signature):
+    """
+    Load a sidecar written by write_stacov_sidecar, or return None if it
+    is missing, unreadable, in an older format or was built from a
+    different file version.
+    """
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            if 'format' not in npz or int(npz['format']) != STACOV_SIDECAR_FORMAT:
+                return None
+            if tuple(npz['signature']) != tuple(signature):
+                return None
+            columns = [str(column) for column in npz['columns']]
+            df_xyz = pd.DataFrame({
+                column: npz[f'column_{i}'] for i, column in enumerate(columns)
+            })
+            return str(npz['cdate']), int(npz['nsta']), df_xyz
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class StacovCache:
+    """
+    Parsed STACOV results kept in memory under an LRU limit and backed by
+    .npz sidecars on disk, so a cold worker can skip text parsing. Both
+    levels are keyed by file path and invalidated when the file's mtime
+    or size changes.
+
+    Results are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, maxsize, sidecar_dir='stacov'):
+        self.sidecar_dir = sidecar_dir
+        self._memory = LRUCache(maxsize)
+
+    def sidecar_path(self, file_path):
+        return cache_path(self.sidecar_dir, os.path.basename(file_path) + '.npz')
+
+    def load(self, file_path, signature=None):
+        """
+        Return the parsed file. signature, if given, is the version the
+        caller wants (e.g. from a DatasetSnapshot): the entry built for it
+        is returned without checking the file, and the file itself only
+        read when there is no such entry.
+        """
+        key = os.path.abspath(file_path)
+        if signature is None:
+            signature = file_signature(key)
+
+        entry = self._memory.get(key)
+        if entry is not None and entry[0] == signature:
+            count_cache('stacov', 'memory')
+            return entry[1]
+
+        sidecar = self.sidecar_path(key)
+        with stage('stacov_sidecar'):
+            result = read_stacov_sidecar(sidecar, signature)
+        count_cache('stacov', 'sidecar' if result is not None else 'parse')
+        if result is None:
+            signature = file_signature(key)
+            with stage('stacov_parse'), open(key, 'rb') as file:
+                result = read_stacov(file)
+            try:
+                write_stacov_sidecar(sidecar, signature, *result)
+            except OSError:
+                # A read-only cache directory only costs us the disk level
+                pass
+
+        self._memory.put(key, (signature, result))
+        return result
+
+    def clear(self):
+        self._memory.clear()
+
+
+stacov_cache = StacovCache(settings.STACOV_CACHE_SIZE)
+
+
+def load_stacov(file_path, signature=None):
+    """
+    Cached equivalent of opening file_path and calling read_stacov on it.
+    """
+    return stacov_cache.load(file_path, signature)
+
+
+class CachedResponse:
+    """
+    Final JSON bytes for one response, with an ETag derived from their
+    content and an optional gzip-compressed copy. gzip_body may be given
+    when the compressed bytes already exist (e.g. read from disk).
+    """
+
+    def __init__(self, body, signature, last_modified, compress=True, gzip_body=None):
+        self.body = body
+        self.signature = signature
+        self.last_modified = last_modified
+        self.etag = '"%s"' % hashlib.blake2b(body, digest_size=16).hexdigest()
+        if gzip_body is None and compress:
+            gzip_body = gzip.compress(body, compresslevel=6)
+        self.gzip_body = gzip_body
+
+
+class ResponseCache:
+    """
+    Serialized responses keyed by request (e.g. option and date). An entry
+    is rebuilt only when one of the source files it was built from
+    changes.
+    """
+
+    def __init__(self, maxsize, compress=True, name='response'):
+        self.compress = compress
+        self.name = name
+        self._memory = LRUCache(maxsize)
+
+    def get_or_build(self, key, sources, build, versions=None):
+        """
+        Return the CachedResponse for key, calling build() to produce the
+        response bytes if there is no entry for the current version of
+        the source files. versions maps sources to the file_signature
+        build() reads them at, when that is not the file's current one
+        (e.g. the version in a DatasetSnapshot).
+        """
+        versions = versions or {}
+        signature = tuple(versions[source] if source in versions else file_signature(source) for source in sources)
+        entry = self._memory.get(key)
+        count_cache(self.name, entry is not None and entry.signature == signature)
+        if entry is not None and entry.signature == signature:
+            return entry
+
+        last_modified = max(mtime_ns for mtime_ns, size in signature) // 10**9
+        body = build()
+        with stage('compress'):
+            entry = CachedResponse(body, signature, last_modified, self.compress)
+        self._memory.put(key, entry)
+        return entry
+
+    def clear(self):
+        self._memory.clear()
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_GZIP)
+range_cache = ResponseCache(settings.RANGE_CACHE_SIZE, settings.RESPONSE_CACHE_GZIP, 'range')
+tile_cache = ResponseCache(settings.TILE_CACHE_SIZE, settings.RESPONSE_CACHE_GZIP, 'tile')
@@ -0,0 +1,142 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+from .geojson import encode_bytes, encode_column
+from .models import layer_geojson
+from .spatial import select_rows
+from .timing import timed
+
+# Response formats for map layers and their media types
+FORMAT_TYPES = {
+    'geojson': 'application/json',
+    'columns': 'application/vnd.cors-dashboard.columns+json',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+
+def layer_table(layer, viewport=None):
+    """
+    Flatten a map Layer into one table of parallel columns: the point
+    groups' properties, "lon"/"lat" and, where present,
+    "Lon_Uncertainty"/"Lat_Uncertainty". Columns a group does not have
+    are missing (None/NaN) for its rows.
+
+    Only rows inside viewport are kept; columnar formats are never
+    clustered. Returns (row count, {name: array}).
+    """
+    parts = []
+    for group in layer.groups:
+        rows = select_rows(viewport, group.lon, group.lat, group.index, group.mask)
+        members = list(group.properties) + [("lon", group.lon), ("lat", group.lat)]
+        if group.uncertainty is not None:
+            members += [("Lon_Uncertainty", group.uncertainty[0]), ("Lat_Uncertainty", group.uncertainty[1])]
+        parts.append((len(rows), {
+            name: np.full(len(rows), value, dtype=object) if np.ndim(value) == 0 else np.asarray(value)[rows]
+            for name, value in members
+        }))
+
+    names = list(dict.fromkeys(name for _, part in parts for name in part))
+    count = sum(length for length, _ in parts)
+    table = {}
+    for name in names:
+        pieces = [part.get(name) for _, part in parts]
+        # A numeric column is padded with NaN, anything else with None
+        numeric = all(piece.dtype.kind in 'fiu' for piece in pieces if piece is not None)
+        pad = np.nan if numeric else None
+        pieces = [np.full(length, pad, dtype=float if numeric else object) if piece is None else piece
+                  for (length, _), piece in zip(parts, pieces)]
+        table[name] = np.concatenate(pieces) if pieces else np.array([], dtype=object)
+    return count, table
+
+
+def encode_json_column(values):
+    """
+    Encode a column as a JSON array, with missing values as null.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        encoded = encode_column(values)
+        for i in np.flatnonzero(np.isnan(values)):
+            encoded[i] = 'null'
+    else:
+        encoded = encode_column(values)
+        for i in np.flatnonzero(pd.isna(values)):
+            encoded[i] = 'null'
+    return '[' + ','.join(encoded) + ']'
+
+
+def encode_columns(layer, viewport=None):
+    """
+    Encode a Layer as compact columnar JSON: the layer's members (e.g.
+    status_count), "count" and "columns": {name: [...]}.
+    """
+    count, table = layer_table(layer, viewport)
+    head = json.dumps({"type": "LayerColumns", **layer.members, "count": count},
+                      ensure_ascii=False, separators=(',', ':'))
+    columns = ','.join(json.dumps(name) + ':' + encode_json_column(values) for name, values in table.items())
+    return (head[:-1] + ',"columns":{' + columns + '}}').encode('utf-8')
+
+
+def arrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def encode_arrow(layer, viewport=None):
+    """
+    Encode a Layer as an Apache Arrow IPC stream with the columns of
+    layer_table. Repetitive text columns (e.g. STATUS) are
+    dictionary-encoded, and the layer's members are stored as JSON in
+    the schema metadata under b"members".
+
+    pyarrow is optional; this raises ImportError without it.
+    """
+    import pyarrow as pa
+
+    count, table = layer_table(layer, viewport)
+    arrays = {}
+    for name, values in table.items():
+        array = pa.array(values, from_pandas=True)
+        if pa.types.is_string(array.type) and len(values) and len(set(values.tolist())) * 2 < len(values):
+            array = array.dictionary_encode()
+        arrays[name] = array
+    arrow_table = pa.table(arrays).replace_schema_metadata({'members': json.dumps(layer.members)})
+
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    return sink.getvalue().to_pybytes()
+
+
+@timed('encode')
+def encode_layer_body(layer, viewport=None, response_format='geojson'):
+    """
+    Encode a Layer in one of FORMAT_TYPES as response bytes.
+    """
+    if response_format == 'columns':
+        return encode_columns(layer, viewport)
+    if response_format == 'arrow':
+        return encode_arrow(layer, viewport)
+    return encode_bytes(layer_geojson(layer, viewport))
+
+
+def encode_history(dataset, site, df, date_column):
+    """
+    Encode one site's rows of a CSV dataset as compact columnar JSON:
+    {"dataset", "site", "count", "columns": {name: [...]}}, with the date
+    column as YYYY-MM-DD strings and missing values as null.
+    """
+    head = json.dumps({"dataset": dataset, "site": site, "count": len(df)},
+                      ensure_ascii=False, separators=(',', ':'))
+    columns = []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if name == date_column:
+            values = np.datetime_as_string(values.astype('datetime64[D]'), unit='D').astype(object)
+        columns.append(json.dumps(name) + ':' + encode_json_column(values))
+    return (head[:-1] + ',"columns":{' + ','.join(columns) + '}}').encode('utf-8')
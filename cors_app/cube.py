@@ -0,0 +1,194 @@
+import glob
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+
+import numpy as np
+
+from .cache import STACOV_SIDECAR_FORMAT, cache_path, file_signature, load_stacov, publish_version
+from .geojson import encode_column
+
+STACOV_SUFFIX = 'NOAM4.0_ambres_nfx20.stacov'
+
+# Cube field -> read_stacov column
+CUBE_FIELDS = {
+    'latitude': 'Latitude',
+    'longitude': 'Longitude',
+    'height': 'Height',
+    'x': 'X',
+    'y': 'Y',
+    'z': 'Z',
+    'sigma_x': 'Sigma X',
+    'sigma_y': 'Sigma Y',
+    'sigma_z': 'Sigma Z',
+}
+
+
+def stacov_files(static_dir):
+    """
+    Return the daily STACOV files in static_dir, in date order.
+    """
+    paths = glob.glob(os.path.join(static_dir, '*' + STACOV_SUFFIX))
+    return sorted(paths, key=stacov_day)
+
+
+def stacov_day(file_path):
+    """
+    Days since 1970-01-01 for a STACOV file, from its name (e.g. '24apr16').
+    """
+    date = datetime.strptime(os.path.basename(file_path)[:7], '%y%b%d').date()
+    return int(np.datetime64(date, 'D').astype(np.int64))
+
+
+class StationCube:
+    """
+    Every STACOV solution as day x station arrays, one .npy file per
+    field, memory-mapped so all workers share one copy through the page
+    cache.
+
+    Stations are the union over all days, sorted by code; a station with
+    no solution on a day is NaN there. A day range is a contiguous block
+    of rows, so reading one touches only those days.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        self.days = np.load(os.path.join(path, 'days.npy'))
+        self.stations = np.load(os.path.join(path, 'stations.npy'))
+        self.fields = {
+            field: np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r') for field in CUBE_FIELDS
+        }
+
+    def day_range(self, start_day, end_day):
+        """
+        Return the (start, stop) row range for days start_day..end_day
+        inclusive.
+        """
+        return (int(np.searchsorted(self.days, start_day, side='left')),
+                int(np.searchsorted(self.days, end_day, side='right')))
+
+    def station_index(self, codes):
+        """
+        Column of each station code, or -1 where the code is unknown.
+        """
+        codes = np.asarray(codes, dtype=str)
+        if len(self.stations) == 0:
+            return np.full(len(codes), -1)
+        pos = np.minimum(np.searchsorted(self.stations, codes), len(self.stations) - 1)
+        return np.where(self.stations[pos] == codes, pos, -1)
+
+    def query(self, start_day, end_day, stations=None, fields=None):
+        """
+        Return (days, stations, {field: 2-D array}) for a day range and
+        optional station list. Unknown stations are kept, with NaN
+        values, so the columns line up with the request.
+        """
+        start, stop = self.day_range(start_day, end_day)
+        fields = list(CUBE_FIELDS) if fields is None else fields
+        days = self.days[start:stop]
+
+        if stations is None:
+            codes = self.stations
+            values = {field: np.asarray(self.fields[field][start:stop]) for field in fields}
+        else:
+            codes = np.asarray(stations, dtype=str)
+            index = self.station_index(codes)
+            known = index >= 0
+            values = {}
+            for field in fields:
+                block = np.full((stop - start, len(codes)), np.nan)
+                block[:, known] = self.fields[field][start:stop][:, index[known]]
+                values[field] = block
+        return days, codes, values
+
+
+def write_cube(path, file_paths):
+    """
+    Parse every STACOV file (through the sidecar cache) into the
+    StationCube layout at path.
+    """
+    days = np.array([stacov_day(file_path) for file_path in file_paths], dtype=np.int64)
+    frames = [load_stacov(file_path)[2] for file_path in file_paths]
+    names = [frame['Station Name'].to_numpy(dtype=str) for frame in frames]
+    stations = np.unique(np.concatenate(names)) if names else np.array([], dtype='U4')
+
+    os.makedirs(path)
+    for field, column in CUBE_FIELDS.items():
+        values = np.full((len(days), len(stations)), np.nan)
+        for row, (frame, codes) in enumerate(zip(frames, names)):
+            values[row, np.searchsorted(stations, codes)] = frame[column].to_numpy()
+        np.save(os.path.join(path, f'{field}.npy'), values)
+
+    np.save(os.path.join(path, 'days.npy'), days)
+    np.save(os.path.join(path, 'stations.npy'), stations)
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'files': [os.path.basename(file_path) for file_path in file_paths],
+                   'fields': list(CUBE_FIELDS)}, meta_file)
+
+
+def cube_version(file_paths):
+    """
+    Identify the set of STACOV files (names, mtimes and sizes) a cube is
+    built from, and the sidecar format they were parsed into.
+    """
+    digest = hashlib.sha1(f'format:{STACOV_SIDECAR_FORMAT}\n'.encode('utf-8'))
+    for file_path in file_paths:
+        mtime_ns, size = file_signature(file_path)
+        digest.update(f'{os.path.basename(file_path)}:{mtime_ns}:{size}\n'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+_cube = None
+_cube_lock = threading.Lock()
+
+
+def load_cube(static_dir):
+    """
+    Return the StationCube for the STACOV files currently in static_dir,
+    building it on first use and again whenever a file is added or
+    changes.
+    """
+    global _cube
+    file_paths = stacov_files(static_dir)
+    path = cache_path('cube', cube_version(file_paths))
+    cube = _cube
+    if cube is not None and cube.path == path:
+        return cube
+
+    with _cube_lock:
+        if _cube is not None and _cube.path == path:
+            return _cube
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            publish_version(path, lambda tmp_path: write_cube(tmp_path, file_paths))
+        _cube = StationCube(path)
+        return _cube
+
+
+def encode_matrix(values):
+    """
+    Encode a 2-D float array as a JSON array of rows, with NaN as null.
+    """
+    rows = []
+    for row in values:
+        encoded = encode_column(row)
+        for i in np.flatnonzero(np.isnan(row)):
+            encoded[i] = 'null'
+        rows.append('[' + ','.join(encoded) + ']')
+    return '[' + ','.join(rows) + ']'
+
+
+def encode_range(days, stations, values):
+    """
+    Encode a StationCube.query result as compact columnar JSON:
+    {"days": [...], "stations": [...], "fields": {name: [[...], ...]}},
+    where fields[name][i][j] is the value for days[i] and stations[j].
+    """
+    dates = np.asarray(days, dtype='datetime64[D]').astype(str)
+    fields = ','.join(json.dumps(field) + ':' + encode_matrix(block) for field, block in values.items())
+    return ('{"days":[' + ','.join(encode_column(dates)) + ']'
+            + ',"stations":[' + ','.join(encode_column(stations)) + ']'
+            + ',"fields":{' + fields + '}}').encode('utf-8')
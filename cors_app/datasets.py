@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .cache import cache_path, publish_version
+from .timing import stage
+
+# CSV datasets served by StacovJsonView, with the date column each builder
+# filters on, the options it parses that column with and the column
+# naming the site of each row
+DATASETS = {
+    'mycs2_predictions': {
+        'file_name': 'mycs2_predictions.csv',
+        'date_column': 'Date',
+        'date_options': {'dayfirst': True},
+        'site_column': 'Station',
+    },
+    'opusnet': {
+        'file_name': 'opusnet_converted_corrected.csv',
+        'date_column': 'measurement_date',
+        'date_options': {'dayfirst': True},
+        'site_column': 'site_id',
+    },
+    'mycs2_uncertainty': {
+        'file_name': 'mycs2_uncertainty.csv',
+        'date_column': 'Date',
+        'date_options': {'dayfirst': True, 'format': '%Y-%m-%d'},
+        'site_column': 'Code',
+    },
+}
+
+# Bumped whenever the on-disk table layout changes, so tables written by
+# an older version are rebuilt
+TABLE_FORMAT = 2
+
+
+def day_number(date):
+    """
+    Days since 1970-01-01 for a date, datetime or date string.
+    """
+    return int(np.datetime64(pd.to_datetime(date).date(), 'D').astype(np.int64))
+
+
+class PartitionedTable:
+    """
+    A CSV dataset stored column by column in .npy files, with rows sorted
+    by day and a day -> row-range index. Columns are memory-mapped, so
+    reading one day touches only that day's rows.
+
+    Text columns are stored as fixed-width strings with a separate mask
+    for missing values. The date column is stored already parsed.
+
+    A secondary index lists the rows again sorted by site (and by day
+    within a site), with a site -> range index into that list, so one
+    site's history is found by binary search as well.
+
+    Every file is mapped when the table is opened, so a table stays
+    readable after a newer version has replaced its directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        self.columns = self.meta['columns']
+        self.days = np.load(os.path.join(path, 'days.npy'))
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'))
+        self.sites = np.load(os.path.join(path, 'sites.npy'))
+        self.site_offsets = np.load(os.path.join(path, 'site_offsets.npy'))
+        self.site_rows = np.load(os.path.join(path, 'site_rows.npy'), mmap_mode='r')
+        self._arrays = {
+            column: np.load(os.path.join(path, f'column_{i}.npy'), mmap_mode='r')
+            for i, column in enumerate(self.columns)
+        }
+        self._missing = {
+            column: np.load(os.path.join(path, f'column_{i}_na.npy'), mmap_mode='r')
+            for i, column in enumerate(self.columns) if os.path.exists(os.path.join(path, f'column_{i}_na.npy'))
+        }
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def array(self, column):
+        return self._arrays[column]
+
+    def missing(self, column):
+        return self._missing.get(column)
+
+    def day_range(self, date):
+        """
+        Return the (start, stop) row range holding the rows for date.
+        """
+        day = day_number(date)
+        i = np.searchsorted(self.days, day)
+        if i == len(self.days) or self.days[i] != day:
+            return 0, 0
+        return int(self.offsets[i]), int(self.offsets[i + 1])
+
+    def read_rows(self, start, stop):
+        """
+        Materialize rows [start, stop) as a DataFrame with the CSV's columns.
+        """
+        return self.take(slice(start, stop))
+
+    def take(self, rows):
+        """
+        Materialize the rows selected by rows (a slice or an index array)
+        as a DataFrame with the CSV's columns.
+        """
+        data = {}
+        for column in self.columns:
+            values = np.asarray(self.array(column)[rows])
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                missing = self.missing(column)
+                if missing is not None:
+                    values[np.asarray(missing[rows])] = np.nan
+            data[column] = values
+        return pd.DataFrame(data, columns=self.columns)
+
+    def site_history(self, site, start=None, end=None):
+        """
+        Return the row numbers of one site's rows in day order, limited to
+        start <= day <= end when those are given. Two binary searches find
+        the site, two more the date window.
+        """
+        i = np.searchsorted(self.sites, site)
+        if i == len(self.sites) or self.sites[i] != site:
+            return np.array([], dtype=np.int64)
+        rows = self.site_rows[self.site_offsets[i]:self.site_offsets[i + 1]]
+
+        # Rows are ordered by day, so a day window is a row number window
+        first, last = 0, len(rows)
+        if start is not None:
+            first = np.searchsorted(rows, self.offsets[np.searchsorted(self.days, day_number(start))])
+        if end is not None:
+            last = np.searchsorted(rows, self.offsets[np.searchsorted(self.days, day_number(end), side='right')])
+        return np.asarray(rows[first:max(first, last)])
+
+    def read_day(self, date):
+        with stage('read_day'):
+            return self.read_rows(*self.day_range(date))
+
+    def read_site(self, site, start=None, end=None):
+        with stage('read_site'):
+            return self.take(self.site_history(site, start, end))
+
+
+def write_table(path, df, date_column, date_options, site_column):
+    """
+    Convert a DataFrame read from one of the DATASETS CSVs into the
+    PartitionedTable layout at path.
+    """
+    dates = pd.to_datetime(df[date_column], errors='coerce', **date_options)
+    # Rows whose date does not parse can never match a requested day
+    keep = dates.notna().to_numpy()
+    day_numbers = dates.to_numpy()[keep].astype('datetime64[D]').astype(np.int64)
+    order = np.argsort(day_numbers, kind='stable')
+    day_numbers = day_numbers[order]
+    df = df.iloc[np.flatnonzero(keep)[order]]
+
+    days, starts = np.unique(day_numbers, return_index=True)
+    offsets = np.append(starts, len(day_numbers)).astype(np.int64)
+
+    os.makedirs(path)
+    columns = [str(column) for column in df.columns]
+    for i, column in enumerate(df.columns):
+        if column == date_column:
+            values = dates.to_numpy()[keep][order]
+        else:
+            values = df[column].to_numpy()
+        if values.dtype == object:
+            missing = pd.isna(values)
+            if missing.any():
+                np.save(os.path.join(path, f'column_{i}_na.npy'), missing)
+            values = np.where(missing, '', values).astype(str)
+        np.save(os.path.join(path, f'column_{i}.npy'), values)
+
+    np.save(os.path.join(path, 'days.npy'), days)
+    np.save(os.path.join(path, 'offsets.npy'), offsets)
+
+    # Secondary index: rows grouped by site, in day order within a site
+    site_ids = df[site_column].astype(str).to_numpy().astype(str)
+    site_rows = np.argsort(site_ids, kind='stable')
+    sites, site_starts = np.unique(site_ids[site_rows], return_index=True)
+    np.save(os.path.join(path, 'sites.npy'), sites)
+    np.save(os.path.join(path, 'site_offsets.npy'), np.append(site_starts, len(site_rows)).astype(np.int64))
+    np.save(os.path.join(path, 'site_rows.npy'), site_rows.astype(np.int64))
+
+    with open(os.path.join(path, 'meta.json'), 'w') as meta_file:
+        json.dump({'columns': columns, 'date_column': date_column, 'rows': len(df)}, meta_file)
+
+
+def table_path(name, version):
+    digest = hashlib.sha1(f'{TABLE_FORMAT}:{version}'.encode('utf-8')).hexdigest()[:16]
+    return cache_path('datasets', name, digest)
+
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def load_table(name, version, open_source):
+    """
+    Return the PartitionedTable for one version of a dataset, ingesting it
+    from open_source() (a callable returning the CSV as a file object or
+    path) the first time that version is seen.
+
+    version identifies the source object, e.g. its S3 ETag. Once a new
+    version has been written, versions before the previous one are removed.
+    """
+    key = (name, version)
+    table = _tables.get(key)
+    if table is not None:
+        return table
+
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None:
+            return table
+
+        path = table_path(name, version)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            ingest(name, open_source(), path)
+
+        table = PartitionedTable(path)
+        for stale in [k for k in _tables if k[0] == name]:
+            del _tables[stale]
+        _tables[key] = table
+        return table
+
+
+def ingest(name, source, path):
+    """
+    Parse a dataset's CSV from source and write it to path, replacing
+    tables built from earlier versions of the source (see
+    publish_version).
+    """
+    spec = DATASETS[name]
+    with stage('read_csv'):
+        df = pd.read_csv(source)
+    with stage('partition'):
+        publish_version(path, lambda tmp_path: write_table(tmp_path, df, spec['date_column'], spec['date_options'],
+                                                          spec['site_column']))
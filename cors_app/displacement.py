@@ -0,0 +1,84 @@
+import json
+
+import numpy as np
+
+from .geodesy import ecef_to_enu, enu_sigmas
+from .geojson import encode_column
+
+# Default threshold, in standard deviations, above which a station is
+# reported as having moved
+DEFAULT_SIGMA = 3.0
+
+# Columns of each day pair in a displacement response
+DISPLACEMENT_COLUMNS = ('east', 'north', 'up', 'sigma_east', 'sigma_north', 'sigma_up')
+
+
+def align_stations(names_before, names_after):
+    """
+    Join two days' station name arrays: returns (stations, before rows,
+    after rows) for the stations present on both days, sorted by name.
+    """
+    return np.intersect1d(np.asarray(names_before, dtype=str), np.asarray(names_after, dtype=str),
+                          return_indices=True)
+
+
+def station_displacement(before, after, stations=None):
+    """
+    Displacements between two read_stacov solutions, in metres in the
+    local east/north/up frame of each station's earlier position, with
+    standard deviations propagated from both days' formal ECEF sigmas.
+
+    stations optionally limits the result to the named stations. Returns
+    (stations, {column: array}) with the columns in DISPLACEMENT_COLUMNS.
+    """
+    names, rows_before, rows_after = align_stations(before['Station Name'], after['Station Name'])
+    if stations is not None:
+        keep = np.isin(names, np.asarray(stations, dtype=str))
+        names, rows_before, rows_after = names[keep], rows_before[keep], rows_after[keep]
+
+    def column(df, name, rows):
+        return df[name].to_numpy(dtype=float)[rows]
+
+    delta = [column(after, axis, rows_after) - column(before, axis, rows_before) for axis in ('X', 'Y', 'Z')]
+    sigma = [np.hypot(column(before, f'Sigma {axis}', rows_before), column(after, f'Sigma {axis}', rows_after))
+             for axis in ('X', 'Y', 'Z')]
+    lat = column(before, 'Latitude', rows_before)
+    lon = column(before, 'Longitude', rows_before)
+
+    values = ecef_to_enu(*delta, lat, lon) + enu_sigmas(*sigma, lat, lon)
+    return names, dict(zip(DISPLACEMENT_COLUMNS, values))
+
+
+def moved(columns, n_sigma):
+    """
+    Stations whose east, north or up displacement exceeds n_sigma of its
+    standard deviation.
+    """
+    return ((np.abs(columns['east']) > n_sigma * columns['sigma_east'])
+            | (np.abs(columns['north']) > n_sigma * columns['sigma_north'])
+            | (np.abs(columns['up']) > n_sigma * columns['sigma_up']))
+
+
+def encode_displacement(days, solutions, n_sigma=DEFAULT_SIGMA, stations=None, moved_only=False):
+    """
+    Day-over-day displacements of consecutive solutions as compact
+    columnar JSON: {"sigma": n_sigma, "pairs": [{"from", "to", "count",
+    "moved_count", "columns": {"station": [...], "east": [...], ...,
+    "moved": [...]}}]}. With moved_only, only the stations that moved
+    are listed.
+    """
+    pairs = []
+    for (day_before, before), (day_after, after) in zip(zip(days, solutions), zip(days[1:], solutions[1:])):
+        names, columns = station_displacement(before, after, stations)
+        flags = moved(columns, n_sigma)
+        head = {'from': day_before, 'to': day_after, 'count': len(names), 'moved_count': int(flags.sum())}
+        if moved_only:
+            names = names[flags]
+            columns = {name: values[flags] for name, values in columns.items()}
+            flags = flags[flags]
+
+        encoded = ['"station":[' + ','.join(encode_column(names)) + ']']
+        encoded += [json.dumps(name) + ':[' + ','.join(encode_column(values)) + ']' for name, values in columns.items()]
+        encoded.append('"moved":[' + ','.join('true' if flag else 'false' for flag in flags.tolist()) + ']')
+        pairs.append(json.dumps(head, separators=(',', ':'))[:-1] + ',"columns":{' + ','.join(encoded) + '}}')
+    return ('{"sigma":' + json.dumps(n_sigma) + ',"pairs":[' + ','.join(pairs) + ']}').encode('utf-8')
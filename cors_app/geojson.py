@@ -0,0 +1,136 @@
+import json
+import math
+from json.encoder import encode_basestring
+
+import numpy as np
+
+# Features joined into one chunk before it is handed to the response
+FEATURES_PER_CHUNK = 1000
+
+
+def encode_number(value):
+    """
+    Encode a number the way json.dumps does, including NaN/Infinity.
+    """
+    value = float(value)
+    if math.isfinite(value):
+        return repr(value)
+    if math.isnan(value):
+        return 'NaN'
+    return 'Infinity' if value > 0 else '-Infinity'
+
+
+def encode_value(value):
+    """
+    Encode a scalar property value (str, number, None or NumPy scalar).
+    """
+    if isinstance(value, str):
+        return encode_basestring(value)
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float):
+        return encode_number(value)
+    return json.dumps(value)
+
+
+def properties_template(*members):
+    """
+    Build a %-format template for a properties object from (name, value)
+    pairs. A value of None marks a per-row field left as a %s slot to be
+    filled with encode_value output; any other value is a constant encoded
+    into the template once.
+
+    >>> properties_template(("SITEID", None), ("STATUS", "Present"))
+    '{"SITEID":%s,"STATUS":"Present"}'
+    """
+    parts = []
+    for name, value in members:
+        encoded = '%s' if value is None else encode_value(value).replace('%', '%%')
+        parts.append(encode_basestring(name).replace('%', '%%') + ':' + encoded)
+    return '{' + ','.join(parts) + '}'
+
+
+def encode_column(values):
+    """
+    Encode a whole column (array or Series) into a list of JSON literals,
+    one per row.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        encoded = list(map(float.__repr__, values.tolist()))
+        for i in np.flatnonzero(~np.isfinite(values)):
+            encoded[i] = encode_number(values[i])
+        return encoded
+    if values.dtype.kind in 'iu':
+        return list(map(int.__repr__, values.tolist()))
+    items = values.tolist()
+    try:
+        return list(map(encode_basestring, items))
+    except TypeError:
+        # Mixed column, e.g. strings with missing (NaN) entries
+        return list(map(encode_value, items))
+
+
+def point_features(properties, lon, lat, uncertainty=None):
+    """
+    Encode Point features column-wise from whole arrays.
+
+    properties is a sequence of (name, value) pairs where value is either
+    a column with one entry per feature or a constant shared by every
+    feature. lon and lat are coordinate columns; uncertainty, if given, is
+    a (lon, lat) pair of columns stored on the geometry as the dashboard
+    expects. Each column is encoded once and the features are produced by
+    filling a single template, so no per-row objects are built.
+    """
+    members = []
+    columns = []
+    for name, value in properties:
+        if np.ndim(value) == 0:
+            members.append((name, value))
+        else:
+            members.append((name, None))
+            columns.append(encode_column(value))
+
+    template = '{"type":"Feature","properties":' + properties_template(*members)
+    template += ',"geometry":{"type":"Point","coordinates":[%s,%s]'
+    columns += [encode_column(lon), encode_column(lat)]
+    if uncertainty is not None:
+        template += ',"Uncertainty":[%s,%s]'
+        columns += [encode_column(uncertainty[0]), encode_column(uncertainty[1])]
+    template += '}}'
+
+    return map(template.__mod__, zip(*columns))
+
+
+def encode_feature_collection(features, **members):
+    """
+    Yield a FeatureCollection as compact JSON text chunks.
+
+    features is an iterable of encoded features (see point_features)
+    and members are the extra top-level keys, written in the given order
+    between "type" and "features". Nothing is buffered beyond one chunk of
+    FEATURES_PER_CHUNK features, so the result can feed a
+    StreamingHttpResponse directly.
+    """
+    head = json.dumps({"type": "FeatureCollection", **members}, ensure_ascii=False, separators=(',', ':'))
+    yield head[:-1] + ',"features":['
+
+    batch = []
+    separator = ''
+    for feature in features:
+        batch.append(feature)
+        if len(batch) == FEATURES_PER_CHUNK:
+            yield separator + ','.join(batch)
+            separator = ','
+            batch = []
+    if batch:
+        yield separator + ','.join(batch)
+
+    yield ']}'
+
+
+def encode_bytes(chunks):
+    """
+    Join encoded chunks into the final UTF-8 response body.
+    """
+    return ''.join(chunks).encode('utf-8')
@@ -0,0 +1,294 @@
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from glob import glob
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from cors_app import views
+from cors_app.artifacts import artifact_store
+from cors_app.cache import response_cache, stacov_cache
+from cors_app.cube import STACOV_SUFFIX
+from cors_app.management.commands.loadtest import LocalS3Client
+from cors_app.models import (
+    ecef_to_llh, generate_CSV_geojson, generate_MYCS2_geojson, generate_MYCS_uncertainty_geojson,
+    generate_OPUSNET_geojson, generate_geojson, read_stacov,
+)
+from cors_app.registry import SiteRegistry
+from cors_app.storage import S3Storage
+
+BENCHMARK_DATE = datetime(2024, 4, 16)
+ECEF_SIZES = (1_000, 10_000, 100_000)
+
+# Every StacovJsonView option, with the short name used in results
+OPTIONS = {
+    'stacov': 'Static JSON + STACOV File',
+    'initial_load': 'Initial Load',
+    'site_info': 'Over All Site Info',
+    'mycs2': 'Over All Vs MYCS2',
+    'opusnet': 'OPUSNET Data',
+    'mycs_uncertainty': 'MYCS Uncertainty',
+}
+
+
+def static_path(file_name):
+    return os.path.join(settings.BASE_DIR, 'static', file_name)
+
+
+def dataset_frames():
+    """
+    The OPUSNET CSV plus MYCS2 prediction and uncertainty frames derived
+    from it, so every dataset option has data for the same days whether
+    or not the real MYCS2 files are at hand.
+    """
+    opusnet = pd.read_csv(static_path('opusnet_converted_corrected.csv'))
+    dates = pd.to_datetime(opusnet['measurement_date'], dayfirst=True, errors='coerce')
+    mycs2 = pd.DataFrame({
+        'Date': dates.dt.strftime('%d/%m/%Y'), 'Station': opusnet['site_id'],
+        'Latitude': opusnet['latitude'] + 0.001, 'Longitude': opusnet['longitude'] - 0.002,
+    })
+    uncertainty = pd.DataFrame({
+        'Date': dates.dt.strftime('%Y-%m-%d'), 'Code': opusnet['site_id'],
+        'Latitude': opusnet['latitude'], 'Longitude': opusnet['longitude'],
+        'Lat_Uncertainty': opusnet['lat_uncertain'], 'Lon_Uncertainty': opusnet['lon_uncertain'],
+    })
+    return {'opusnet': opusnet, 'mycs2_predictions': mycs2, 'mycs2_uncertainty': uncertainty}
+
+
+def scaled(df, scale):
+    return pd.concat([df] * scale, ignore_index=True) if scale > 1 else df
+
+
+def scaled_sites(scale):
+    df = scaled(pd.read_csv(static_path('site_id.csv')), scale)
+    with open(static_path('CORS_All_Site_data.json')) as cors_file:
+        return SiteRegistry(df, json.load(cors_file)['features'])
+
+
+def synthetic_ecef(size, seed=0):
+    """
+    size ECEF positions: the bundled stations repeated with centimetre
+    noise, so the conversion sees realistic coordinates.
+    """
+    with open(static_path(f'24apr16{STACOV_SUFFIX}'), 'rb') as file:
+        df_xyz = read_stacov(file)[2]
+    xyz = df_xyz[['X', 'Y', 'Z']].to_numpy()
+    xyz = np.resize(xyz, (size, 3)) + np.random.default_rng(seed).normal(0, 0.01, (size, 3))
+    return xyz[:, 0], xyz[:, 1], xyz[:, 2]
+
+
+def consume(chunks):
+    return sum(len(chunk) for chunk in chunks)
+
+
+def measure(func, repeat, setup=None, warmup=1):
+    """
+    Time func() repeat times after warmup untimed calls; setup(), if
+    given, runs untimed before each call.
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        func()
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+        'repeat': repeat,
+    }
+
+
+def parse_benchmarks():
+    paths = sorted(glob(static_path(f'*{STACOV_SUFFIX}')))
+
+    def read_all():
+        for path in paths:
+            with open(path, 'rb') as file:
+                read_stacov(file)
+
+    yield 'parse.read_stacov.all_files', {'files': len(paths)}, read_all, None
+    for size in ECEF_SIZES:
+        x, y, z = synthetic_ecef(size)
+        yield f'parse.ecef_to_llh.{size}', {'rows': size}, lambda x=x, y=y, z=z: ecef_to_llh(x, y, z), None
+
+
+def builder_benchmarks(scales):
+    with open(static_path(f'24apr16{STACOV_SUFFIX}'), 'rb') as file:
+        df_xyz = read_stacov(file)[2]
+    frames = dataset_frames()
+    sites = scaled_sites(1)
+
+    for scale in scales:
+        stacov_df = scaled(df_xyz, scale)
+        yield (f'build.generate_geojson.x{scale}', {'rows': len(stacov_df)},
+               lambda df=stacov_df: consume(generate_geojson(df, sites)), None)
+        scaled_registry = scaled_sites(scale)
+        yield (f'build.generate_CSV_geojson.x{scale}', {'rows': len(scaled_registry.code)},
+               lambda registry=scaled_registry: consume(generate_CSV_geojson(registry)), None)
+
+        # The dataset builders add a Date column, so each call gets a copy
+        for name, dataset, build in (
+            ('generate_MYCS2_geojson', 'mycs2_predictions',
+             lambda df: generate_MYCS2_geojson(df, BENCHMARK_DATE, sites)),
+            ('generate_OPUSNET_geojson', 'opusnet',
+             lambda df: generate_OPUSNET_geojson(df, BENCHMARK_DATE)),
+            ('generate_MYCS_uncertainty_geojson', 'mycs2_uncertainty',
+             lambda df: generate_MYCS_uncertainty_geojson(df, BENCHMARK_DATE)),
+        ):
+            df = scaled(frames[dataset], scale)
+            inputs = {}
+            yield (f'build.{name}.x{scale}', {'rows': len(df)},
+                   lambda build=build, inputs=inputs: consume(build(inputs['df'])),
+                   lambda df=df, inputs=inputs: inputs.update(df=df.copy()))
+
+
+def endpoint_benchmarks(source_dir):
+    """
+    StacovJsonView for every option, with the datasets served by a local
+    S3 stand-in that is revalidated on every request. "warm" is a worker
+    with populated caches; "cold_worker" clears the in-memory caches first
+    (files derived on disk are kept, as for a freshly started worker).
+    """
+    views.storage = S3Storage('benchmark', LocalS3Client(source_dir, 0), ttl=0, cache_dir='benchmark-s3')
+    client = Client()
+
+    def clear_memory():
+        response_cache._memory.clear()
+        artifact_store._memory.clear()
+        stacov_cache.clear()
+
+    for short_name, option in OPTIONS.items():
+        payload = {'input': {'options': option, 'date': BENCHMARK_DATE.strftime('%Y-%m-%dT%H:%M:%S.000Z')}}
+
+        def request(payload=payload):
+            response = client.post('/api/json/', payload, content_type='application/json')
+            if response.status_code != 200:
+                raise CommandError(f"{payload['input']['options']}: HTTP {response.status_code}")
+            return consume(response.streaming_content) if response.streaming else len(response.content)
+
+        yield f'e2e.{short_name}.warm', {}, request, None
+        yield f'e2e.{short_name}.cold_worker', {}, request, clear_memory
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    (name, baseline median, current median, ratio, regressed) for the
+    benchmarks present in both runs.
+    """
+    rows = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        ratio = result['median_s'] / previous['median_s'] if previous['median_s'] else float('inf')
+        rows.append((name, previous['median_s'], result['median_s'], ratio, ratio > threshold))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ("Benchmark STACOV parsing, the GeoJSON builders and StacovJsonView end to end, "
+            "optionally saving the results as JSON and comparing them with an earlier run.")
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--filter', action='append', default=[],
+                            help="Only run benchmarks whose name contains this text (repeatable).")
+        parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark.")
+        parser.add_argument('--scales', type=int, nargs='+', default=[1, 10],
+                            help="Replication factors for the builder inputs (e.g. 1 10 100).")
+        parser.add_argument('--output', metavar='FILE', help="Write the results to this JSON file.")
+        parser.add_argument('--compare', metavar='FILE', help="Compare with the results in this JSON file.")
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help="Median slowdown ratio reported as a regression (default: 1.2).")
+        parser.add_argument('--fail-on-regression', action='store_true',
+                            help="Exit with an error if any benchmark regressed.")
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError("--repeat must be at least 1")
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as baseline_file:
+                baseline = json.load(baseline_file)['results']
+
+        # Caches start empty in a scratch directory, so runs are comparable
+        work_dir = tempfile.mkdtemp(prefix='cors-benchmark-')
+        storage = views.storage
+        try:
+            source_dir = os.path.join(work_dir, 'bucket')
+            os.makedirs(source_dir)
+            for dataset, df in dataset_frames().items():
+                df.to_csv(os.path.join(source_dir, views.DATASETS[dataset]['file_name']), index=False)
+
+            with override_settings(CORS_CACHE_DIR=os.path.join(work_dir, 'cache')):
+                results = self.run_benchmarks(options, source_dir)
+        finally:
+            views.storage = storage
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pandas': pd.__version__,
+                'cpu_count': os.cpu_count(),
+                'machine': platform.machine(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+            with open(options['output'], 'w') as output_file:
+                json.dump(report, output_file, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            rows = compare(results, baseline, options['threshold'])
+            self.stdout.write(f"\n{'benchmark':<48} {'before ms':>10} {'after ms':>10} {'ratio':>7}")
+            for name, before, after, ratio, regressed in rows:
+                flag = '  REGRESSION' if regressed else ''
+                self.stdout.write(f"{name:<48} {before * 1000:>10.2f} {after * 1000:>10.2f} {ratio:>7.2f}{flag}")
+            regressions = [row[0] for row in rows if row[4]]
+            if regressions and options['fail_on_regression']:
+                raise CommandError(f"{len(regressions)} benchmark(s) regressed: {', '.join(regressions)}")
+
+    def run_benchmarks(self, options, source_dir):
+        suites = (parse_benchmarks(), builder_benchmarks(options['scales']), endpoint_benchmarks(source_dir))
+        results = {}
+        self.stdout.write(f"{'benchmark':<48} {'median ms':>10} {'min ms':>10}")
+        for suite in suites:
+            for name, info, func, setup in suite:
+                if options['filter'] and not any(text in name for text in options['filter']):
+                    continue
+                results[name] = {**info, **measure(func, options['repeat'], setup)}
+                self.stdout.write(f"{name:<48} {results[name]['median_s'] * 1000:>10.2f} "
+                                  f"{results[name]['min_s'] * 1000:>10.2f}")
+        return results
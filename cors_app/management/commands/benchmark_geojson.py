@@ -0,0 +1,174 @@
+import json
+import multiprocessing
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import django
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from cors_app.models import (
+    generate_CSV_geojson, generate_OPUSNET_geojson, generate_geojson, process_lat_lon, read_stacov,
+)
+from cors_app.registry import SiteRegistry
+
+STACOV_FILE = '24apr16NOAM4.0_ambres_nfx20.stacov'
+OPUSNET_DATE = datetime(2024, 4, 16)
+
+
+def static_path(file_name):
+    return os.path.join(settings.BASE_DIR, 'static', file_name)
+
+
+def legacy_render(features, **members):
+    """
+    The previous response path: pretty-printed string from the builder,
+    parsed back in the view, then re-encoded by DRF.
+    """
+    geojson = {"type": "FeatureCollection", **members, "features": features}
+    geojson_str = json.dumps(geojson, indent=4)
+    return JSONRenderer().render(json.loads(geojson_str))
+
+
+def legacy_stacov(df_xyz):
+    with open(static_path('CORS_All_Site_data.json')) as cors_file:
+        cors_data = json.load(cors_file)
+    cors_site_ids = {feature['properties']['SITEID'] for feature in cors_data['features']}
+    df_xyz_site_ids = set(df_xyz['Station Name'])
+    data = []
+    for index, row in df_xyz.iterrows():
+        data.append({
+            "type": "Feature",
+            "properties": {"SITEID": row['Station Name'], "STATUS": "Present"},
+            "geometry": {"type": "Point", "coordinates": [row['Longitude'], row['Latitude']]}
+        })
+    missing_sites = cors_site_ids - df_xyz_site_ids
+    for feature in cors_data['features']:
+        if feature['properties']['SITEID'] in missing_sites:
+            feature['properties']['STATUS'] = "Not Present"
+            data.append(feature)
+    return legacy_render(data, status_count=len(df_xyz_site_ids))
+
+
+def legacy_site_info(df):
+    df = process_lat_lon(df)
+    data = []
+    for index, row in df.iterrows():
+        data.append({
+            "type": "Feature",
+            "properties": {
+                "SITEID": row['Code'], "STATUS": "Present",
+                "Description": row['Description'], "DOMES": row['DOMES']
+            },
+            "geometry": {"type": "Point", "coordinates": [row['Lon'], row['Lat']]}
+        })
+    return legacy_render(data, status_count=len(df['Code']))
+
+
+def legacy_opusnet(df, input_date):
+    df['Date'] = pd.to_datetime(df['measurement_date'], dayfirst=True, errors='coerce')
+    filtered_df = df[df['Date'].dt.date == pd.to_datetime(input_date).date()]
+    data = []
+    for index, row in filtered_df.iterrows():
+        data.append({
+            "type": "Feature",
+            "properties": {"SITEID": row['site_id'], "STATUS": "Uncertainty"},
+            "geometry": {
+                "type": "Point",
+                "coordinates": [row['longitude'], row['latitude']],
+                "Uncertainty": [row['lon_uncertain'], row['lat_uncertain']]
+            }
+        })
+    return legacy_render(data, status_count=len(filtered_df['site_id']), uncertainty=True, mycs2_prediction=True)
+
+
+def streamed_size(chunks):
+    """
+    Consume encoder output the way StreamingHttpResponse does, one chunk
+    at a time, returning the number of bytes sent.
+    """
+    return sum(len(chunk.encode('utf-8')) for chunk in chunks)
+
+
+def load_input(case, scale):
+    if case == 'stacov':
+        with open(static_path(STACOV_FILE), 'rb') as file:
+            df_xyz = read_stacov(file)[2]
+        return (pd.concat([df_xyz] * scale, ignore_index=True), SiteRegistry.load())
+    if case == 'site_info':
+        df = pd.concat([pd.read_csv(static_path('site_id.csv'))] * scale, ignore_index=True)
+        with open(static_path('CORS_All_Site_data.json')) as cors_file:
+            sites = SiteRegistry(df, json.load(cors_file)['features'])
+        return (df, sites)
+    df = pd.read_csv(static_path('opusnet_converted_corrected.csv'))
+    return (pd.concat([df] * scale, ignore_index=True), OPUSNET_DATE)
+
+
+PATHS = {
+    'stacov': {
+        'legacy': lambda df_xyz, sites: len(legacy_stacov(df_xyz)),
+        'streaming': lambda df_xyz, sites: streamed_size(generate_geojson(df_xyz, sites)),
+    },
+    'site_info': {
+        'legacy': lambda df, sites: len(legacy_site_info(df)),
+        'streaming': lambda df, sites: streamed_size(generate_CSV_geojson(sites)),
+    },
+    'opusnet': {
+        'legacy': lambda df, date: len(legacy_opusnet(df, date)),
+        'streaming': lambda df, date: streamed_size(generate_OPUSNET_geojson(df, date)),
+    },
+}
+
+
+def run_case(case, path, scale, repeat):
+    """
+    Time one (case, path) pair in a fresh process so its peak RSS is not
+    polluted by the other path.
+    """
+    inputs = load_input(case, scale)
+    baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(repeat):
+        args = [arg.copy() if isinstance(arg, pd.DataFrame) else arg for arg in inputs]
+        start = time.perf_counter()
+        size = PATHS[case][path](*args)
+        timings.append(time.perf_counter() - start)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        'case': case,
+        'path': path,
+        'rows': len(inputs[0]),
+        'bytes': size,
+        'wall_s': min(timings),
+        'peak_rss_delta_mb': (peak_kb - baseline_kb) / 1024,
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare wall time and peak RSS of the legacy and streaming GeoJSON paths."
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--case', choices=sorted(PATHS), action='append',
+                            help="Builder to benchmark (default: all).")
+        parser.add_argument('--scale', type=int, default=1,
+                            help="Replicate each input frame this many times.")
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        cases = options['case'] or sorted(PATHS)
+        context = multiprocessing.get_context('spawn')
+        for case in cases:
+            for path in ('legacy', 'streaming'):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=django.setup) as pool:
+                    result = pool.submit(run_case, case, path, options['scale'], options['repeat']).result()
+                self.stdout.write(
+                    f"{result['case']:<10} {result['path']:<10} rows={result['rows']:<7} "
+                    f"bytes={result['bytes']:<9} wall={result['wall_s'] * 1000:9.1f} ms "
+                    f"peak_rss=+{result['peak_rss_delta_mb']:.1f} MB"
+                )
@@ -0,0 +1,22 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cors_app.cube import load_cube, stacov_files
+
+
+class Command(BaseCommand):
+    help = "Build the station x day cube served by api/range/ from the STACOV files."
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--static-dir', default=os.path.join(settings.BASE_DIR, 'static'),
+                            help="Directory holding the daily .stacov files.")
+
+    def handle(self, *args, **options):
+        if not stacov_files(options['static_dir']):
+            raise CommandError(f"No STACOV files in {options['static_dir']}")
+
+        cube = load_cube(options['static_dir'])
+        self.stdout.write(f"{len(cube.stations)} stations over {len(cube.days)} days -> {cube.path}")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cors_app.datasets import DATASETS, load_table
+from cors_app.storage import LocalStorage
+
+
+class Command(BaseCommand):
+    help = "Convert the S3 CSV datasets into date-partitioned columnar tables."
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*',
+                            help=f"Datasets to ingest: {', '.join(sorted(DATASETS))} (default: all).")
+        parser.add_argument('--source', metavar='DIR',
+                            help="Read the CSVs from this directory instead of the configured storage.")
+
+    def handle(self, *args, **options):
+        unknown = set(options['names']) - set(DATASETS)
+        if unknown:
+            raise CommandError(f"Unknown dataset(s): {', '.join(sorted(unknown))}")
+
+        if options['source']:
+            storage = LocalStorage(options['source'])
+        else:
+            from cors_app.views import storage
+
+        for name in options['names'] or sorted(DATASETS):
+            file_name = DATASETS[name]['file_name']
+            try:
+                obj = storage.fetch(file_name)
+            except FileNotFoundError as error:
+                raise CommandError(str(error))
+            table = load_table(name, obj.version, lambda: obj.path)
+
+            self.stdout.write(f"{name}: {len(table)} rows over {len(table.days)} days -> {table.path}")
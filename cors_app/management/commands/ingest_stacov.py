@@ -0,0 +1,151 @@
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import django
+import pandas as pd
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cors_app.cache import cache_path, file_signature, read_stacov_sidecar, stacov_cache, write_stacov_sidecar
+from cors_app.cube import STACOV_SUFFIX
+from cors_app.models import read_stacov
+
+
+def init_worker():
+    # Workers started with spawn rather than fork import Django afresh
+    django.setup()
+
+
+def stacov_paths(patterns):
+    """
+    STACOV files named by a list of files, directories (every STACOV file
+    inside) and glob patterns, without duplicates.
+    """
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += glob.glob(os.path.join(pattern, f'*{STACOV_SUFFIX}'))
+        else:
+            paths += glob.glob(pattern)
+    return sorted(set(os.path.abspath(path) for path in paths))
+
+
+def ingest_file(file_path, output_dir, force=False):
+    """
+    Parse one STACOV file into its .npz sidecar in output_dir, unless an
+    up-to-date one is already there. Returns (file_path, error, day,
+    station table, parsed) with error set instead of the rest for files
+    that could not be read.
+    """
+    try:
+        signature = file_signature(file_path)
+        sidecar = os.path.join(output_dir, os.path.basename(file_path) + '.npz')
+        result = None if force else read_stacov_sidecar(sidecar, signature)
+        parsed = result is None
+        if parsed:
+            with open(file_path, 'rb') as file:
+                result = read_stacov(file)
+        cdate, nsta, df_xyz = result
+
+        # A truncated parameter block leaves stations without a name
+        if nsta == 0 or df_xyz['Station Name'].isna().any():
+            raise ValueError("incomplete parameter block")
+        day = datetime.strptime(cdate.rstrip('.'), '%y%b%d').date()
+        if parsed:
+            write_stacov_sidecar(sidecar, signature, cdate, nsta, df_xyz)
+
+        stations = df_xyz[['Station Name', 'Latitude', 'Longitude', 'Height']].copy()
+        return file_path, None, day, stations, parsed
+    except Exception as error:
+        return file_path, f'{type(error).__name__}: {error}', None, None, False
+
+
+def station_catalog(days):
+    """
+    Combine (day, station table) pairs into {station: {"first_day",
+    "last_day", "days", "latitude", "longitude", "height"}}, with the
+    coordinates of the station's latest day.
+    """
+    frames = [stations.assign(day=day.isoformat()) for day, stations in days]
+    if not frames:
+        return {}
+    df = pd.concat(frames, ignore_index=True).sort_values('day', kind='stable')
+    grouped = df.groupby('Station Name', sort=True)
+    summary = grouped.agg(first_day=('day', 'first'), last_day=('day', 'last'), days=('day', 'nunique'),
+                          latitude=('Latitude', 'last'), longitude=('Longitude', 'last'), height=('Height', 'last'))
+    return {str(station): {
+        'first_day': row.first_day,
+        'last_day': row.last_day,
+        'days': int(row.days),
+        'latitude': float(row.latitude),
+        'longitude': float(row.longitude),
+        'height': float(row.height),
+    } for station, row in summary.iterrows()}
+
+
+def write_catalog(path, catalog, days):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w') as tmp:
+        json.dump({'days': days, 'stations': catalog}, tmp, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+class Command(BaseCommand):
+    help = ("Parse STACOV files across a process pool into per-day .npz files (the sidecars "
+            "the server reads) and a combined station catalog.")
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=[os.path.join(settings.BASE_DIR, 'static')],
+                            help="STACOV files, directories or glob patterns (default: the static directory).")
+        parser.add_argument('--output', metavar='DIR',
+                            help="Where to write the .npz files and catalog.json "
+                                 "(default: the STACOV sidecar directory under CORS_CACHE_DIR).")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Worker processes (default: one per CPU).")
+        parser.add_argument('--force', action='store_true',
+                            help="Re-parse files even if their .npz output is up to date.")
+
+    def handle(self, *args, **options):
+        paths = stacov_paths(options['paths'])
+        if not paths:
+            raise CommandError(f"No STACOV files in {', '.join(options['paths'])}")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+        output_dir = options['output'] or cache_path(stacov_cache.sidecar_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+        started = time.perf_counter()
+        days, failed = [], []
+        parsed = stations = 0
+        chunksize = max(1, len(paths) // (options['workers'] * 8))
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+            results = pool.map(ingest_file, paths, [output_dir] * len(paths), [options['force']] * len(paths),
+                               chunksize=chunksize)
+            for file_path, error, day, table, was_parsed in results:
+                if error is not None:
+                    failed.append((file_path, error))
+                    continue
+                days.append((day, table))
+                parsed += was_parsed
+                stations += len(table)
+        elapsed = time.perf_counter() - started
+
+        catalog = station_catalog(days)
+        catalog_path = os.path.join(output_dir, 'catalog.json')
+        write_catalog(catalog_path, catalog, sorted({day.isoformat() for day, _ in days}))
+
+        for file_path, error in failed:
+            self.stderr.write(f"skipped {file_path}: {error}")
+        self.stdout.write(
+            f"{len(days)} files ({parsed} parsed, {len(days) - parsed} up to date, {len(failed)} skipped) "
+            f"in {elapsed:.2f}s with {options['workers']} workers: "
+            f"{len(days) / elapsed:.1f} files/s, {stations / elapsed:,.0f} stations/s"
+        )
+        self.stdout.write(f"{len(catalog)} stations -> {catalog_path}")
@@ -0,0 +1,107 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from cors_app import views
+from cors_app.storage import S3Storage
+
+
+class LocalS3Client:
+    """
+    S3 get_object stand-in that serves files from a local directory after
+    a fixed network latency and answers IfNoneMatch with 304.
+    """
+
+    def __init__(self, root, latency):
+        self.root = root
+        self.latency = latency
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        time.sleep(self.latency)
+        path = os.path.join(self.root, Key)
+        stat = os.stat(path)
+        etag = '"%s"' % hashlib.md5(f'{stat.st_mtime_ns}-{stat.st_size}'.encode()).hexdigest()
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        with open(path, 'rb') as file:
+            return {'Body': io.BytesIO(file.read()), 'ETag': etag}
+
+
+def summarize(latencies, elapsed):
+    latencies = np.array(latencies) * 1000
+    return len(latencies) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+class Command(BaseCommand):
+    help = "Compare throughput of the WSGI and ASGI JSON endpoints as concurrency grows."
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--option', default='OPUSNET Data', help="Layer to request.")
+        parser.add_argument('--date', default='2024-04-16T00:00:00.000Z')
+        parser.add_argument('--requests', type=int, default=64, help="Requests per concurrency level.")
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+        parser.add_argument('--wsgi-workers', type=int, default=4,
+                            help="Sync workers available to the WSGI path.")
+        parser.add_argument('--latency', type=float, default=0.05,
+                            help="Simulated S3 round-trip time in seconds.")
+        parser.add_argument('--source', default=os.path.join(settings.BASE_DIR, 'static'),
+                            help="Directory the local S3 stand-in serves objects from.")
+
+    @override_settings(ALLOWED_HOSTS=['testserver'])
+    def handle(self, *args, **options):
+        # Every request revalidates against the stand-in, as after TTL expiry
+        views.storage = S3Storage('loadtest', LocalS3Client(options['source'], options['latency']),
+                                  ttl=0, cache_dir='loadtest-s3')
+        payload = {'input': {'options': options['option'], 'date': options['date']}}
+
+        def wsgi_request(client):
+            start = time.perf_counter()
+            response = client.post('/api/json/', payload, content_type='application/json')
+            if response.streaming:
+                b''.join(response.streaming_content)
+            assert response.status_code == 200, response.status_code
+            return time.perf_counter() - start
+
+        async def asgi_run(concurrency, total):
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one():
+                async with semaphore:
+                    start = time.perf_counter()
+                    response = await client.post('/api/json/async/', payload, content_type='application/json')
+                    assert response.status_code == 200, response.status_code
+                    return time.perf_counter() - start
+
+            return await asyncio.gather(*(one() for _ in range(total)))
+
+        # Warm up caches and the partitioned table once
+        wsgi_request(Client())
+
+        self.stdout.write(f"{'path':<6} {'conc':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8}")
+        for concurrency in options['concurrency']:
+            workers = min(concurrency, options['wsgi_workers'])
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                clients = [Client() for _ in range(options['requests'])]
+                start = time.perf_counter()
+                latencies = list(pool.map(wsgi_request, clients))
+                elapsed = time.perf_counter() - start
+            self.stdout.write("{:<6} {:>5} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+                'wsgi', concurrency, *summarize(latencies, elapsed)))
+
+            start = time.perf_counter()
+            latencies = asyncio.run(asgi_run(concurrency, options['requests']))
+            elapsed = time.perf_counter() - start
+            self.stdout.write("{:<6} {:>5} {:>8.1f} {:>8.1f} {:>8.1f}".format(
+                'asgi', concurrency, *summarize(latencies, elapsed)))
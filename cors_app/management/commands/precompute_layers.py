@@ -0,0 +1,111 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cors_app.artifacts import artifact_store
+from cors_app.cache import cache_path
+from cors_app.columnar import FORMAT_TYPES, arrow_available, encode_layer_body
+from cors_app.cube import stacov_day, stacov_files
+from cors_app.datasets import DATASETS, load_table
+from cors_app.views import LAYER_DATASETS, TILE_LAYERS, layer_day, layer_source, source_versions, storage
+
+UNIX_EPOCH = datetime(1970, 1, 1)
+
+
+def init_worker():
+    # Workers started with spawn rather than fork import Django afresh
+    django.setup()
+
+
+def precompute_day(name, input_date, obj, formats, force=False):
+    """
+    Write the artifacts of one layer on one day in each of formats,
+    skipping formats already built from the current inputs. Returns
+    'built', 'skipped' or 'empty' (no data that day).
+    """
+    sources, make_layer = layer_source(name, input_date, obj)
+    versions = source_versions(obj)
+    day = layer_day(name, input_date)
+    missing = [fmt for fmt in formats if force or not artifact_store.exists(name, day, fmt, sources, versions)]
+    if not missing:
+        return 'skipped'
+
+    layer = make_layer()
+    if layer is None:
+        return 'empty'
+    for fmt in missing:
+        artifact_store.write(name, day, fmt, sources, encode_layer_body(layer, None, fmt), versions)
+    return 'built'
+
+
+class Command(BaseCommand):
+    help = ("Write every map layer, for every day with data, as a compressed artifact "
+            "that StacovJsonView serves instead of building the layer per request.")
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layers', nargs='+', choices=TILE_LAYERS, default=list(TILE_LAYERS),
+                            help="Layers to precompute (default: all).")
+        parser.add_argument('--formats', nargs='+', choices=sorted(FORMAT_TYPES), default=['geojson'],
+                            help="Response formats to write (default: geojson).")
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help="Worker processes (default: one per CPU).")
+        parser.add_argument('--force', action='store_true',
+                            help="Rebuild artifacts even if their inputs are unchanged.")
+
+    def layer_days(self, name):
+        """
+        (input_date, obj) for every day of a layer; obj is the dataset's
+        StoredObject, fetched once here rather than in every worker.
+        """
+        if name == 'sites':
+            return [(None, None)]
+        if name == 'stacov':
+            static_dir = os.path.join(settings.BASE_DIR, 'static')
+            return [(UNIX_EPOCH + timedelta(days=stacov_day(path)), None) for path in stacov_files(static_dir)]
+
+        dataset = LAYER_DATASETS[name]
+        try:
+            obj = storage.fetch(DATASETS[dataset]['file_name'])
+        except FileNotFoundError as error:
+            self.stderr.write(f"{name}: skipped, {error}")
+            return []
+        table = load_table(dataset, obj.version, lambda: obj.path)
+        return [(UNIX_EPOCH + timedelta(days=int(day)), obj) for day in table.days]
+
+    def handle(self, *args, **options):
+        formats = options['formats']
+        if 'arrow' in formats and not arrow_available():
+            raise CommandError("Arrow output needs pyarrow")
+        if options['workers'] < 1:
+            raise CommandError("--workers must be at least 1")
+
+        tasks = [(name, input_date, obj) for name in options['layers'] for input_date, obj in self.layer_days(name)]
+
+        started = time.perf_counter()
+        results = Counter()
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as pool:
+            futures = {
+                pool.submit(precompute_day, name, input_date, obj, formats, options['force']): (name, input_date)
+                for name, input_date, obj in tasks
+            }
+            for future, (name, input_date) in futures.items():
+                try:
+                    results[name, future.result()] += 1
+                except Exception as error:
+                    results[name, 'failed'] += 1
+                    self.stderr.write(f"{name} {layer_day(name, input_date) or ''}: {error}")
+        elapsed = time.perf_counter() - started
+
+        for name in options['layers']:
+            counts = ', '.join(f"{results[name, outcome]} {outcome}"
+                               for outcome in ('built', 'skipped', 'empty', 'failed') if results[name, outcome])
+            self.stdout.write(f"{name}: {counts or 'no days'}")
+        self.stdout.write(f"{len(tasks)} layer days in {elapsed:.1f}s with {options['workers']} workers "
+                          f"-> {cache_path(artifact_store.artifact_dir)}")
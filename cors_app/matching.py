@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+
+from .geodesy import ecef_to_enu, geodetic_to_ecef
+from .geojson import encode_column
+
+# How a prediction was paired with an observed site
+MATCH_CODE = 'code'
+MATCH_NEAREST = 'nearest'
+
+# Percentiles of the horizontal residual reported for a day
+RESIDUAL_PERCENTILES = (50, 90, 95)
+
+
+def match_sites(stations, lon, lat, sites, max_distance):
+    """
+    Pair each prediction with a site_id.csv row of the SiteRegistry: by
+    station code where the code is known, otherwise the nearest site no
+    more than max_distance metres away from its unrounded coordinates.
+
+    Returns (site rows, method), with -1 and None for predictions left
+    unmatched.
+    """
+    rows = sites.index_of(stations)
+    method = np.where(rows >= 0, MATCH_CODE, None).astype(object)
+    unknown = np.flatnonzero(rows < 0)
+    if len(unknown):
+        nearest, _ = sites.exact_index.nearest(np.asarray(lon, dtype=float)[unknown],
+                                               np.asarray(lat, dtype=float)[unknown], max_distance)
+        rows[unknown] = nearest
+        method[unknown[nearest >= 0]] = MATCH_NEAREST
+    return rows, method
+
+
+def horizontal_residuals(lon, lat, site_lon, site_lat):
+    """
+    East and north offsets (m) of predicted positions from the observed
+    ones, in the local frame of each observed site.
+    """
+    x, y, z = geodetic_to_ecef(lat, lon, 0)
+    site_x, site_y, site_z = geodetic_to_ecef(site_lat, site_lon, 0)
+    east, north, _ = ecef_to_enu(x - site_x, y - site_y, z - site_z, site_lat, site_lon)
+    return east, north
+
+
+def residual_summary(east, north):
+    """
+    Day-level statistics of the horizontal residuals (m): their mean,
+    RMS, maximum and RESIDUAL_PERCENTILES, plus the mean east and north
+    offsets (a systematic shift shows up there). Non-finite residuals
+    are left out.
+    """
+    residual = np.hypot(east, north)
+    finite = np.isfinite(residual)
+    residual, east, north = residual[finite], east[finite], north[finite]
+    if len(residual) == 0:
+        return {'count': 0}
+    summary = {
+        'count': len(residual),
+        'mean_m': float(residual.mean()),
+        'rms_m': float(np.sqrt(np.mean(residual * residual))),
+        'max_m': float(residual.max()),
+        'mean_east_m': float(east.mean()),
+        'mean_north_m': float(north.mean()),
+    }
+    for percentile, value in zip(RESIDUAL_PERCENTILES, np.percentile(residual, RESIDUAL_PERCENTILES)):
+        summary[f'p{percentile}_m'] = float(value)
+    return summary
+
+
+def encode_residuals(day, df, sites, max_distance):
+    """
+    One day of MYCS2 predictions (Station, Longitude, Latitude) matched
+    to the observed sites, as compact columnar JSON: {"date", "count",
+    "matched", "unmatched": [...], "summary": {...}, "columns":
+    {"station", "site", "match", "lon", "lat", "site_lon", "site_lat",
+    "east", "north", "residual"}}. Only matched predictions are listed
+    in columns; offsets are in metres, from the unrounded site
+    coordinates given as site_lon/site_lat.
+    """
+    stations = df['Station'].to_numpy(dtype=str)
+    lon = df['Longitude'].to_numpy(dtype=float)
+    lat = df['Latitude'].to_numpy(dtype=float)
+    rows, method = match_sites(stations, lon, lat, sites, max_distance)
+
+    matched = rows >= 0
+    rows = rows[matched]
+    site_lon, site_lat = sites.lon_exact[rows], sites.lat_exact[rows]
+    east, north = horizontal_residuals(lon[matched], lat[matched], site_lon, site_lat)
+    columns = {
+        'station': stations[matched],
+        'site': sites.code[rows],
+        'match': method[matched],
+        'lon': lon[matched],
+        'lat': lat[matched],
+        'site_lon': site_lon,
+        'site_lat': site_lat,
+        'east': east,
+        'north': north,
+        'residual': np.hypot(east, north),
+    }
+
+    head = json.dumps({
+        'date': day,
+        'count': len(stations),
+        'matched': int(matched.sum()),
+        'unmatched': stations[~matched].tolist(),
+        'summary': residual_summary(east, north),
+    }, separators=(',', ':'))
+    encoded = ','.join(json.dumps(name) + ':[' + ','.join(encode_column(values)) + ']'
+                       for name, values in columns.items())
+    return (head[:-1] + ',"columns":{' + encoded + '}}').encode('utf-8')
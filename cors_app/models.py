@@ -1,386 +1,266 @@
-import os
+import logging
+from collections import namedtuple
+from itertools import chain
+
 import numpy as np
 import pandas as pd
-import json
-from django.conf import settings
+from .geodesy import ecef_to_geodetic
+from .geojson import encode_feature_collection
+from .spatial import viewport_features
+from .timing import stage
 
-# Constants for WGS84
-a = 6378137.0         # Semi-major axis
-f = 1 / 298.257223563 # Flattening
-e2 = f * (2 - f)      # Square of eccentricity
+logger = logging.getLogger(__name__)
 
 def ecef_to_llh(x, y, z):
-    lon = np.arctan2(y, x)
-    p = np.sqrt(x**2 + y**2)
-    lat = np.arctan2(z, p * (1 - e2))
-    
-    for _ in range(5):
-        N = a / np.sqrt(1 - e2 * np.sin(lat)**2)
-        lat = np.arctan2(z + e2 * N * np.sin(lat), p)
-    
-    N = a / np.sqrt(1 - e2 * np.sin(lat)**2)
-    h = p / np.cos(lat) - N
-    
-    lat = np.degrees(lat)
-    lon = np.degrees(lon)
-    
-    return lat, lon, h
+    # Closed-form conversion; lat/lon in degrees, height in metres
+    return ecef_to_geodetic(x, y, z)
 
 def read_stacov(file):
-    content = file.read().decode("utf-8").splitlines()
-    header = content[0].strip()
-    n = int(header.split()[0])
-    nsta = n // 3
-    cdate = header.split()[-1]
-
-    station_names = []
-    xyz = np.zeros((3, nsta))
-    uncertainties = np.zeros((3, nsta))
+    """
+    Parse a STACOV file into station names and geodetic coordinates.
 
-    for i in range(n):
-        line = content[i + 1].strip()
-        parts = line.split()
+    The parameter block is decoded in one pass into columns, and all
+    stations are converted from ECEF to lat/lon/height in a single
+    array-wide call. The ECEF solution (X, Y, Z) and its formal
+    uncertainties (Sigma X/Y/Z, metres) are kept as extra columns.
+    """
+    header = file.readline().decode("utf-8").split()
+    n = int(header[0])
+    nsta = n // 3
+    cdate = header[-1]
 
-        param_num = int(parts[0])
-        station_name = parts[1]
-        coordinate = parts[3]
-        value = float(parts[4])
-        uncertainty_value = float(parts[6])
+    # Columns: parameter number, station, "STA", X/Y/Z, value, "+-", sigma
+    params = pd.read_csv(
+        file,
+        sep=r'\s+',
+        header=None,
+        nrows=n,
+        usecols=[0, 1, 3, 4, 6],
+        names=['param', 'station', 'coordinate', 'value', 'uncertainty'],
+        dtype={'param': np.int64, 'station': str, 'coordinate': str},
+        float_precision='round_trip',
+    )
 
-        station_index = (param_num - 1) // 3
-        coord_index = ['X', 'Y', 'Z'].index(coordinate[-1])
+    station_index = (params['param'].to_numpy() - 1) // 3
+    coord_index = pd.Categorical(
+        params['coordinate'].str[-1], categories=['X', 'Y', 'Z']
+    ).codes
+    if (coord_index < 0).any():
+        raise ValueError("Unexpected coordinate label in STACOV file")
 
-        if coord_index == 0:
-            station_names.append(station_name)
+    xyz = np.zeros((3, nsta))
+    uncertainties = np.zeros((3, nsta))
+    xyz[coord_index, station_index] = params['value'].to_numpy()
+    uncertainties[coord_index, station_index] = params['uncertainty'].to_numpy()
 
-        xyz[coord_index, station_index] = value
-        uncertainties[coord_index, station_index] = uncertainty_value
+    station_names = np.empty(nsta, dtype=object)
+    is_x = coord_index == 0
+    station_names[station_index[is_x]] = params['station'].to_numpy()[is_x]
 
-    latitudes = []
-    longitudes = []
-    heights = []
+    latitudes, longitudes, heights = ecef_to_llh(xyz[0], xyz[1], xyz[2])
 
-    for i in range(nsta):
-        lat, lon, h = ecef_to_llh(xyz[0, i], xyz[1, i], xyz[2, i])
-        latitudes.append(lat)
-        longitudes.append(lon)
-        heights.append(h)
-    
     df_xyz = pd.DataFrame({
         "Station Name": station_names,
         "Latitude": latitudes,
         "Longitude": longitudes,
-        "Height": heights
+        "Height": heights,
+        "X": xyz[0],
+        "Y": xyz[1],
+        "Z": xyz[2],
+        "Sigma X": uncertainties[0],
+        "Sigma Y": uncertainties[1],
+        "Sigma Z": uncertainties[2],
     })
 
     return cdate, nsta, df_xyz
 
-def generate_geojson(df_xyz):
-    file_name = "CORS_All_Site_data.json"
-    # Create the full file path
-    file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
-    
-    # Load CORS_All_Site_data.json for comparison
-    with open(file_path, 'r') as cors_file:
-        cors_data = json.load(cors_file)
-    
-    cors_site_ids = {feature['properties']['SITEID'] for feature in cors_data['features']}
-    df_xyz_site_ids = set(df_xyz['Station Name'])
-    
-    data = []
-    present_count = len(df_xyz_site_ids)
-
-    # Mark all df_xyz sites as "Present"
-    for index, row in df_xyz.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "SITEID": row['Station Name'],
-                "STATUS": "Present"
-            },
-            "geometry": {
-                "type": "Point",
-                "coordinates": [row['Longitude'], row['Latitude']]
-            }
-        }
-        data.append(feature)
-
-    # Mark remaining cors_site_ids not in df_xyz as "Not Present"
-    missing_sites = cors_site_ids - df_xyz_site_ids
-    
-    for feature in cors_data['features']:
-        if feature['properties']['SITEID'] in missing_sites:
-            feature['properties']['STATUS'] = "Not Present"
-            data.append(feature)
-
-    geojson = {
-        "type": "FeatureCollection",
-        "status_count": present_count,  # This counts only the sites marked as "Present"
-        "features": data
-    }
-    
-    return json.dumps(geojson, indent=4)
-
-def generate_CSV_geojson(df):
-    def dms_to_decimal(degrees, minutes, seconds):
-        """
-        Convert DMS (Degrees, Minutes, Seconds) to Decimal Degrees and round to 3 decimal places.
-        """
-        decimal_degrees = degrees + (minutes / 60) + (seconds / 3600)
-        return round(decimal_degrees, 3)
-
-    def convert_dms_string_to_decimal(dms_str, is_longitude=False):
-        """
-        Convert a DMS string (e.g., '50 47 52.1') into decimal degrees.
-        If it's longitude, adjust the value if it's in the 0-360 system.
-        """
-        dms_parts = dms_str.split()
-        degrees = int(dms_parts[0])
-        minutes = int(dms_parts[1])
-        seconds = float(dms_parts[2])
-        
-        decimal_degrees = dms_to_decimal(degrees, minutes, seconds)
-        
-        # If it's longitude and in the 0-360 range, convert to -180 to 180 range
-        if is_longitude and decimal_degrees > 180:
-            decimal_degrees -= 360
-            
-        return decimal_degrees
-
-    def process_lat_lon(df):
-        """
-        Convert all Lat and Lon columns from DMS to Decimal Degrees in the given DataFrame.
-        """
-        # Convert the Lon and Lat columns to decimal degrees and round them to 3 decimal points
-        df['Lon'] = df['Lon'].apply(lambda x: convert_dms_string_to_decimal(x, is_longitude=True))
-        df['Lat'] = df['Lat'].apply(convert_dms_string_to_decimal)
-        return df
-
-    # Process the DataFrame
-    df = process_lat_lon(df)
-    data = []
-    for index, row in df.iterrows():
-        feature = {
-            "type": "Feature",
-            "properties": {
-                "SITEID": row['Code'],
-                "STATUS": "Present",
-                "Description": row['Description'],
-                "DOMES": row['DOMES']
-            },
-            "geometry": {
-                "type": "Point",
-                "coordinates": [row['Lon'], row['Lat']]
-            }
-        }
-        data.append(feature)
-        present_count = len(df['Code'])
-        
-    geojson = {
-        "type": "FeatureCollection",
-        "status_count": present_count,  # This counts only the sites marked as "Present"
-        "features": data
-    }
-    return json.dumps(geojson, indent=4)
-
-def generate_MYCS2_geojson(df,input_date,df_1):
-    def filter_data_by_date(df,input_date,df_1):
-        def dms_to_decimal(degrees, minutes, seconds):
-            """
-            Convert DMS (Degrees, Minutes, Seconds) to Decimal Degrees and round to 3 decimal places.
-            """
-            decimal_degrees = degrees + (minutes / 60) + (seconds / 3600)
-            return round(decimal_degrees, 3)
-
-        def convert_dms_string_to_decimal(dms_str, is_longitude=False):
-            """
-            Convert a DMS string (e.g., '50 47 52.1') into decimal degrees.
-            If it's longitude, adjust the value if it's in the 0-360 system.
-            """
-            dms_parts = dms_str.split()
-            degrees = int(dms_parts[0])
-            minutes = int(dms_parts[1])
-            seconds = float(dms_parts[2])
-            
-            decimal_degrees = dms_to_decimal(degrees, minutes, seconds)
-            
-            # If it's longitude and in the 0-360 range, convert to -180 to 180 range
-            if is_longitude and decimal_degrees > 180:
-                decimal_degrees -= 360
-                
-            return decimal_degrees
-
-        def process_lat_lon(df):
-            """
-            Convert all Lat and Lon columns from DMS to Decimal Degrees in the given DataFrame.
-            """
-            # Convert the Lon and Lat columns to decimal degrees and round them to 3 decimal points
-            df['Lon'] = df['Lon'].apply(lambda x: convert_dms_string_to_decimal(x, is_longitude=True))
-            df['Lat'] = df['Lat'].apply(convert_dms_string_to_decimal)
-            return df
-
-        # Process the DataFrame
-        df_1 = process_lat_lon(df_1)
-        
-        # Convert the 'Date' column to datetime format, allowing pandas to infer the format
-        df['Date'] = pd.to_datetime(df['Date'], dayfirst=True, errors='coerce')  # Coerce will turn invalid formats into NaT
-        
-        # Convert the input date to a datetime object, ensuring it's only the date part
-        input_date = pd.to_datetime(input_date).date()
-        # Filter the dataframe for the rows where the date matches the input (ignoring the time)
-        filtered_df = df[df['Date'].dt.date == input_date]
-        
-        if filtered_df.empty:
-            print(f"No data found for the given date: {input_date.strftime('%Y-%m-%d')}")
-        else:
-            data = []
-            for index, row in filtered_df.iterrows():
-                feature = {
-                    "type": "Feature",
-                    "properties": {
-                        "SITEID": row['Station'],
-                        "STATUS": "MYCS2 Prediction"
-                    },
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [row['Longitude'],row['Latitude']]
-                    }
-                }
-                data.append(feature)
-            present_count = len(filtered_df['Station'])
-            for index, row in df_1.iterrows():
-                feature = {
-                    "type": "Feature",
-                    "properties": {
-                        "SITEID": row['Code'],
-                        "STATUS": "Observation",
-                        "Description": row['Description'],
-                        "DOMES": row['DOMES']
-                    },
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [row['Lon'], row['Lat']]
-                    }
-                }
-                data.append(feature)
-            geojson = {
-                "type": "FeatureCollection",
-                "status_count": present_count,  # This counts only the sites marked as "Present"
-                "mycs2_prediction": True,
-                "features": data
-            }
-
-            return json.dumps(geojson, indent=4)
-
-    filtered_data = filter_data_by_date(df,input_date,df_1)
-    return filtered_data
-
-def generate_OPUSNET_geojson(df,input_date,):
+# One set of points in a map layer: (name, value) properties as taken by
+# point_features, coordinate columns, optional (lon, lat) uncertainty
+# columns, and optionally a GridIndex over lon/lat and a row mask
+PointGroup = namedtuple('PointGroup', ['properties', 'lon', 'lat', 'uncertainty', 'index', 'mask'],
+                        defaults=[None, None, None])
+
+# A map layer: its point groups and the top-level GeoJSON members
+Layer = namedtuple('Layer', ['groups', 'members'])
+
+
+def layer_geojson(layer, viewport=None):
+    """
+    Encode a Layer as a GeoJSON FeatureCollection (None if the layer is).
+
+    Only features inside viewport (see spatial.viewport_features) are
+    encoded when one is given; the members, e.g. status_count, still
+    describe the whole layer.
+    """
+    if layer is None:
+        return None
+    features = chain.from_iterable(viewport_features(viewport, *group) for group in layer.groups)
+    return encode_feature_collection(features, **layer.members)
+
+def stacov_layer(df_xyz, sites):
+    """
+    Mark the stations in a STACOV day as "Present" and the remaining
+    CORS_All_Site_data.json sites (from the SiteRegistry) as "Not Present".
+    """
+    present_count = df_xyz['Station Name'].nunique()
+    missing = sites.missing_cors_sites(df_xyz['Station Name'])
+
+    groups = [
+        # Mark all df_xyz sites as "Present"
+        PointGroup(
+            [("SITEID", df_xyz['Station Name']), ("STATUS", "Present")],
+            df_xyz['Longitude'], df_xyz['Latitude']
+        ),
+        # Mark remaining CORS sites not in df_xyz as "Not Present"
+        PointGroup(
+            [("SITEID", sites.cors_siteid), ("STATUS", "Not Present")],
+            sites.cors_lon, sites.cors_lat, index=sites.cors_index, mask=missing
+        ),
+    ]
+
+    # status_count counts only the sites marked as "Present"
+    return Layer(groups, {'status_count': present_count})
+
+def generate_geojson(df_xyz, sites, viewport=None):
+    return layer_geojson(stacov_layer(df_xyz, sites), viewport)
+
+def dms_to_decimal(dms, is_longitude=False, rounded=True):
+    """
+    Convert a Series of DMS strings (e.g., '50 47 52.1') into decimal degrees
+    rounded to 3 decimal places (the full value if rounded is False).
+    Longitudes in the 0-360 system are moved to the -180 to 180 range.
+    """
+    parts = dms.str.split(expand=True)
+    decimal_degrees = parts[0].astype(int) + (parts[1].astype(int) / 60) + (parts[2].astype(float) / 3600)
+    if rounded:
+        # Python's round() is correctly rounded; np.round is not and would
+        # shift about 1% of the sites by one ulp
+        decimal_degrees = np.array([round(value, 3) for value in decimal_degrees.tolist()])
+    else:
+        decimal_degrees = decimal_degrees.to_numpy(dtype=float)
+    if is_longitude:
+        decimal_degrees = np.where(decimal_degrees > 180, decimal_degrees - 360, decimal_degrees)
+    return decimal_degrees
+
+def process_lat_lon(df):
+    """
+    Convert all Lat and Lon columns from DMS to Decimal Degrees in the given DataFrame.
+    """
+    df['Lon'] = dms_to_decimal(df['Lon'], is_longitude=True)
+    df['Lat'] = dms_to_decimal(df['Lat'])
+    return df
+
+def site_group(sites, status):
+    """
+    Every site_id.csv row in the SiteRegistry, with the given STATUS.
+    """
+    return PointGroup(
+        [("SITEID", sites.code), ("STATUS", status), ("Description", sites.description), ("DOMES", sites.domes)],
+        sites.lon, sites.lat, index=sites.site_index
+    )
+
+def site_info_layer(sites):
+    present_count = len(sites)
+
+    # status_count counts only the sites marked as "Present"
+    return Layer([site_group(sites, "Present")], {'status_count': present_count})
+
+def generate_CSV_geojson(sites, viewport=None):
+    return layer_geojson(site_info_layer(sites), viewport)
+
+def parse_dates(values, **options):
+    """
+    Parse a date column with pd.to_datetime, unless it already holds
+    datetimes as the day slices of a PartitionedTable do.
+    """
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values
+    with stage('to_datetime'):
+        return pd.to_datetime(values, **options)
+
+def mycs2_layer(df,input_date,sites):
     # Convert the 'Date' column to datetime format, allowing pandas to infer the format
-    df['Date'] = pd.to_datetime(df['measurement_date'], dayfirst=True, errors='coerce')  # Coerce will turn invalid formats into NaT
+    df['Date'] = parse_dates(df['Date'], dayfirst=True, errors='coerce')  # Coerce will turn invalid formats into NaT
+    
     # Convert the input date to a datetime object, ensuring it's only the date part
     input_date = pd.to_datetime(input_date).date()
     # Filter the dataframe for the rows where the date matches the input (ignoring the time)
     filtered_df = df[df['Date'].dt.date == input_date]
+    
     if filtered_df.empty:
-            print(f"No data found for the given date: {input_date.strftime('%Y-%m-%d')}")
-    else:
-        data = []
-        for index, row in filtered_df.iterrows():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "SITEID": row['site_id'],
-                    "STATUS": "Uncertainty"
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [row['longitude'],row['latitude']],
-                    "Uncertainty": [row['lon_uncertain'],row['lat_uncertain']]
-                }
-            }
-            data.append(feature)
-        present_count = len(filtered_df['site_id'])
-        geojson = {
-            "type": "FeatureCollection",
-            "status_count": present_count,  # This counts only the sites marked as "Present"
-            "uncertainty": True,
-            "mycs2_prediction": True,
-            "features": data
-        }
-
-        return json.dumps(geojson, indent=4)
-
-    return filtered_df
-
-def generate_MYCS_uncertainty_geojson(df,input_date,):
+        logger.debug("No data found for the given date: %s", input_date.strftime('%Y-%m-%d'))
+        return None
+
+    groups = [
+        PointGroup(
+            [("SITEID", filtered_df['Station']), ("STATUS", "MYCS2 Prediction")],
+            filtered_df['Longitude'], filtered_df['Latitude']
+        ),
+        site_group(sites, "Observation"),
+    ]
+
+    present_count = len(filtered_df['Station'])
+    return Layer(groups, {
+        'status_count': present_count,  # This counts only the sites marked as "Present"
+        'mycs2_prediction': True,
+    })
+
+def generate_MYCS2_geojson(df,input_date,sites,viewport=None):
+    return layer_geojson(mycs2_layer(df, input_date, sites), viewport)
+
+def uncertainty_group(df, siteid, lon, lat, lon_uncertain, lat_uncertain):
+    """
+    "Uncertainty" points from the named columns of df.
+    """
+    return PointGroup(
+        [("SITEID", df[siteid]), ("STATUS", "Uncertainty")],
+        df[lon], df[lat], (df[lon_uncertain], df[lat_uncertain])
+    )
+
+def opusnet_layer(df,input_date):
     # Convert the 'Date' column to datetime format, allowing pandas to infer the format
-    df['Date'] = pd.to_datetime(df['Date'], dayfirst=True, errors='coerce', format='%Y-%m-%d')  # Coerce will turn invalid formats into NaT
+    df['Date'] = parse_dates(df['measurement_date'], dayfirst=True, errors='coerce')  # Coerce will turn invalid formats into NaT
     # Convert the input date to a datetime object, ensuring it's only the date part
     input_date = pd.to_datetime(input_date).date()
     # Filter the dataframe for the rows where the date matches the input (ignoring the time)
     filtered_df = df[df['Date'].dt.date == input_date]
     if filtered_df.empty:
-            print(f"No data found for the given date: {input_date.strftime('%Y-%m-%d')}")
-    else:
-        data = []
-        for index, row in filtered_df.iterrows():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "SITEID": row['Code'],
-                    "STATUS": "Uncertainty"
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [row['Longitude'],row['Latitude']],
-                    "Uncertainty": [row['Lon_Uncertainty'],row['Lat_Uncertainty']]
-                }
-            }
-            data.append(feature)
-        present_count = len(filtered_df['Code'])
-        geojson = {
-            "type": "FeatureCollection",
-            "status_count": present_count,  # This counts only the sites marked as "Present"
-            "uncertainty": True,
-            "mycs2_prediction": True,
-            "features": data
-        }
-        return json.dumps(geojson, indent=4)
-    return filtered_df
-    
-def generate_MYCS_uncertainty_geojson(df,input_date,):
+        logger.debug("No data found for the given date: %s", input_date.strftime('%Y-%m-%d'))
+        return None
+
+    group = uncertainty_group(
+        filtered_df, 'site_id', 'longitude', 'latitude', 'lon_uncertain', 'lat_uncertain'
+    )
+    present_count = len(filtered_df['site_id'])
+    return Layer([group], {
+        'status_count': present_count,  # This counts only the sites marked as "Present"
+        'uncertainty': True,
+        'mycs2_prediction': True,
+    })
+
+def generate_OPUSNET_geojson(df,input_date,viewport=None):
+    return layer_geojson(opusnet_layer(df, input_date), viewport)
+
+def mycs_uncertainty_layer(df,input_date):
     # Convert the 'Date' column to datetime format, allowing pandas to infer the format
-    df['Date'] = pd.to_datetime(df['Date'], dayfirst=True, errors='coerce', format='%Y-%m-%d')  # Coerce will turn invalid formats into NaT
+    df['Date'] = parse_dates(df['Date'], dayfirst=True, errors='coerce', format='%Y-%m-%d')  # Coerce will turn invalid formats into NaT
     # Convert the input date to a datetime object, ensuring it's only the date part
     input_date = pd.to_datetime(input_date).date()
     # Filter the dataframe for the rows where the date matches the input (ignoring the time)
     filtered_df = df[df['Date'].dt.date == input_date]
     if filtered_df.empty:
-            print(f"No data found for the given date: {input_date.strftime('%Y-%m-%d')}")
-    else:
-        data = []
-        for index, row in filtered_df.iterrows():
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "SITEID": row['Code'],
-                    "STATUS": "Uncertainty"
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [row['Longitude'],row['Latitude']],
-                    "Uncertainty": [row['Lon_Uncertainty'],row['Lat_Uncertainty']]
-                }
-            }
-            data.append(feature)
-        present_count = len(filtered_df['Code'])
-        geojson = {
-            "type": "FeatureCollection",
-            "status_count": present_count,  # This counts only the sites marked as "Present"
-            "uncertainty": True,
-            "mycs2_prediction": True,
-            "features": data
-        }
-        return json.dumps(geojson, indent=4)
-    return filtered_df
\ No newline at end of file
+        logger.debug("No data found for the given date: %s", input_date.strftime('%Y-%m-%d'))
+        return None
+
+    group = uncertainty_group(
+        filtered_df, 'Code', 'Longitude', 'Latitude', 'Lon_Uncertainty', 'Lat_Uncertainty'
+    )
+    present_count = len(filtered_df['Code'])
+    return Layer([group], {
+        'status_count': present_count,  # This counts only the sites marked as "Present"
+        'uncertainty': True,
+        'mycs2_prediction': True,
+    })
+
+def generate_MYCS_uncertainty_geojson(df,input_date,viewport=None):
+    return layer_geojson(mycs_uncertainty_layer(df, input_date), viewport)
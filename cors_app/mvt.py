@@ -0,0 +1,158 @@
+import math
+import struct
+
+import numpy as np
+
+from .spatial import Viewport, select_rows
+
+# Tile coordinate space and the margin (in the same units) of points
+# outside the tile that are still included, so symbols on a tile edge
+# are not clipped
+EXTENT = 4096
+BUFFER = 64
+
+# Latitude limit of the Web Mercator projection
+MAX_LATITUDE = math.degrees(math.atan(math.sinh(math.pi)))
+
+# Geometry command: MoveTo with a count of 1
+MOVE_TO_ONE = (1 & 0x7) | (1 << 3)
+POINT = 1
+
+
+def varint(value):
+    """
+    Encode a non-negative integer as a protobuf varint.
+    """
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field(number, wire_type, payload=b''):
+    """
+    Encode one protobuf field. wire_type 0 takes an int payload, 2 takes
+    bytes (length-delimited) and 1 takes 8 raw bytes.
+    """
+    key = varint((number << 3) | wire_type)
+    if wire_type == 0:
+        return key + varint(payload)
+    if wire_type == 2:
+        return key + varint(len(payload)) + payload
+    return key + payload
+
+
+def packed(number, values):
+    return field(number, 2, b''.join(map(varint, values)))
+
+
+def encode_value(value):
+    """
+    Encode a property value as a vector tile Value message, or return
+    None for values the format cannot hold (missing/NaN).
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return field(7, 0, int(value))
+    if isinstance(value, (int, np.integer)):
+        return field(6, 0, zigzag(int(value)))
+    if isinstance(value, (float, np.floating)):
+        if math.isnan(value):
+            return None
+        return field(3, 1, struct.pack('<d', float(value)))
+    if isinstance(value, str):
+        return field(1, 2, value.encode('utf-8'))
+    return None
+
+
+def tile_bounds(z, x, y, buffer=BUFFER):
+    """
+    Viewport (west, south, east, north in degrees) covered by a tile plus
+    buffer tile units on each side.
+    """
+    n = 2 ** z
+    margin = buffer / EXTENT
+
+    def lon(tx):
+        return max(-180.0, min(180.0, tx / n * 360 - 180))
+
+    def lat(ty):
+        ty = max(0.0, min(float(n), ty))
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return Viewport(lon(x - margin), lat(y + 1 + margin), lon(x + 1 + margin), lat(y - margin), z)
+
+
+def project(lon, lat, z, x, y):
+    """
+    Web Mercator projection of lon/lat arrays into integer tile
+    coordinates (0..EXTENT inside the tile).
+    """
+    n = 2 ** z
+    lat = np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE))
+    world_x = (np.asarray(lon) + 180) / 360 * n
+    world_y = (1 - np.log(np.tan(lat) + 1 / np.cos(lat)) / math.pi) / 2 * n
+    return (np.round((world_x - x) * EXTENT).astype(np.int64),
+            np.round((world_y - y) * EXTENT).astype(np.int64))
+
+
+def encode_layer(name, groups, z, x, y):
+    """
+    Encode a map Layer's point groups that fall on tile z/x/y as one
+    vector tile layer. Properties keep their GeoJSON names; uncertainty
+    columns become "Lon_Uncertainty" and "Lat_Uncertainty".
+    Returns b'' when no point is on the tile.
+    """
+    bounds = tile_bounds(z, x, y)
+    keys, values = {}, {}
+    features = []
+
+    for group in groups:
+        rows = select_rows(bounds, group.lon, group.lat, group.index, group.mask)
+        if len(rows) == 0:
+            continue
+        members = list(group.properties)
+        if group.uncertainty is not None:
+            members += [("Lon_Uncertainty", group.uncertainty[0]), ("Lat_Uncertainty", group.uncertainty[1])]
+
+        # Per-row tags, resolved against the shared key/value tables
+        columns = []
+        for key, value in members:
+            key_index = keys.setdefault(key, len(keys))
+            if np.ndim(value) == 0:
+                column = [value] * len(rows)
+            else:
+                column = np.asarray(value)[rows].tolist()
+            tags = []
+            for item in column:
+                encoded = encode_value(item)
+                if encoded is None:
+                    tags.append(None)
+                else:
+                    tags.append((key_index, values.setdefault(encoded, len(values))))
+            columns.append(tags)
+
+        px, py = project(np.asarray(group.lon, dtype=float)[rows], np.asarray(group.lat, dtype=float)[rows], z, x, y)
+        geometry = zip(px.tolist(), py.tolist())
+        for (tx, ty), *row_tags in zip(geometry, *columns):
+            tag_list = [i for pair in row_tags if pair is not None for i in pair]
+            features.append(
+                packed(2, tag_list)
+                + field(3, 0, POINT)
+                + packed(4, [MOVE_TO_ONE, zigzag(tx), zigzag(ty)])
+            )
+
+    if not features:
+        return b''
+
+    layer = field(15, 0, 2) + field(1, 2, name.encode('utf-8'))
+    layer += b''.join(field(2, 2, feature) for feature in features)
+    layer += b''.join(field(3, 2, key.encode('utf-8')) for key in keys)
+    layer += b''.join(field(4, 2, value) for value in values)
+    layer += field(5, 0, EXTENT)
+    return field(3, 2, layer)
@@ -0,0 +1,39 @@
+import importlib
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Heavy dependencies, ordered so each one's own cost is measured
+# separately from the modules it imports (pandas imports numpy, etc.)
+COLD_START_MODULES = ('numpy', 'pandas', 'botocore', 'boto3', 'django', 'rest_framework')
+
+
+def profile_imports(modules=COLD_START_MODULES):
+    """
+    Import modules one at a time and return [(name, seconds)]. A module
+    that is already loaded reports 0.
+    """
+    timings = []
+    for name in modules:
+        start = time.perf_counter()
+        if name not in sys.modules:
+            importlib.import_module(name)
+        timings.append((name, time.perf_counter() - start))
+    return timings
+
+
+def report_cold_start(timings, app_seconds):
+    """
+    Log per-module import times and the time taken to load the Django
+    application afterwards.
+    """
+    lines = [f'  {name:<16} {seconds * 1000:8.1f} ms' for name, seconds in timings]
+    lines.append(f'  {"application":<16} {app_seconds * 1000:8.1f} ms')
+    total = sum(seconds for _, seconds in timings) + app_seconds
+    lines.append(f'  {"total":<16} {total * 1000:8.1f} ms')
+    message = 'Cold start profile:\n' + '\n'.join(lines)
+    # Logging is not configured this early, so also write to stderr
+    logger.info(message)
+    print(message, file=sys.stderr)
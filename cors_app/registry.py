@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+
+from .cache import file_signature
+from .models import dms_to_decimal
+from .spatial import GridIndex
+
+# The static files a SiteRegistry is built from
+SITE_FILES = ('site_id.csv', 'CORS_All_Site_data.json')
+
+
+class SiteRegistry:
+    """
+    Static site metadata held as column arrays, with grid indexes over
+    their coordinates, built once per process.
+
+    The site_id.csv table keeps its row order (codes may repeat) with
+    coordinates already converted from DMS: lon/lat rounded to 0.001
+    degrees as the GeoJSON layers show them, and lon_exact/lat_exact at
+    full precision for matching against predictions. The
+    CORS_All_Site_data.json sites are kept alongside, with a sorted copy
+    of their ids for set operations against the stations present in a
+    STACOV day.
+
+    Builders read these arrays directly; they must not be modified.
+    signature identifies the version of SITE_FILES the registry was
+    loaded from (None if it was built from frames).
+    """
+
+    def __init__(self, sites_df, cors_features, signature=None):
+        self.signature = signature
+
+        # site_id.csv
+        self.code = sites_df['Code'].to_numpy(dtype=str)
+        self.domes = sites_df['DOMES'].to_numpy(dtype=object)
+        self.description = sites_df['Description'].to_numpy(dtype=object)
+        self.lon = dms_to_decimal(sites_df['Lon'], is_longitude=True)
+        self.lat = dms_to_decimal(sites_df['Lat'])
+        self.lon_exact = dms_to_decimal(sites_df['Lon'], is_longitude=True, rounded=False)
+        self.lat_exact = dms_to_decimal(sites_df['Lat'], rounded=False)
+        self.height = sites_df['Height'].to_numpy(dtype=float)
+
+        # Sorted view of the codes for index lookups (first row per code)
+        self._code_order = np.argsort(self.code, kind='stable')
+        self._sorted_code = self.code[self._code_order]
+
+        # CORS_All_Site_data.json
+        self.cors_siteid = np.array([feature['properties']['SITEID'] for feature in cors_features], dtype=str)
+        coordinates = np.array([feature['geometry']['coordinates'] for feature in cors_features], dtype=float)
+        self.cors_lon = coordinates[:, 0]
+        self.cors_lat = coordinates[:, 1]
+
+        # Spatial indexes for viewport queries, and for nearest-site matching
+        self.site_index = GridIndex(self.lon, self.lat)
+        self.cors_index = GridIndex(self.cors_lon, self.cors_lat)
+        self.exact_index = GridIndex(self.lon_exact, self.lat_exact)
+
+    @classmethod
+    def load(cls, static_dir=None):
+        static_dir = static_dir or default_static_dir()
+        # Taken before reading, so a file replaced meanwhile is seen as changed
+        signature = site_files_signature(static_dir)
+        sites_df = pd.read_csv(os.path.join(static_dir, 'site_id.csv'))
+        with open(os.path.join(static_dir, 'CORS_All_Site_data.json'), 'r') as cors_file:
+            cors_features = json.load(cors_file)['features']
+        return cls(sites_df, cors_features, signature)
+
+    def __len__(self):
+        return len(self.code)
+
+    def index_of(self, codes):
+        """
+        Return the first site_id.csv row for each code, or -1 where the
+        code is unknown.
+        """
+        codes = np.asarray(codes, dtype=str)
+        pos = np.searchsorted(self._sorted_code, codes)
+        found = pos < len(self._sorted_code)
+        found[found] = self._sorted_code[pos[found]] == codes[found]
+        return np.where(found, self._code_order[np.minimum(pos, len(self.code) - 1)], -1)
+
+    def missing_cors_sites(self, present):
+        """
+        Boolean mask over the CORS_All_Site_data.json sites whose id is
+        not among present.
+        """
+        present = np.unique(np.asarray(present, dtype=str))
+        if len(present) == 0:
+            return np.ones(len(self.cors_siteid), dtype=bool)
+        pos = np.minimum(np.searchsorted(present, self.cors_siteid), len(present) - 1)
+        return present[pos] != self.cors_siteid
+
+
+def default_static_dir():
+    return os.path.join(settings.BASE_DIR, 'static')
+
+
+def site_files_signature(static_dir):
+    """
+    The file_signature of each of SITE_FILES in static_dir.
+    """
+    return tuple(file_signature(os.path.join(static_dir, name)) for name in SITE_FILES)
+
+
+# One registry per static directory, normally just static/
+_site_registries = {}
+_load_lock = threading.Lock()
+
+
+def load_site_registry(static_dir=None):
+    """
+    (Re)build the process-wide registry from the files in static_dir
+    (static/ by default). The new registry replaces the old one in a
+    single assignment, so readers always see a complete registry.
+    """
+    static_dir = static_dir or default_static_dir()
+    registry = SiteRegistry.load(static_dir)
+    _site_registries[static_dir] = registry
+    return registry
+
+
+def get_site_registry(static_dir=None):
+    """
+    Return the process-wide registry, (re)loading it if ready() has not
+    or if SITE_FILES changed since it was built. Checking costs a stat()
+    per file, which every cached response already pays for its sources.
+    """
+    static_dir = static_dir or default_static_dir()
+    registry = _site_registries.get(static_dir)
+    if registry is not None and registry.signature == site_files_signature(static_dir):
+        return registry
+    with _load_lock:
+        # Another thread may have reloaded it while this one waited
+        registry = _site_registries.get(static_dir)
+        if registry is not None and registry.signature == site_files_signature(static_dir):
+            return registry
+        return load_site_registry(static_dir)
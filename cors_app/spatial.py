@@ -0,0 +1,254 @@
+from collections import namedtuple
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+
+from .geodesy import MEAN_RADIUS, great_circle_distance
+from .geojson import point_features
+
+# Map viewport from a request: bbox in degrees (west may exceed east when
+# the box crosses the antimeridian) and the web-map zoom level, if given
+Viewport = namedtuple('Viewport', ['west', 'south', 'east', 'north', 'zoom'])
+
+# Clusters are formed on a grid of cells this many pixels wide on screen
+CLUSTER_CELL_PIXELS = 64
+
+# Web-map zoom levels a viewport may ask for
+MIN_ZOOM = 0
+MAX_ZOOM = 24
+
+
+def parse_viewport(query):
+    """
+    Read the optional "bbox": [west, south, east, north] and "zoom" members
+    of a request's input. Returns None when no bbox is given; raises
+    ValueError for malformed values, including a zoom outside
+    MIN_ZOOM..MAX_ZOOM.
+    """
+    bbox = query.get('bbox')
+    if bbox is None:
+        return None
+    if not isinstance(bbox, (list, tuple)) or len(bbox) != 4:
+        raise ValueError("bbox must be [west, south, east, north]")
+    west, south, east, north = (float(value) for value in bbox)
+    if not (-90 <= south <= north <= 90) or not (-180 <= west <= 180 and -180 <= east <= 180):
+        raise ValueError("bbox is out of range")
+    zoom = query.get('zoom')
+    zoom = None if zoom is None else int(zoom)
+    if zoom is not None and not MIN_ZOOM <= zoom <= MAX_ZOOM:
+        raise ValueError(f"zoom must be from {MIN_ZOOM} to {MAX_ZOOM}")
+    return Viewport(west, south, east, north, zoom)
+
+
+def in_viewport(viewport, lon, lat):
+    """
+    Boolean mask of the points inside viewport.
+    """
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    inside = (lat >= viewport.south) & (lat <= viewport.north)
+    if viewport.west <= viewport.east:
+        return inside & (lon >= viewport.west) & (lon <= viewport.east)
+    return inside & ((lon >= viewport.west) | (lon <= viewport.east))
+
+
+def clusters_at(viewport):
+    """
+    Whether points in this viewport are clustered rather than sent
+    individually.
+    """
+    return viewport is not None and viewport.zoom is not None and viewport.zoom < settings.CORS_CLUSTER_MAX_ZOOM
+
+
+class GridIndex:
+    """
+    Fixed-grid spatial index over lon/lat arrays. Points are sorted by
+    cell, so a bbox query visits only the cells it overlaps and tests the
+    points in them exactly. Meant for long-lived arrays (site tables);
+    for a one-off frame a plain in_viewport mask is just as fast.
+    """
+
+    def __init__(self, lon, lat, cell_size=1.0):
+        self.lon = np.asarray(lon, dtype=float)
+        self.lat = np.asarray(lat, dtype=float)
+        self.cell_size = cell_size
+        self.columns = int(np.ceil(360 / cell_size))
+        self.rows = int(np.ceil(180 / cell_size))
+        cell = self._cell(self.lon, self.lat)
+        self.order = np.argsort(cell, kind='stable')
+        self.sorted_cell = cell[self.order]
+
+    def _column(self, lon):
+        return np.clip(np.floor((np.asarray(lon) + 180) / self.cell_size).astype(np.int64), 0, self.columns - 1)
+
+    def _row(self, lat):
+        return np.clip(np.floor((np.asarray(lat) + 90) / self.cell_size).astype(np.int64), 0, self.rows - 1)
+
+    def _cell(self, lon, lat):
+        return self._row(lat) * self.columns + self._column(lon)
+
+    def query(self, viewport):
+        """
+        Indices (in original order) of the points inside viewport.
+        """
+        west, east = int(self._column(viewport.west)), int(self._column(viewport.east))
+        spans = [(west, east)] if viewport.west <= viewport.east else [(west, self.columns - 1), (0, east)]
+        first_row, last_row = int(self._row(viewport.south)), int(self._row(viewport.north))
+
+        rows = np.arange(first_row, last_row + 1) * self.columns
+        candidates = []
+        for first, last in spans:
+            starts = np.searchsorted(self.sorted_cell, rows + first, side='left')
+            stops = np.searchsorted(self.sorted_cell, rows + last, side='right')
+            candidates.extend(self.order[start:stop] for start, stop in zip(starts, stops) if stop > start)
+        if not candidates:
+            return np.array([], dtype=np.int64)
+        candidates = np.concatenate(candidates)
+        candidates = candidates[in_viewport(viewport, self.lon[candidates], self.lat[candidates])]
+        return np.sort(candidates)
+
+    def nearest(self, lon, lat, max_distance):
+        """
+        For each query point, the index of the nearest indexed point no
+        more than max_distance metres away (great-circle), or -1. Returns
+        (indices, distances), with inf distances where there is no match.
+
+        Only the cells around each query point that can hold a point
+        within max_distance are searched, one vectorized pass per cell
+        offset. When that is more cells than there are points, every
+        query point is compared with every point instead.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        best = np.full(len(lon), -1, dtype=np.int64)
+        best_distance = np.full(len(lon), np.inf)
+        valid = np.isfinite(lon) & np.isfinite(lat)
+        if not valid.any() or len(self.order) == 0:
+            return best, best_distance
+
+        # Cells reached in each direction: a degree of longitude shrinks
+        # towards the poles, so use the highest latitude involved
+        reach = np.degrees(max_distance / MEAN_RADIUS)
+        max_lat = min(np.abs(lat[valid]).max() + reach, 89.0)
+        lat_cells = min(int(np.ceil(reach / self.cell_size)), self.rows)
+        lon_cells = min(int(np.ceil(reach / np.cos(np.radians(max_lat)) / self.cell_size)), self.columns // 2)
+
+        queries = np.flatnonzero(valid)
+        if (2 * lat_cells + 1) * (2 * lon_cells + 1) > len(self.order):
+            # Chunks of queries keep the distance matrix to ~1M entries
+            chunk = max(1, 1_000_000 // len(self.order))
+            for start in range(0, len(queries), chunk):
+                query = queries[start:start + chunk]
+                distance = great_circle_distance(lon[query, None], lat[query, None], self.lon, self.lat)
+                nearest = distance.argmin(axis=1)
+                best[query] = nearest
+                best_distance[query] = distance[np.arange(len(query)), nearest]
+        else:
+            row, column = self._row(lat[queries]), self._column(lon[queries])
+            for row_offset in range(-lat_cells, lat_cells + 1):
+                rows = row + row_offset
+                in_grid = (rows >= 0) & (rows < self.rows)
+                for column_offset in range(-lon_cells, lon_cells + 1):
+                    cell = rows * self.columns + (column + column_offset) % self.columns
+                    starts = np.searchsorted(self.sorted_cell, cell, side='left')
+                    counts = np.where(in_grid, np.searchsorted(self.sorted_cell, cell, side='right') - starts, 0)
+                    total = counts.sum()
+                    if total == 0:
+                        continue
+
+                    # Every (query, candidate) pair in these cells, flattened
+                    owner = np.repeat(np.arange(len(queries)), counts)
+                    positions = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+                    candidates = self.order[positions]
+                    query = queries[owner]
+                    distance = great_circle_distance(lon[query], lat[query],
+                                                     self.lon[candidates], self.lat[candidates])
+
+                    # Closest candidate per query point in this cell
+                    order = np.lexsort((distance, owner))
+                    first = order[np.unique(owner[order], return_index=True)[1]]
+                    closer = distance[first] < best_distance[query[first]]
+                    best[query[first][closer]] = candidates[first][closer]
+                    best_distance[query[first][closer]] = distance[first][closer]
+
+        too_far = best_distance > max_distance
+        best[too_far] = -1
+        best_distance[too_far] = np.inf
+        return best, best_distance
+
+
+def cluster_points(lon, lat, zoom):
+    """
+    Group points into screen-sized grid cells for a zoom level.
+
+    Returns (members, counts, cluster_lon, cluster_lat): members gives
+    each point's cluster number, and each cluster has its point count and
+    centroid.
+    """
+    cell_size = 360 / (256 * 2 ** zoom) * CLUSTER_CELL_PIXELS
+    lon = np.asarray(lon, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    key = np.floor((lat + 90) / cell_size) * (360 / cell_size + 1) + np.floor((lon + 180) / cell_size)
+    _, members, counts = np.unique(key, return_inverse=True, return_counts=True)
+    cluster_lon = np.bincount(members, weights=lon) / counts
+    cluster_lat = np.bincount(members, weights=lat) / counts
+    return members, counts, cluster_lon, cluster_lat
+
+
+def take_rows(properties, lon, lat, uncertainty, rows):
+    """
+    Select rows from the per-feature columns of a point_features call;
+    constant properties are left as they are.
+    """
+    properties = [(name, value if np.ndim(value) == 0 else np.asarray(value)[rows]) for name, value in properties]
+    if uncertainty is not None:
+        uncertainty = (np.asarray(uncertainty[0])[rows], np.asarray(uncertainty[1])[rows])
+    return properties, np.asarray(lon)[rows], np.asarray(lat)[rows], uncertainty
+
+
+def select_rows(viewport, lon, lat, index=None, mask=None):
+    """
+    Indices of the points inside viewport (all points if it is None)
+    where mask, if given, is set. index is an optional GridIndex over
+    lon/lat.
+    """
+    if viewport is None:
+        rows = np.arange(len(lon))
+    elif index is not None:
+        rows = index.query(viewport)
+    else:
+        rows = np.flatnonzero(in_viewport(viewport, lon, lat))
+    if mask is not None:
+        rows = rows[np.asarray(mask)[rows]]
+    return rows
+
+
+def viewport_features(viewport, properties, lon, lat, uncertainty=None, index=None, mask=None):
+    """
+    point_features restricted to a Viewport (None means everything) and,
+    if given, to the rows where the boolean mask is set.
+
+    index is a GridIndex over lon/lat, used instead of testing every
+    point. Below CORS_CLUSTER_MAX_ZOOM, points sharing a grid cell are
+    replaced by one feature at their centroid carrying the constant
+    properties (e.g. STATUS) plus "cluster": true and "point_count";
+    points alone in their cell are sent unchanged.
+    """
+    if viewport is None and mask is None:
+        return point_features(properties, lon, lat, uncertainty)
+
+    rows = select_rows(viewport, lon, lat, index, mask)
+    properties, lon, lat, uncertainty = take_rows(properties, lon, lat, uncertainty, rows)
+    if not clusters_at(viewport):
+        return point_features(properties, lon, lat, uncertainty)
+
+    members, counts, cluster_lon, cluster_lat = cluster_points(lon, lat, viewport.zoom)
+    single = np.flatnonzero(counts[members] == 1)
+    grouped = counts > 1
+    constants = [(name, value) for name, value in properties if np.ndim(value) == 0]
+    return chain(
+        point_features(*take_rows(properties, lon, lat, uncertainty, single)),
+        point_features(constants + [("cluster", True), ("point_count", counts[grouped])],
+                       cluster_lon[grouped], cluster_lat[grouped]),
+    )
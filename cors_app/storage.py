@@ -0,0 +1,213 @@
+import glob
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+
+from django.conf import settings
+
+from .cache import cache_path, file_signature
+from .timing import count_cache, stage
+
+# A dataset object available on the local filesystem. version changes
+# whenever the object's content does (S3 ETag, or mtime/size locally).
+# table is the PartitionedTable built from that version, when the
+# DatasetManager supplies the object.
+StoredObject = namedtuple('StoredObject', ['path', 'version', 'table'], defaults=[None])
+
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Return the process-wide S3 client, creating it on first use.
+
+    boto3 is imported here rather than at module level, keeping it off
+    the cold-start path of requests that never touch S3. Clients are
+    thread-safe, so one pooled client is shared by all requests.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+
+                _s3_client = boto3.session.Session().client(
+                    's3',
+                    region_name=settings.AWS_DEFAULT_REGION,
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    config=Config(
+                        max_pool_connections=settings.CORS_S3_MAX_POOL_CONNECTIONS,
+                        tcp_keepalive=True,
+                        connect_timeout=settings.CORS_S3_CONNECT_TIMEOUT,
+                        read_timeout=settings.CORS_S3_READ_TIMEOUT,
+                        retries={'max_attempts': settings.CORS_S3_MAX_ATTEMPTS, 'mode': 'standard'},
+                    ),
+                )
+    return _s3_client
+
+
+class LocalStorage:
+    """
+    Objects read straight from a local directory. Used in development and
+    tests, and in place of S3 when the bucket is mirrored to disk.
+    """
+
+    def __init__(self, root):
+        self.root = str(root)
+
+    def fetch(self, key):
+        path = os.path.join(self.root, key)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{key} not found in {self.root}")
+        mtime_ns, size = file_signature(path)
+        return StoredObject(path, f'{mtime_ns}-{size}')
+
+    def refresh(self, key):
+        return self.fetch(key)
+
+
+class S3Storage:
+    """
+    Objects from an S3 bucket, cached on local disk.
+
+    A cached object is trusted for ttl seconds after it was last checked.
+    After that it is revalidated with a conditional GET on its ETag, which
+    costs one round trip and no transfer when it has not changed.
+    Concurrent fetches of the same key in a process share one request:
+    callers arriving while a download or revalidation is in flight wait
+    for its result instead of queueing up behind it for another.
+
+    Each downloaded version is kept in a file of its own, named after its
+    ETag, and a .meta.json file names the current one. A new version is
+    written in full before the .meta.json is replaced, in one rename, so
+    a reader sees either the old ETag and file or the new ones, never new
+    bytes under the old ETag. The previous version is kept for readers
+    still using it; older ones are removed.
+    """
+
+    def __init__(self, bucket, client, ttl=300, cache_dir='s3'):
+        self.bucket = bucket
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._client = client
+        self._checked = {}
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def client(self):
+        # Accept either a client or a callable returning one
+        return self._client() if callable(self._client) else self._client
+
+    def local_path(self, key, etag):
+        """
+        Local copy of the version of key with the given ETag.
+        """
+        directory, name = os.path.split(cache_path(self.cache_dir, self.bucket, key))
+        digest = hashlib.sha1(etag.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(directory, f'{digest}-{name}')
+
+    def meta_path(self, key):
+        return cache_path(self.cache_dir, self.bucket, key) + '.meta.json'
+
+    def _current(self, key):
+        """
+        StoredObject of the version of key last downloaded, or None.
+        """
+        try:
+            with open(self.meta_path(key)) as meta_file:
+                etag = json.load(meta_file)['etag']
+        except (OSError, ValueError, KeyError):
+            return None
+        path = self.local_path(key, etag)
+        return StoredObject(path, etag) if os.path.exists(path) else None
+
+    def fetch(self, key):
+        checked = self._checked.get(key)
+        if checked is not None and time.monotonic() - checked < self.ttl:
+            current = self._current(key)
+            if current is not None:
+                count_cache('s3', 'fresh')
+                return current
+
+        with self._in_flight_lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            return future.result()
+
+        try:
+            future.set_result(self._revalidate(key))
+        except BaseException as error:
+            future.set_exception(error)
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+        return future.result()
+
+    def refresh(self, key):
+        """
+        Fetch key, revalidating the cached copy now whatever its age.
+        """
+        self._checked.pop(key, None)
+        return self.fetch(key)
+
+    def _revalidate(self, key):
+        from botocore.exceptions import ClientError
+
+        current = self._current(key)
+        request = {'Bucket': self.bucket, 'Key': key}
+        if current is not None:
+            request['IfNoneMatch'] = current.version
+        try:
+            with stage('s3'):
+                response = self.client.get_object(**request)
+        except ClientError as error:
+            status_code = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+            if current is None or (status_code != 304 and error.response['Error'].get('Code') != '304'):
+                raise
+            count_cache('s3', 'not_modified')
+            stored = current
+        else:
+            with stage('s3_download'):
+                stored = self._store(key, response['Body'], response['ETag'], current)
+            count_cache('s3', 'downloaded')
+
+        self._checked[key] = time.monotonic()
+        return stored
+
+    def _store(self, key, body, etag, previous):
+        """
+        Write a new version of key and make it the current one. previous
+        is the StoredObject it replaces, which is kept.
+        """
+        path = self.local_path(key, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as tmp:
+            shutil.copyfileobj(body, tmp, 1024 * 1024)
+        os.replace(tmp_path, path)
+        with open(tmp_path, 'w') as meta_file:
+            json.dump({'etag': etag}, meta_file)
+        os.replace(tmp_path, self.meta_path(key))
+
+        keep = {path, previous.path if previous is not None else None}
+        directory, name = os.path.split(cache_path(self.cache_dir, self.bucket, key))
+        for stale in glob.glob(os.path.join(directory, '?' * 16 + '-' + glob.escape(name))):
+            if stale not in keep:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+        return StoredObject(path, etag)
@@ -1,3 +1,1202 @@
-from django.test import TestCase
+import glob
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest import skipUnless
+from unittest.mock import patch
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from botocore.exceptions import ClientError
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+
+from . import views
+from .artifacts import artifact_store
+from .cache import StacovCache, file_signature, publish_version, read_stacov_sidecar
+from .columnar import arrow_available, encode_history
+from .cube import load_cube, stacov_day, stacov_files
+from .datasets import load_table
+from .displacement import moved, station_displacement
+from .geodesy import ecef_to_geodetic, geodetic_to_ecef, great_circle_distance
+from .geojson import encode_bytes
+from .management.commands.precompute_layers import precompute_day
+from .matching import encode_residuals
+from .models import (generate_CSV_geojson, generate_geojson, generate_MYCS2_geojson, generate_MYCS_uncertainty_geojson,
+                     generate_OPUSNET_geojson, layer_geojson, mycs2_layer, parse_dates, read_stacov, stacov_layer)
+from .mvt import EXTENT, tile_bounds
+from .registry import SiteRegistry, get_site_registry
+from .spatial import GridIndex, Viewport, in_viewport
+from .storage import LocalStorage, S3Storage, StoredObject, get_s3_client
+from .timeseries import load_timeseries, lttb, minmax
+from .timing import metrics, stage
+from .versions import DatasetManager
+
+
+def reference_read_stacov(file):
+    """
+    Line-by-line STACOV parser that read_stacov replaced, kept as the
+    reference the vectorized parser is checked against.
+    """
+    content = file.read().decode("utf-8").splitlines()
+    header = content[0].strip()
+    n = int(header.split()[0])
+    nsta = n // 3
+    cdate = header.split()[-1]
+
+    station_names = []
+    xyz = np.zeros((3, nsta))
+
+    for i in range(n):
+        parts = content[i + 1].strip().split()
+        station_index = (int(parts[0]) - 1) // 3
+        coord_index = ['X', 'Y', 'Z'].index(parts[3][-1])
+        if coord_index == 0:
+            station_names.append(parts[1])
+        xyz[coord_index, station_index] = float(parts[4])
+
+    latitudes = []
+    longitudes = []
+    heights = []
+    for i in range(nsta):
+        lat, lon, h = reference_ecef_to_llh(xyz[0, i], xyz[1, i], xyz[2, i])
+        latitudes.append(lat)
+        longitudes.append(lon)
+        heights.append(h)
+
+    return cdate, nsta, station_names, latitudes, longitudes, heights
+
+
+def reference_ecef_to_llh(x, y, z):
+    """
+    The fixed-point iteration ecef_to_llh used before the closed-form
+    conversion, kept as the reference it is checked against.
+    """
+    a = 6378137.0
+    e2 = (1 / 298.257223563) * (2 - 1 / 298.257223563)
+    lon = np.arctan2(y, x)
+    p = np.sqrt(x**2 + y**2)
+    lat = np.arctan2(z, p * (1 - e2))
+    for _ in range(5):
+        N = a / np.sqrt(1 - e2 * np.sin(lat)**2)
+        lat = np.arctan2(z + e2 * N * np.sin(lat), p)
+    N = a / np.sqrt(1 - e2 * np.sin(lat)**2)
+    h = p / np.cos(lat) - N
+    return np.degrees(lat), np.degrees(lon), h
+
+
+def reference_dms_to_decimal(dms_str, is_longitude=False):
+    """
+    The per-value DMS conversion the GeoJSON builders used before
+    dms_to_decimal.
+    """
+    degrees, minutes, seconds = dms_str.split()
+    decimal_degrees = round(int(degrees) + int(minutes) / 60 + float(seconds) / 3600, 3)
+    if is_longitude and decimal_degrees > 180:
+        decimal_degrees -= 360
+    return decimal_degrees
+
+
+def reference_feature(properties, coordinates, uncertainty=None):
+    """
+    One feature as the row-by-row builders produced it, before the
+    streaming encoder.
+    """
+    geometry = {"type": "Point", "coordinates": list(coordinates)}
+    if uncertainty is not None:
+        geometry["Uncertainty"] = list(uncertainty)
+    return {"type": "Feature", "properties": properties, "geometry": geometry}
+
+
+def reference_site_features(sites_df, status):
+    return [
+        reference_feature(
+            {"SITEID": row['Code'], "STATUS": status, "Description": row['Description'], "DOMES": row['DOMES']},
+            [reference_dms_to_decimal(row['Lon'], is_longitude=True), reference_dms_to_decimal(row['Lat'])]
+        )
+        for _, row in sites_df.iterrows()
+    ]
+
+
+class GeodesyTests(SimpleTestCase):
+    # Sub-millimetre agreement, with 1 m of arc ~ 1 / 111,000 degrees
+    TOLERANCE_M = 1e-4
+    TOLERANCE_DEG = TOLERANCE_M / 111_000
+
+    def test_matches_iterative_solution_on_stations(self):
+        with open(os.path.join(settings.BASE_DIR, 'static', '24apr16NOAM4.0_ambres_nfx20.stacov'), 'rb') as file:
+            df_xyz = read_stacov(file)[2]
+        xyz = df_xyz[['X', 'Y', 'Z']].to_numpy().T
+        lat, lon, h = ecef_to_geodetic(*xyz)
+        ref_lat, ref_lon, ref_h = reference_ecef_to_llh(*xyz)
+        self.assertLess(np.abs(lat - ref_lat).max(), self.TOLERANCE_DEG)
+        self.assertLess(np.abs(lon - ref_lon).max(), self.TOLERANCE_DEG)
+        self.assertLess(np.abs(h - ref_h).max(), self.TOLERANCE_M)
+
+    def test_round_trip_worldwide(self):
+        rng = np.random.default_rng(0)
+        lat = np.concatenate([[90, -90, 0, 89.9999, -45], rng.uniform(-90, 90, 10_000)])
+        lon = np.concatenate([[0, 180, -180, 12.5, 90], rng.uniform(-180, 180, 10_000)])
+        h = np.concatenate([[0, 0, -100, 5000, 400_000], rng.uniform(-500, 20_000, 10_000)])
+
+        back_lat, back_lon, back_h = ecef_to_geodetic(*geodetic_to_ecef(lat, lon, h))
+        self.assertLess(np.abs(back_lat - lat).max(), self.TOLERANCE_DEG)
+        self.assertLess(np.abs(back_h - h).max(), self.TOLERANCE_M)
+        # Longitude is undefined at the poles
+        off_pole = np.abs(lat) < 90
+        dlon = (back_lon - lon + 180) % 360 - 180
+        self.assertLess(np.abs(dlon[off_pole] * np.cos(np.radians(lat[off_pole]))).max(), self.TOLERANCE_DEG)
+
+
+class ReadStacovTests(SimpleTestCase):
+    def stacov_files(self):
+        return sorted(glob.glob(os.path.join(settings.BASE_DIR, 'static', '*.stacov')))
+
+    def test_bundled_files_present(self):
+        self.assertEqual(len(self.stacov_files()), 48)
+
+    def test_matches_reference_parser(self):
+        for file_path in self.stacov_files():
+            with self.subTest(file=os.path.basename(file_path)):
+                with open(file_path, 'rb') as file:
+                    cdate, nsta, df_xyz = read_stacov(file)
+                with open(file_path, 'rb') as file:
+                    ref_cdate, ref_nsta, names, lats, lons, heights = reference_read_stacov(file)
+
+                self.assertEqual(cdate, ref_cdate)
+                self.assertEqual(nsta, ref_nsta)
+                self.assertEqual(list(df_xyz['Station Name']), names)
+                # The reference converts with the iterative solution, so the
+                # two agree to the conversion tolerance rather than exactly
+                np.testing.assert_allclose(df_xyz['Latitude'], lats, rtol=0, atol=GeodesyTests.TOLERANCE_DEG)
+                np.testing.assert_allclose(df_xyz['Longitude'], lons, rtol=0, atol=GeodesyTests.TOLERANCE_DEG)
+                np.testing.assert_allclose(df_xyz['Height'], heights, rtol=0, atol=GeodesyTests.TOLERANCE_M)
+
+
+class StacovCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=os.path.join(self.tmp_dir, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        source = os.path.join(settings.BASE_DIR, 'static', '24apr16NOAM4.0_ambres_nfx20.stacov')
+        self.file_path = os.path.join(self.tmp_dir, os.path.basename(source))
+        shutil.copy(source, self.file_path)
+
+    def test_sidecar_round_trip(self):
+        cache = StacovCache(maxsize=2)
+        cdate, nsta, df_xyz = cache.load(self.file_path)
+        self.assertTrue(os.path.exists(cache.sidecar_path(self.file_path)))
+        self.assertIs(cache.load(self.file_path)[2], df_xyz)
+
+        # A fresh cache (a cold worker) is served from the sidecar
+        cold_cdate, cold_nsta, cold_df = StacovCache(maxsize=2).load(self.file_path)
+        self.assertEqual((cold_cdate, cold_nsta), (cdate, nsta))
+        pd.testing.assert_frame_equal(cold_df, df_xyz)
+
+    def test_invalidated_when_file_changes(self):
+        cache = StacovCache(maxsize=2)
+        first = cache.load(self.file_path)[2]
+        stat = os.stat(self.file_path)
+        os.utime(self.file_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        second = cache.load(self.file_path)[2]
+        self.assertIsNot(second, first)
+        pd.testing.assert_frame_equal(second, first)
+
+    def test_publish_version_keeps_previous(self):
+        parent = os.path.join(self.tmp_dir, 'versions')
+        for generation, version in enumerate(['v1', 'v2', 'v3']):
+            publish_version(os.path.join(parent, version), os.makedirs)
+            # Order the generations whatever the filesystem's mtime resolution
+            os.utime(os.path.join(parent, version), ns=(generation, generation))
+        self.assertEqual(sorted(os.listdir(parent)), ['v2', 'v3'])
+
+    def test_bulk_ingest(self):
+        with open(os.path.join(self.tmp_dir, '24may40NOAM4.0_ambres_nfx20.stacov'), 'w') as file:
+            file.write('not a stacov file\n')
+        output_dir = os.path.join(self.tmp_dir, 'out')
+        out, err = io.StringIO(), io.StringIO()
+        call_command('ingest_stacov', self.tmp_dir, '--output', output_dir, '--workers', '1', stdout=out, stderr=err)
+        self.assertIn('1 files (1 parsed, 0 up to date, 1 skipped)', out.getvalue())
+        self.assertIn('24may40', err.getvalue())
+
+        # The per-day output is the sidecar StacovCache reads
+        cdate, nsta, df_xyz = read_stacov_sidecar(
+            os.path.join(output_dir, os.path.basename(self.file_path) + '.npz'), file_signature(self.file_path))
+        with open(self.file_path, 'rb') as file:
+            pd.testing.assert_frame_equal(df_xyz, read_stacov(file)[2])
+
+        with open(os.path.join(output_dir, 'catalog.json')) as file:
+            catalog = json.load(file)
+        self.assertEqual(catalog['days'], ['2024-04-16'])
+        self.assertEqual(len(catalog['stations']), nsta)
+        self.assertEqual(catalog['stations'][df_xyz['Station Name'][0]]['latitude'], df_xyz['Latitude'][0])
+
+
+class GeoJSONBuilderTests(SimpleTestCase):
+    # site_id.csv rows with missing Description/DOMES, non-ASCII text and
+    # a longitude in the 0-360 system
+    SITES = pd.DataFrame({
+        'Code': ['BRUS', 'ÅLES', 'ZIMM', 'MOSI'],
+        'DOMES': ['13101M004', np.nan, '14001M004', np.nan],
+        'Description': ['Brussels, Belgium', 'Ålesund, Norge', np.nan, 'Mosinee, WI "North"'],
+        'Lat': ['50 47 52.1', '62 28 36.0', '46 52 37.5', '44 47 31.7'],
+        'Lon': ['4 21 33.1', '6 11 54.3', '7 27 55.0', '269 32 19.0'],
+        'Height': [149.7, 45.2, 956.3, 365.0],
+    })
+    CORS = [
+        {'type': 'Feature', 'properties': {'SITEID': siteid}, 'geometry': {'type': 'Point', 'coordinates': coords}}
+        for siteid, coords in [('MOSI', [-90.46, 44.79]), ('P123', [-111.5, 40.25]), ('ZDV1', [-105.1, 39.9])]
+    ]
+    DAY = '2024-04-16T00:00:00.000Z'
+    EMPTY_DAY = '1990-01-01T00:00:00.000Z'
+
+    def setUp(self):
+        self.sites = SiteRegistry(self.SITES, self.CORS)
+        # Small chunks so the separators between chunks are exercised
+        chunk_size = patch('cors_app.geojson.FEATURES_PER_CHUNK', 2)
+        chunk_size.start()
+        self.addCleanup(chunk_size.stop)
+
+    def assertStreamsLike(self, chunks, members, features):
+        body = encode_bytes(chunks)
+        self.assertNotIn(b'\n', body)
+        expected = {"type": "FeatureCollection", **members, "features": features}
+        self.assertEqual(json.loads(body), json.loads(json.dumps(expected)))
+
+    def test_stacov(self):
+        df_xyz = pd.DataFrame({
+            'Station Name': ['MOSI', 'ÅLES', 'BRUS'],
+            'Latitude': [44.792, 62.47666666666667, 50.79780555555556],
+            'Longitude': [-90.46138888888889, 6.198416666666667, 4.359194444444445],
+        })
+        present = set(df_xyz['Station Name'])
+        features = [reference_feature({"SITEID": row['Station Name'], "STATUS": "Present"},
+                                      [row['Longitude'], row['Latitude']])
+                    for _, row in df_xyz.iterrows()]
+        features += [reference_feature({"SITEID": feature['properties']['SITEID'], "STATUS": "Not Present"},
+                                       feature['geometry']['coordinates'])
+                     for feature in self.CORS if feature['properties']['SITEID'] not in present]
+        self.assertStreamsLike(generate_geojson(df_xyz, self.sites), {"status_count": 3}, features)
+
+    def test_site_info(self):
+        self.assertStreamsLike(generate_CSV_geojson(self.sites), {"status_count": 4},
+                               reference_site_features(self.SITES, "Present"))
+
+    def test_mycs2(self):
+        df = pd.DataFrame({
+            'Date': ['16/04/2024', '16/04/2024', '17/04/2024'],
+            'Station': ['BRUS', 'ÅLES', 'BRUS'],
+            'Longitude': [4.3592, 6.1984, 4.3593],
+            'Latitude': [50.7978, np.nan, 50.7979],
+        })
+        features = [reference_feature({"SITEID": row['Station'], "STATUS": "MYCS2 Prediction"},
+                                      [row['Longitude'], row['Latitude']])
+                    for _, row in df[:2].iterrows()]
+        features += reference_site_features(self.SITES, "Observation")
+        self.assertStreamsLike(generate_MYCS2_geojson(df.copy(), self.DAY, self.sites),
+                               {"status_count": 2, "mycs2_prediction": True}, features)
+        self.assertIsNone(generate_MYCS2_geojson(df.copy(), self.EMPTY_DAY, self.sites))
+
+    def test_uncertainty(self):
+        opusnet = pd.DataFrame({
+            'measurement_date': ['2024-04-16', '2024-04-16', '2024-04-15'],
+            'site_id': ['P123', 'ÅLES', 'P123'],
+            'longitude': [-111.5, 6.2, -111.5],
+            'latitude': [40.25, 62.48, 40.25],
+            'lon_uncertain': [0.002, np.nan, 0.003],
+            'lat_uncertain': [0.001, 0.004, 0.002],
+        })
+        mycs = opusnet.rename(columns={
+            'measurement_date': 'Date', 'site_id': 'Code', 'longitude': 'Longitude', 'latitude': 'Latitude',
+            'lon_uncertain': 'Lon_Uncertainty', 'lat_uncertain': 'Lat_Uncertainty',
+        })
+        features = [reference_feature({"SITEID": row['site_id'], "STATUS": "Uncertainty"},
+                                      [row['longitude'], row['latitude']],
+                                      [row['lon_uncertain'], row['lat_uncertain']])
+                    for _, row in opusnet[:2].iterrows()]
+        members = {"status_count": 2, "uncertainty": True, "mycs2_prediction": True}
+
+        for generate, df in [(generate_OPUSNET_geojson, opusnet), (generate_MYCS_uncertainty_geojson, mycs)]:
+            with self.subTest(builder=generate.__name__):
+                self.assertStreamsLike(generate(df.copy(), self.DAY), members, features)
+                self.assertIsNone(generate(df.copy(), self.EMPTY_DAY))
+
+
+class LayerTests(SimpleTestCase):
+    def test_stacov_layer(self):
+        sites = get_site_registry()
+        with open(os.path.join(settings.BASE_DIR, 'static', '24apr16NOAM4.0_ambres_nfx20.stacov'), 'rb') as file:
+            df_xyz = read_stacov(file)[2]
+        # A station listed twice still counts once
+        df_xyz = pd.concat([df_xyz, df_xyz[:1]], ignore_index=True)
+        cors = set(sites.cors_siteid)
+        present = set(df_xyz['Station Name'])
+        self.assertTrue(present & cors and cors - present)
+
+        layer = stacov_layer(df_xyz, sites)
+        self.assertEqual(layer.members, {'status_count': len(present)})
+        present_group, missing_group = layer.groups
+        self.assertEqual(dict(present_group.properties)['STATUS'], 'Present')
+        self.assertEqual(list(dict(present_group.properties)['SITEID']), list(df_xyz['Station Name']))
+        self.assertIsNone(present_group.mask)
+
+        self.assertEqual(dict(missing_group.properties)['STATUS'], 'Not Present')
+        not_present = sites.cors_siteid[missing_group.mask]
+        self.assertEqual(set(not_present), cors - present)
+        self.assertEqual(len(not_present), sum(siteid not in present for siteid in sites.cors_siteid))
+
+        geojson = json.loads(encode_bytes(layer_geojson(layer)))
+        statuses = [feature['properties']['STATUS'] for feature in geojson['features']]
+        self.assertEqual(statuses, ['Present'] * len(df_xyz) + ['Not Present'] * len(not_present))
+
+    def test_mycs2_layer(self):
+        sites = get_site_registry()
+        df = pd.DataFrame({
+            'Date': ['16/04/2024', '16/04/2024', '16/04/2024', '17/04/2024'],
+            'Station': ['BRUS', 'ZIMM', 'GRAZ', 'BRUS'],
+            'Longitude': [4.359, 7.465, 15.493, 4.36],
+            'Latitude': [50.798, 46.877, 47.067, 50.8],
+        })
+        layer = mycs2_layer(df, '2024-04-16T00:00:00.000Z', sites)
+        self.assertEqual(layer.members, {'status_count': 3, 'mycs2_prediction': True})
+        predictions, observations = layer.groups
+        self.assertEqual(dict(predictions.properties)['STATUS'], 'MYCS2 Prediction')
+        self.assertEqual(list(dict(predictions.properties)['SITEID']), ['BRUS', 'ZIMM', 'GRAZ'])
+        self.assertEqual(list(predictions.lon), [4.359, 7.465, 15.493])
+        self.assertEqual(dict(observations.properties)['STATUS'], 'Observation')
+        self.assertIs(observations.index, sites.site_index)
+        self.assertEqual(len(observations.lon), len(sites))
+
+        with self.assertLogs('cors_app.models', 'DEBUG') as logs:
+            self.assertIsNone(mycs2_layer(df, '2024-04-18T00:00:00.000Z', sites))
+        self.assertIn('No data found for the given date: 2024-04-18', logs.output[0])
+
+        # Already parsed dates (PartitionedTable day slices) are used as they are
+        self.assertIs(parse_dates(df['Date']), df['Date'])
+        again = mycs2_layer(df, '2024-04-16T00:00:00.000Z', sites)
+        self.assertEqual(list(dict(again.groups[0].properties)['SITEID']), ['BRUS', 'ZIMM', 'GRAZ'])
+
+
+class StacovJsonViewCacheTests(SimpleTestCase):
+    def post(self, options, **extra):
+        payload = {'input': {'options': options, 'date': '2024-04-16T00:00:00.000Z'}}
+        return self.client.post('/api/json/', payload, content_type='application/json', **extra)
+
+    def test_stacov_response_is_compact_and_conditional(self):
+        response = self.post('Static JSON + STACOV File')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'\n', response.content)
+        geojson = json.loads(response.content)
+        self.assertEqual(geojson['type'], 'FeatureCollection')
+        self.assertEqual(geojson['status_count'], 1285)
+
+        etag = response['ETag']
+        self.assertEqual(self.post('Initial Load')['ETag'], etag)
+        self.assertEqual(self.post('Initial Load', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_gzip_body(self):
+        response = self.post('Over All Site Info', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        geojson = json.loads(gzip.decompress(response.content))
+        self.assertEqual(geojson['status_count'], 7880)
+
+        # gzip refused with q=0 gets the plain body; every variant varies
+        # on Accept-Encoding, 304s included
+        for accept_encoding in ('gzip;q=0, identity', 'br', ''):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.post('Over All Site Info', HTTP_ACCEPT_ENCODING=accept_encoding)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.post('Over All Site Info', HTTP_ACCEPT_ENCODING='*')['Content-Encoding'], 'gzip')
+        response = self.post('Over All Site Info', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_cross_origin_revalidation(self):
+        origin = 'https://cors-dashboard-frontend.vercel.app'
+        preflight = self.client.options('/api/json/', HTTP_ORIGIN=origin,
+                                        HTTP_ACCESS_CONTROL_REQUEST_METHOD='POST',
+                                        HTTP_ACCESS_CONTROL_REQUEST_HEADERS='content-type, if-none-match')
+        self.assertEqual(preflight.status_code, 200)
+        allowed = preflight['Access-Control-Allow-Headers'].split(', ')
+        self.assertIn('if-none-match', allowed)
+        self.assertIn('if-modified-since', allowed)
+
+        response = self.post('Over All Site Info', HTTP_ORIGIN=origin)
+        self.assertEqual(response['Access-Control-Allow-Origin'], origin)
+        exposed = response['Access-Control-Expose-Headers'].split(', ')
+        self.assertEqual(exposed, ['ETag', 'Last-Modified', 'Server-Timing'])
+        response = self.post('Over All Site Info', HTTP_ORIGIN=origin, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_columnar_format(self):
+        geojson = json.loads(self.post('Static JSON + STACOV File').content)
+        response = self.client.post('/api/json/', {'input': {
+            'options': 'Static JSON + STACOV File', 'date': '2024-04-16T00:00:00.000Z', 'format': 'columns',
+        }}, content_type='application/json')
+        self.assertEqual(response['Content-Type'], 'application/vnd.cors-dashboard.columns+json')
+        body = json.loads(response.content)
+        self.assertEqual(body['status_count'], geojson['status_count'])
+        self.assertEqual(body['count'], len(geojson['features']))
+        self.assertEqual(body['columns']['SITEID'], [f['properties']['SITEID'] for f in geojson['features']])
+        self.assertEqual(body['columns']['lat'], [f['geometry']['coordinates'][1] for f in geojson['features']])
+
+    @skipUnless(arrow_available(), "pyarrow is not installed")
+    def test_arrow_by_accept_header(self):
+        import pyarrow as pa
+
+        response = self.post('Over All Site Info', HTTP_ACCEPT='application/vnd.apache.arrow.stream')
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        self.assertIn('Accept', response['Vary'])
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.num_rows, 7880)
+        self.assertEqual(json.loads(table.schema.metadata[b'members']), {'status_count': 7880})
+
+    async def test_async_endpoint_matches_sync(self):
+        payload = {'input': {'options': 'Over All Site Info', 'date': '2024-04-16T00:00:00.000Z'}}
+        response = await self.async_client.post('/api/json/async/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, self.post('Over All Site Info').content)
+
+        payload['input']['options'] = 'Nothing'
+        response = await self.async_client.post('/api/json/async/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), {'error': 'Unknown option'})
+
+        for body, error in [(b'{"input": ', 'Invalid JSON body'), (b'\xff', 'Invalid JSON body'),
+                            (b'{"input": "2024-04-16"}', 'Input must be an object'),
+                            (b'[1, 2]', 'Input must be an object')]:
+            with self.subTest(body=body):
+                response = await self.async_client.post('/api/json/async/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {'error': error})
+
+    def test_input_must_be_an_object(self):
+        for body in [b'{"input": "2024-04-16"}', b'{"input": ["2024-04-16"]}', b'[1, 2]']:
+            with self.subTest(body=body):
+                response = self.client.post('/api/json/', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {'error': 'Input must be an object'})
+
+    def test_batched_layers(self):
+        options = ['Static JSON + STACOV File', 'Over All Site Info', 'OPUSNET Data']
+        with patch.object(views, 'storage', LocalStorage(os.path.join(settings.BASE_DIR, 'static'))):
+            singles = [self.post(option) for option in options]
+            singles = [json.loads(b''.join(r.streaming_content) if r.streaming else r.content) for r in singles]
+            response = self.post(options)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), {'layers': dict(zip(options, singles))})
+
+            response = self.post(options, HTTP_ACCEPT_ENCODING='gzip')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertEqual(list(json.loads(gzip.decompress(response.content))['layers']), options)
+
+        # A layer without data reports its error alongside the others
+        payload = {'input': {'options': ['Static JSON + STACOV File', 'Over All Site Info'],
+                             'date': '1990-01-01T00:00:00.000Z'}}
+        layers = json.loads(self.client.post('/api/json/', payload, content_type='application/json').content)['layers']
+        self.assertEqual(layers['Static JSON + STACOV File'], {'error': 'Data not found'})
+        self.assertEqual(layers['Over All Site Info']['status_count'], 7880)
+
+        self.assertEqual(self.post(['Over All Site Info', 'Nothing']).status_code, 400)
+
+    async def test_async_batch_matches_sync(self):
+        options = ['Static JSON + STACOV File', 'Over All Site Info']
+        payload = {'input': {'options': options, 'date': '2024-04-16T00:00:00.000Z', 'format': 'columns'}}
+        response = await self.async_client.post('/api/json/async/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        sync = self.client.post('/api/json/', payload, content_type='application/json')
+        self.assertEqual(response.content, sync.content)
+
+
+class PrecomputeLayersTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def post(self, options):
+        payload = {'input': {'options': options, 'date': '2024-04-16T00:00:00.000Z'}}
+        return self.client.post('/api/json/', payload, content_type='application/json')
+
+    def test_view_serves_artifacts(self):
+        live = self.post('Over All Site Info').content
+        out = io.StringIO()
+        call_command('precompute_layers', '--layers', 'sites', '--workers', '1', stdout=out)
+        self.assertIn('sites: 1 built', out.getvalue())
+
+        source = os.path.join(settings.BASE_DIR, 'static', 'site_id.csv')
+        self.assertIsNotNone(artifact_store.get('sites', None, 'geojson', [source]))
+        self.assertEqual(self.post('Over All Site Info').content, live)
+
+        # Unchanged inputs are not rebuilt
+        call_command('precompute_layers', '--layers', 'sites', '--workers', '1', stdout=out)
+        self.assertIn('sites: 1 skipped', out.getvalue())
+
+    def test_dataset_artifacts_keyed_on_version(self):
+        csv_path = os.path.join(self.tmp_dir, 'opusnet_converted_corrected.csv')
+        shutil.copy(os.path.join(settings.BASE_DIR, 'static', 'opusnet_converted_corrected.csv'), csv_path)
+        obj = StoredObject(csv_path, '"etag-1"')
+        day = datetime(2024, 4, 16)
+        self.assertEqual(precompute_day('opusnet', day, obj, ['geojson']), 'built')
+
+        # A re-download of the same object gets a new mtime, not a new key
+        stat = os.stat(csv_path)
+        os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(precompute_day('opusnet', day, obj, ['geojson']), 'skipped')
+        self.assertIsNotNone(artifact_store.get('opusnet', '2024-04-16', 'geojson', [csv_path], {csv_path: obj.version}))
+        self.assertEqual(precompute_day('opusnet', day, obj._replace(version='"etag-2"'), ['geojson']), 'built')
+
+    def test_stacov_day(self):
+        live = self.post('Initial Load')
+        self.assertEqual(precompute_day('stacov', datetime(2024, 4, 16), None, ['geojson', 'columns']), 'built')
+        self.assertEqual(precompute_day('stacov', datetime(2024, 4, 16), None, ['geojson']), 'skipped')
+        response = self.post('Initial Load')
+        self.assertEqual(response.content, live.content)
+        self.assertEqual(response['ETag'], live['ETag'])
+
+
+class TimingTests(SimpleTestCase):
+    def setUp(self):
+        metrics.clear()
+
+    def post(self, path='/api/json/'):
+        payload = {'input': {'options': 'Initial Load', 'date': '2024-04-16T00:00:00.000Z'}}
+        return self.client.post(path, payload, content_type='application/json')
+
+    def test_server_timing_and_metrics(self):
+        response = self.post()
+        stages = dict(entry.split(';dur=') for entry in response['Server-Timing'].split(', '))
+        self.assertIn('total', stages)
+        self.assertGreaterEqual(float(stages['total']), max(float(value) for value in stages.values()))
+
+        with stage('unit'):
+            pass
+        text = self.client.get('/metrics/').content.decode()
+        self.assertIn('cors_request_seconds_count{route="api/json/"} 1', text)
+        self.assertIn('cors_stage_seconds_count{stage="unit"} 1', text)
+        self.assertIn('cors_cache_requests_total{cache="', text)
+
+    def test_timing_visible_to_allowed_origins(self):
+        payload = {'input': {'options': 'Initial Load', 'date': '2024-04-16T00:00:00.000Z'}}
+        origin = 'https://cors-dashboard-frontend.vercel.app'
+        response = self.client.post('/api/json/', payload, content_type='application/json', HTTP_ORIGIN=origin)
+        self.assertEqual(response['Timing-Allow-Origin'], origin)
+        self.assertIn('Server-Timing', response['Access-Control-Expose-Headers'])
+        self.assertIn('origin', response['Vary'].lower())
+
+        response = self.client.post('/api/json/', payload, content_type='application/json',
+                                    HTTP_ORIGIN='https://example.com')
+        self.assertFalse(response.has_header('Timing-Allow-Origin'))
+        self.assertFalse(self.post().has_header('Timing-Allow-Origin'))
+
+    def test_profile_is_opt_in(self):
+        self.assertEqual(self.post('/api/json/?profile').status_code, 200)
+        with override_settings(CORS_PROFILING=True):
+            response = self.post('/api/json/?profile')
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertEqual(response['X-Profiled-Status'], '200')
+        self.assertIn(b'function calls', response.content)
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    def test_results_saved_and_compared(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        output = os.path.join(tmp_dir, 'results.json')
+        out = io.StringIO()
+        call_command('benchmark', '--filter', 'ecef_to_llh.1000', '--filter', 'e2e.opusnet.warm',
+                     '--repeat', '1', '--output', output, stdout=out)
+        with open(output) as results_file:
+            report = json.load(results_file)
+        self.assertIn('e2e.opusnet.warm', report['results'])
+        self.assertNotIn('e2e.opusnet.cold_worker', report['results'])
+        self.assertGreater(report['results']['parse.ecef_to_llh.1000']['median_s'], 0)
+
+        # Against itself with an impossible threshold, everything regresses
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--filter', 'ecef_to_llh.1000', '--repeat', '1', '--compare', output,
+                         '--threshold', '0', '--fail-on-regression', stdout=out)
+        self.assertIn('REGRESSION', out.getvalue())
+
+
+class DisplacementTests(SimpleTestCase):
+    def solution(self):
+        with open(os.path.join(settings.BASE_DIR, 'static', '24apr16NOAM4.0_ambres_nfx20.stacov'), 'rb') as file:
+            return read_stacov(file)[2]
+
+    def test_known_shift_is_recovered(self):
+        before = self.solution()
+        after = before.iloc[::-1].reset_index(drop=True)
+        after = after.drop(index=5).reset_index(drop=True)
+
+        # Move one station 2 cm north and 1 cm up, everything else stays
+        row = int(np.flatnonzero(after['Station Name'] == before['Station Name'][0])[0])
+        lat, lon = np.radians(before['Latitude'][0]), np.radians(before['Longitude'][0])
+        north = np.array([-np.sin(lat) * np.cos(lon), -np.sin(lat) * np.sin(lon), np.cos(lat)])
+        up = np.array([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+        shift = 0.02 * north + 0.01 * up
+        for axis, delta in zip(('X', 'Y', 'Z'), shift):
+            after.loc[row, axis] += delta
+
+        stations, columns = station_displacement(before, after)
+        self.assertEqual(len(stations), len(before) - 1)
+        self.assertTrue(np.all(stations[:-1] <= stations[1:]))
+        i = int(np.searchsorted(stations, before['Station Name'][0]))
+        np.testing.assert_allclose([columns['east'][i], columns['north'][i], columns['up'][i]],
+                                   [0, 0.02, 0.01], atol=1e-6)
+        self.assertEqual(np.abs(np.delete(columns['up'], i)).max(), 0)
+        # A rotation keeps the total variance: both days' ECEF variances
+        sigmas = before.set_index('Station Name').loc[stations]
+        np.testing.assert_allclose(columns['sigma_east'] ** 2 + columns['sigma_north'] ** 2 + columns['sigma_up'] ** 2,
+                                   2 * (sigmas['Sigma X'] ** 2 + sigmas['Sigma Y'] ** 2 + sigmas['Sigma Z'] ** 2))
+        self.assertEqual(list(stations[moved(columns, 3)]), [before['Station Name'][0]])
+
+    def test_endpoint(self):
+        dates = ['2024-04-17T00:00:00.000Z', '2024-04-15T00:00:00.000Z', '2024-04-16T00:00:00.000Z']
+        response = self.client.post('/api/displacement/', {'input': {'dates': dates, 'stations': ['P123', 'ZDV1']}},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual([(pair['from'], pair['to']) for pair in body['pairs']],
+                         [('2024-04-15', '2024-04-16'), ('2024-04-16', '2024-04-17')])
+        self.assertLessEqual(set(body['pairs'][0]['columns']['station']), {'P123', 'ZDV1'})
+
+        response = self.client.post('/api/displacement/', {'input': {'dates': dates[:1]}},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class MatchingTests(SimpleTestCase):
+    def test_nearest_matches_brute_force(self):
+        sites = get_site_registry()
+        rng = np.random.default_rng(0)
+        lon = np.concatenate([sites.lon[:500] + rng.normal(0, 0.05, 500), rng.uniform(-180, 180, 200), [179.99]])
+        lat = np.concatenate([sites.lat[:500] + rng.normal(0, 0.05, 500), rng.uniform(-89, 89, 200), [65]])
+        distances = great_circle_distance(lon[:, None], lat[:, None], sites.lon, sites.lat)
+        for max_distance in (2000, 20_000, 200_000, 20_000_000):
+            with self.subTest(max_distance=max_distance):
+                rows, found = sites.site_index.nearest(lon, lat, max_distance)
+                closest = distances.min(axis=1)
+                within = closest <= max_distance
+                np.testing.assert_array_equal(rows >= 0, within)
+                np.testing.assert_array_equal(found[within], closest[within])
+
+    def test_huge_max_distance(self):
+        sites = get_site_registry()
+        lon = np.random.default_rng(0).uniform(-180, 180, 500)
+        started = time.monotonic()
+        rows, _ = sites.site_index.nearest(lon, np.zeros(500), 1e12)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertTrue(np.all(rows >= 0))
+
+        for max_distance in (1e12, -1, 'far'):
+            with self.subTest(max_distance=max_distance):
+                response = self.client.post('/api/residuals/', {'input': {
+                    'date': '2024-04-16T00:00:00.000Z', 'max_distance': max_distance,
+                }}, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+
+    def test_residuals(self):
+        sites = get_site_registry()
+        codes = ['BRUS', 'ZIMM', 'GRAZ']
+        rows = sites.index_of(codes)
+        # BRUS 0.001 degrees north, ZIMM under an unknown code at the same
+        # place, GRAZ under an unknown code far from any site
+        df = pd.DataFrame({
+            'Station': ['BRUS', 'ZIMMX', 'GRAZX'],
+            'Longitude': [sites.lon_exact[rows[0]], sites.lon_exact[rows[1]], 0.0],
+            'Latitude': [sites.lat_exact[rows[0]] + 0.001, sites.lat_exact[rows[1]], -60.0],
+        })
+        body = json.loads(encode_residuals('2024-04-16', df, sites, 5000))
+        self.assertEqual((body['count'], body['matched'], body['unmatched']), (3, 2, ['GRAZX']))
+        self.assertEqual(body['columns']['site'], ['BRUS', 'ZIMM'])
+        self.assertEqual(body['columns']['match'], ['code', 'nearest'])
+        np.testing.assert_allclose(body['columns']['north'], [111.25, 0], atol=0.05)
+        np.testing.assert_allclose(body['columns']['east'], [0, 0], atol=1e-6)
+        self.assertAlmostEqual(body['summary']['rms_m'], body['columns']['residual'][0] / np.sqrt(2))
+        self.assertAlmostEqual(body['summary']['p50_m'], body['columns']['residual'][0] / 2)
+
+    def test_prediction_on_site(self):
+        sites = get_site_registry()
+        codes = ['BRUS', 'ZIMM', 'GRAZ']
+        rows = sites.index_of(codes)
+        # Rounding to 0.001 degrees moves these sites by metres
+        offsets = great_circle_distance(sites.lon[rows], sites.lat[rows], sites.lon_exact[rows], sites.lat_exact[rows])
+        self.assertTrue(np.all(offsets > 1))
+
+        df = pd.DataFrame({
+            'Station': codes + [code + 'X' for code in codes],
+            'Longitude': np.tile(sites.lon_exact[rows], 2),
+            'Latitude': np.tile(sites.lat_exact[rows], 2),
+        })
+        body = json.loads(encode_residuals('2024-04-16', df, sites, 1))
+        self.assertEqual(body['matched'], 6)
+        self.assertEqual(body['columns']['site'], codes * 2)
+        self.assertEqual(body['columns']['match'], ['code'] * 3 + ['nearest'] * 3)
+        np.testing.assert_allclose(body['columns']['residual'], 0, atol=1e-6)
+        self.assertEqual(body['columns']['site_lat'], list(df['Latitude']))
+
+
+class ViewportTests(SimpleTestCase):
+    def post(self, **members):
+        payload = {'input': {'options': 'Over All Site Info', 'date': '2024-04-16T00:00:00.000Z', **members}}
+        response = self.client.post('/api/json/', payload, content_type='application/json')
+        return json.loads(response.content)
+
+    def test_grid_index_matches_mask(self):
+        sites = get_site_registry()
+        index = GridIndex(sites.lon, sites.lat, cell_size=2.5)
+        for viewport in [Viewport(-125, 24, -66, 50, None), Viewport(-90.3, 29.9, -89.7, 30.4, None),
+                         Viewport(170, 50, -150, 72, None), Viewport(-180, -90, 180, 90, None)]:
+            with self.subTest(viewport=viewport):
+                expected = np.flatnonzero(in_viewport(viewport, sites.lon, sites.lat))
+                np.testing.assert_array_equal(index.query(viewport), expected)
+
+    def test_bbox_and_clusters(self):
+        bbox = [-100, 30, -90, 40]
+        visible = self.post(bbox=bbox, zoom=10)['features']
+        self.assertTrue(visible)
+        for feature in visible:
+            lon, lat = feature['geometry']['coordinates']
+            self.assertTrue(-100 <= lon <= -90 and 30 <= lat <= 40)
+
+        clustered = self.post(bbox=bbox, zoom=3)
+        self.assertEqual(clustered['status_count'], 7880)
+        counts = [feature['properties'].get('point_count', 1) for feature in clustered['features']]
+        self.assertLess(len(counts), len(visible))
+        self.assertEqual(sum(counts), len(visible))
+
+    def test_zoom_out_of_range(self):
+        for zoom in (-2000, -1, 25, 10 ** 6):
+            with self.subTest(zoom=zoom):
+                payload = {'input': {'options': 'Over All Site Info', 'bbox': [-100, 30, -90, 40], 'zoom': zoom}}
+                response = self.client.post('/api/json/', payload, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(json.loads(response.content), {'error': 'zoom must be from 0 to 24'})
+        self.assertEqual(self.post(bbox=[-100, 30, -90, 40], zoom=0)['status_count'], 7880)
+
+
+def read_protobuf(data):
+    """
+    Minimal protobuf reader: [(field number, int or bytes value)].
+    """
+    fields, i = [], 0
+
+    def varint():
+        nonlocal i
+        value, shift = 0, 0
+        while True:
+            byte = data[i]
+            i += 1
+            value |= (byte & 0x7F) << shift
+            shift += 7
+            if byte < 0x80:
+                return value
+
+    while i < len(data):
+        key = varint()
+        if key & 7 == 0:
+            fields.append((key >> 3, varint()))
+        elif key & 7 == 2:
+            length = varint()
+            fields.append((key >> 3, data[i:i + length]))
+            i += length
+        else:
+            fields.append((key >> 3, data[i:i + 8]))
+            i += 8
+    return fields
+
+
+class VectorTileTests(SimpleTestCase):
+    def test_site_tile(self):
+        response = self.client.get('/tiles/sites/any/4/3/6.pbf')
+        self.assertEqual(response['Content-Type'], 'application/vnd.mapbox-vector-tile')
+        (number, layer), = read_protobuf(response.content)
+        layer = read_protobuf(layer)
+        self.assertEqual(number, 3)
+        self.assertIn((1, b'sites'), layer)
+        self.assertIn((5, EXTENT), layer)
+        self.assertEqual([key for number, key in layer if number == 3], [b'SITEID', b'STATUS', b'Description', b'DOMES'])
+
+        # Every site inside the tile (plus its buffer) is in it, in tile coordinates
+        sites = get_site_registry()
+        expected = np.flatnonzero(in_viewport(tile_bounds(4, 3, 6), sites.lon, sites.lat))
+        features = [read_protobuf(value) for number, value in layer if number == 2]
+        self.assertEqual(len(features), len(expected))
+        for feature in features:
+            # Packed geometry starting with a single MoveTo
+            self.assertEqual(dict(feature)[4][0], 9)
+
+    def test_unknown_layer_and_out_of_range_tile(self):
+        self.assertEqual(self.client.get('/tiles/nope/2024-04-16/0/0/0.pbf').status_code, 404)
+        self.assertEqual(self.client.get('/tiles/stacov/2024-04-16/2/4/0.pbf').status_code, 404)
+        self.assertEqual(self.client.get('/tiles/stacov/2023-01-01/0/0/0.pbf').status_code, 404)
+
+
+class StationCubeTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.static_dir = os.path.join(settings.BASE_DIR, 'static')
+
+    def test_cube_matches_daily_files(self):
+        cube = load_cube(self.static_dir)
+        file_paths = stacov_files(self.static_dir)
+        self.assertEqual(len(cube.days), 48)
+
+        file_path = file_paths[2]
+        with open(file_path, 'rb') as file:
+            df_xyz = read_stacov(file)[2]
+        day = stacov_day(file_path)
+        days, stations, values = cube.query(day, day, list(df_xyz['Station Name']) + ['NOPE'])
+        self.assertEqual(list(days), [day])
+        np.testing.assert_array_equal(values['latitude'][0, :-1], df_xyz['Latitude'])
+        np.testing.assert_array_equal(values['sigma_z'][0, :-1], df_xyz['Sigma Z'])
+        self.assertTrue(np.isnan(values['height'][0, -1]))
+
+    def test_range_endpoint(self):
+        payload = {'input': {'start': '2024-04-30T00:00:00.000Z', 'end': '2024-05-02T00:00:00.000Z',
+                             'stations': ['1LSU', 'NOPE'], 'fields': ['height', 'sigma_x']}}
+        response = self.client.post('/api/range/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body['days'], ['2024-04-30', '2024-05-01', '2024-05-02'])
+        self.assertEqual(body['stations'], ['1LSU', 'NOPE'])
+        self.assertEqual(list(body['fields']), ['height', 'sigma_x'])
+        self.assertEqual([row[1] for row in body['fields']['height']], [None] * 3)
+
+        payload['input']['fields'] = ['speed']
+        response = self.client.post('/api/range/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class TimeSeriesTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_binary_copy_matches_text(self):
+        series = load_timeseries('CLGO', os.path.join(settings.BASE_DIR, 'static'))
+        text = pd.read_csv(os.path.join(settings.BASE_DIR, 'static', 'CLGO.pfiles'), sep=r'\s+', header=None)
+        self.assertEqual(len(series), len(text))
+        np.testing.assert_array_equal(series.records['mjd'], text[2])
+        np.testing.assert_allclose(series.records['longitude'] + 360, text[3], rtol=0, atol=1e-9)
+
+    def test_range_endpoint(self):
+        payload = {'input': {'station': 'mena', 'start': '2015-07-01T00:00:00.000Z', 'end': '2015-07-02T00:00:00.000Z'}}
+        response = self.client.post('/api/timeseries/', payload, content_type='application/json')
+        body = json.loads(response.content)
+        self.assertEqual(body['count'], 2)
+        self.assertEqual(body['columns']['mjd'], [57204.5, 57205.5])
+
+    def test_downsampling(self):
+        x = np.arange(10000, dtype=float)
+        y = np.sin(x / 300) + (x == 5000) * 10
+        index = lttb(x, y, 200)
+        self.assertEqual(len(index), 200)
+        self.assertEqual((index[0], index[-1]), (0, 9999))
+        self.assertTrue(np.all(np.diff(index) > 0))
+        self.assertIn(5000, minmax(y, 200))
+        self.assertIn(int(np.argmin(y)), minmax(y, 200))
+
+
+class PartitionedTableTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.csv_path = os.path.join(settings.BASE_DIR, 'static', 'opusnet_converted_corrected.csv')
+
+    def test_day_slice_matches_full_scan(self):
+        table = load_table('opusnet', self.id(), lambda: self.csv_path)
+        df = pd.read_csv(self.csv_path)
+        dates = pd.to_datetime(df['measurement_date'], dayfirst=True, errors='coerce')
+        self.assertEqual(len(table), len(df))
+
+        for date in ['2018-10-27', '2021-06-30', '2024-04-16', '1990-01-01']:
+            with self.subTest(date=date):
+                expected = df[dates.dt.date == pd.to_datetime(date).date()]
+                day = table.read_day(date)
+                self.assertEqual(list(day['id']), list(expected['id']))
+                self.assertEqual(list(day['site_id']), list(expected['site_id']))
+                np.testing.assert_array_equal(day['latitude'], expected['latitude'])
+
+        input_date = datetime(2024, 4, 16)
+        streamed = ''.join(generate_OPUSNET_geojson(table.read_day(input_date), input_date))
+        self.assertEqual(streamed, ''.join(generate_OPUSNET_geojson(df, input_date)))
+
+    def test_site_history_matches_full_scan(self):
+        table = load_table('opusnet', self.id(), lambda: self.csv_path)
+        df = pd.read_csv(self.csv_path)
+        dates = pd.to_datetime(df['measurement_date'], dayfirst=True, errors='coerce')
+        df = df[dates.notna()].assign(day=dates.dt.date).sort_values('day', kind='stable')
+
+        for site, start, end in [('1LSU', None, None), ('1LSU', '2019-01-01', '2021-12-31'),
+                                 (df['site_id'].iloc[-1], '2024-04-16', '2024-04-16'), ('NONE', None, None)]:
+            with self.subTest(site=site, start=start, end=end):
+                expected = df[df['site_id'] == site]
+                if start is not None:
+                    expected = expected[(expected['day'] >= pd.to_datetime(start).date())
+                                        & (expected['day'] <= pd.to_datetime(end).date())]
+                history = table.read_site(site, start, end)
+                self.assertEqual(list(history['id']), list(expected['id']))
+                np.testing.assert_array_equal(history['lat_uncertain'], expected['lat_uncertain'])
+
+        body = json.loads(encode_history('opusnet', '1LSU', table.read_site('1LSU'), 'measurement_date'))
+        self.assertEqual(body['count'], len(body['columns']['measurement_date']))
+        self.assertRegex(body['columns']['measurement_date'][0], r'^\d{4}-\d{2}-\d{2}$')
+
+    def test_new_version_replaces_old(self):
+        old = load_table('opusnet', self.id() + '-v1', lambda: self.csv_path)
+        self.assertTrue(os.path.exists(old.path))
+        new = load_table('opusnet', self.id() + '-v2', lambda: self.csv_path)
+        self.assertNotEqual(old.path, new.path)
+        # The previous version is kept for readers still using it
+        self.assertTrue(os.path.exists(old.path))
+        load_table('opusnet', self.id() + '-v3', lambda: self.csv_path)
+        self.assertFalse(os.path.exists(old.path))
+
+
+class DatasetManagerTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=os.path.join(self.tmp_dir, 'cache'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        static_dir = os.path.join(settings.BASE_DIR, 'static')
+        self.bucket_dir = os.path.join(self.tmp_dir, 'bucket')
+        self.stacov_dir = os.path.join(self.tmp_dir, 'static')
+        os.makedirs(self.bucket_dir)
+        os.makedirs(self.stacov_dir)
+        self.stacov_sources = stacov_files(static_dir)[:3]
+        for file_path in self.stacov_sources[:2]:
+            shutil.copy(file_path, self.stacov_dir)
+        self.csv_path = os.path.join(self.bucket_dir, 'opusnet_converted_corrected.csv')
+        shutil.copy(os.path.join(static_dir, 'opusnet_converted_corrected.csv'), self.csv_path)
+        self.manager = DatasetManager(LocalStorage(self.bucket_dir), self.stacov_dir, interval=60)
+
+    def test_rebuilds_only_what_changed(self):
+        names = [os.path.basename(file_path) for file_path in self.stacov_sources]
+        self.assertEqual(self.manager.refresh(), ['opusnet'] + names[:2])
+        old = self.manager.dataset('opusnet')
+        old_cube = self.manager.current().cube
+        self.assertEqual(len(old_cube.days), 2)
+        self.assertEqual(self.manager.refresh(), [])
+        self.assertIs(self.manager.dataset('opusnet'), old)
+        self.assertIs(self.manager.current().cube, old_cube)
+
+        # Replace the CSV with its first 1000 rows and add a STACOV day
+        pd.read_csv(self.csv_path).head(1000).to_csv(self.csv_path, index=False)
+        shutil.copy(self.stacov_sources[2], self.stacov_dir)
+        self.assertEqual(self.manager.refresh(), ['opusnet', names[2]])
+        new = self.manager.dataset('opusnet')
+        self.assertEqual(len(new.table), 1000)
+        self.assertEqual(len(self.manager.current().cube.days), 3)
+
+        # The old snapshot stays readable after its files were replaced
+        self.assertTrue(os.path.exists(old.table.path))
+        self.assertEqual(len(old.table), 6260)
+        self.assertEqual(len(old.table.read_day('2024-04-16')), 3)
+
+    def test_site_files_rebuild_registry(self):
+        static_dir = os.path.join(settings.BASE_DIR, 'static')
+        for name in ('site_id.csv', 'CORS_All_Site_data.json'):
+            shutil.copy(os.path.join(static_dir, name), self.stacov_dir)
+        sites_path = os.path.join(self.stacov_dir, 'site_id.csv')
+        self.assertIn('site_id.csv', self.manager.refresh())
+        old = self.manager.current().sites
+        self.assertEqual(len(old), 7880)
+        self.assertEqual(self.manager.refresh(), [])
+        self.assertIs(self.manager.current().sites, old)
+
+        pd.read_csv(sites_path).head(10).to_csv(sites_path, index=False)
+        self.assertEqual(self.manager.refresh(), ['site_id.csv'])
+        self.assertEqual(len(self.manager.current().sites), 10)
+        self.assertIs(get_site_registry(self.stacov_dir), self.manager.current().sites)
+
+    def test_site_info_follows_site_file(self):
+        static_dir = os.path.join(self.tmp_dir, 'base', 'static')
+        os.makedirs(static_dir)
+        for name in ('site_id.csv', 'CORS_All_Site_data.json'):
+            shutil.copy(os.path.join(settings.BASE_DIR, 'static', name), static_dir)
+        settings_override = override_settings(BASE_DIR=os.path.join(self.tmp_dir, 'base'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        def post():
+            payload = {'input': {'options': 'Over All Site Info', 'date': '2024-04-16T00:00:00.000Z'}}
+            return json.loads(self.client.post('/api/json/', payload, content_type='application/json').content)
+
+        self.assertEqual(post()['status_count'], 7880)
+        sites_path = os.path.join(static_dir, 'site_id.csv')
+        pd.read_csv(sites_path).head(10).to_csv(sites_path, index=False)
+        geojson = post()
+        self.assertEqual(geojson['status_count'], 10)
+        self.assertEqual(len(geojson['features']), 10)
+
+    def test_requests_read_the_snapshot(self):
+        static_dir = os.path.join(self.tmp_dir, 'base', 'static')
+        os.makedirs(static_dir)
+        for name in ('site_id.csv', 'CORS_All_Site_data.json'):
+            shutil.copy(os.path.join(settings.BASE_DIR, 'static', name), static_dir)
+        settings_override = override_settings(BASE_DIR=os.path.join(self.tmp_dir, 'base'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        manager = DatasetManager(LocalStorage(self.bucket_dir), static_dir, interval=60)
+        manager.refresh()
+
+        def post():
+            payload = {'input': {'options': 'Over All Site Info', 'date': '2024-04-16T00:00:00.000Z'}}
+            return json.loads(self.client.post('/api/json/', payload, content_type='application/json').content)
+
+        sites_path = os.path.join(static_dir, 'site_id.csv')
+        with patch.object(views, 'dataset_manager', manager):
+            self.assertEqual(post()['status_count'], 7880)
+
+            # A changed file is picked up by the next poll, not by requests
+            pd.read_csv(sites_path).head(10).to_csv(sites_path, index=False)
+            with patch.object(views, 'get_site_registry', side_effect=AssertionError):
+                self.assertEqual(post()['status_count'], 7880)
+            manager.refresh()
+            self.assertEqual(post()['status_count'], 10)
+
+    def test_stale_snapshot_is_not_used(self):
+        self.manager.refresh()
+        self.assertIsNotNone(self.manager.current())
+        self.manager.snapshot = self.manager.snapshot._replace(created=time.monotonic() - 181)
+        self.assertIsNone(self.manager.current())
+        self.assertIsNone(self.manager.dataset('opusnet'))
+
+    def test_background_thread(self):
+        # The first poll waits one interval, and stop() does not
+        slow = DatasetManager(LocalStorage(self.bucket_dir), self.stacov_dir, interval=60)
+        slow.start()
+        time.sleep(0.1)
+        self.assertIsNone(slow.snapshot)
+        started = time.monotonic()
+        slow.stop()
+        self.assertLess(time.monotonic() - started, 5)
+
+        manager = DatasetManager(LocalStorage(self.bucket_dir), self.stacov_dir, interval=0.05)
+        manager.start()
+        self.addCleanup(manager.stop)
+        deadline = time.monotonic() + 30
+        while manager.dataset('opusnet') is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIsNotNone(manager.dataset('opusnet'))
+
+
+class FakeS3Client:
+    """
+    Minimal get_object stand-in that honours IfNoneMatch like S3 does.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.calls = []
+
+    def get_object(self, Bucket, Key, IfNoneMatch=None):
+        self.calls.append((Key, IfNoneMatch))
+        body, etag = self.objects[Key]
+        if IfNoneMatch == etag:
+            raise ClientError({'Error': {'Code': '304', 'Message': 'Not Modified'},
+                               'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': io.BytesIO(body), 'ETag': etag}
+
+
+class S3StorageTests(SimpleTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        settings_override = override_settings(CORS_CACHE_DIR=self.tmp_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = FakeS3Client({'data.csv': (b'a,b\n1,2\n', '"v1"')})
+
+    def test_cached_within_ttl_then_revalidated(self):
+        storage = S3Storage('bucket', self.client, ttl=60)
+        first = storage.fetch('data.csv')
+        self.assertEqual(first.version, '"v1"')
+        with open(first.path, 'rb') as file:
+            self.assertEqual(file.read(), b'a,b\n1,2\n')
+        storage.fetch('data.csv')
+        self.assertEqual(self.client.calls, [('data.csv', None)])
+
+        # A new worker revalidates the file on disk instead of downloading it
+        S3Storage('bucket', self.client, ttl=60).fetch('data.csv')
+        self.assertEqual(self.client.calls[-1], ('data.csv', '"v1"'))
+
+        self.client.objects['data.csv'] = (b'a,b\n3,4\n', '"v2"')
+        updated = S3Storage('bucket', self.client, ttl=0).fetch('data.csv')
+        self.assertEqual(updated.version, '"v2"')
+        with open(updated.path, 'rb') as file:
+            self.assertEqual(file.read(), b'a,b\n3,4\n')
+
+    def test_new_version_leaves_previous_file(self):
+        storage = S3Storage('bucket', self.client, ttl=0)
+        first = storage.fetch('data.csv')
+        self.client.objects['data.csv'] = (b'a,b\n3,4\n', '"v2"')
+        second = storage.fetch('data.csv')
+        self.assertNotEqual(second.path, first.path)
+        with open(first.path, 'rb') as file:
+            self.assertEqual(file.read(), b'a,b\n1,2\n')
+
+        # Versions before the previous one are removed
+        self.client.objects['data.csv'] = (b'a,b\n5,6\n', '"v3"')
+        third = storage.fetch('data.csv')
+        self.assertFalse(os.path.exists(first.path))
+        self.assertTrue(os.path.exists(second.path))
+        self.assertEqual(storage.fetch('data.csv'), third)
+
+    def test_shared_client(self):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            clients = set(map(id, pool.map(lambda _: get_s3_client(), range(8))))
+        self.assertEqual(len(clients), 1)
+
+    def test_concurrent_fetches_share_one_download(self):
+        storage = S3Storage('bucket', self.client, ttl=60)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            versions = set(pool.map(lambda _: storage.fetch('data.csv').version, range(16)))
+        self.assertEqual(versions, {'"v1"'})
+        self.assertEqual(len(self.client.calls), 1)
+
+
+class SiteRegistryTests(SimpleTestCase):
+    def test_lookups_match_set_semantics(self):
+        sites = get_site_registry()
+        self.assertEqual(len(sites), 7880)
+
+        with open(os.path.join(settings.BASE_DIR, 'static', '24apr16NOAM4.0_ambres_nfx20.stacov'), 'rb') as file:
+            present = read_stacov(file)[2]['Station Name']
+        missing = sites.missing_cors_sites(present)
+        expected = [siteid not in set(present) for siteid in sites.cors_siteid]
+        self.assertEqual(list(missing), expected)
+
+        index = sites.index_of(['BRUS', 'MOSI', 'NOPE'])
+        self.assertEqual(sites.code[index[0]], 'BRUS')
+        self.assertEqual(sites.code[index[1]], 'MOSI')
+        self.assertEqual(index[2], -1)
+        self.assertEqual(sites.lon[index[1]], round(269 + 32 / 60 + 19.0 / 3600, 3) - 360)
@@ -0,0 +1,212 @@
+import glob
+import json
+import os
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+
+from .cache import cache_path, file_signature
+from .geojson import encode_column
+
+# Days between the MJD epoch (1858-11-17) and 1970-01-01
+MJD_UNIX_EPOCH = 40587
+
+# .pfiles columns after the station code. Longitudes are stored in
+# -180..180 like the site registry; sigmas are in millimetres and the
+# last three columns are the east-north, east-up and north-up
+# correlations of the daily solution.
+PFILES_DTYPE = np.dtype([
+    ('decimal_year', 'f8'),
+    ('mjd', 'f8'),
+    ('longitude', 'f8'),
+    ('latitude', 'f8'),
+    ('height', 'f8'),
+    ('sigma_east', 'f8'),
+    ('sigma_north', 'f8'),
+    ('sigma_up', 'f8'),
+    ('corr_en', 'f8'),
+    ('corr_eu', 'f8'),
+    ('corr_nu', 'f8'),
+])
+
+STATION_CODE = re.compile(r'^[A-Za-z0-9]{4}$')
+
+
+def read_pfiles(file):
+    """
+    Parse a .pfiles station time series into a PFILES_DTYPE record array
+    sorted by MJD.
+    """
+    columns = ['decimal_year', 'station', 'mjd', 'longitude', 'latitude', 'height',
+               'sigma_east', 'sigma_north', 'sigma_up', 'corr_en', 'corr_eu', 'corr_nu']
+    df = pd.read_csv(file, sep=r'\s+', header=None, usecols=range(12), names=columns,
+                     float_precision='round_trip')
+
+    records = np.empty(len(df), dtype=PFILES_DTYPE)
+    for name in PFILES_DTYPE.names:
+        records[name] = df[name].to_numpy(dtype=float)
+    records['longitude'] = np.where(records['longitude'] > 180, records['longitude'] - 360, records['longitude'])
+    return records[np.argsort(records['mjd'], kind='stable')]
+
+
+class StationTimeSeries:
+    """
+    One station's daily solutions as a memory-mapped record array in MJD
+    order, so a date range is found by binary search and read as one
+    contiguous block.
+    """
+
+    def __init__(self, station, path):
+        self.station = station
+        self.path = path
+        self.records = np.load(path, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.records)
+
+    def mjd_range(self, start_mjd=None, end_mjd=None):
+        """
+        Return the (start, stop) row range with start_mjd <= MJD < end_mjd.
+        """
+        mjd = self.records['mjd']
+        start = 0 if start_mjd is None else int(np.searchsorted(mjd, start_mjd, side='left'))
+        stop = len(mjd) if end_mjd is None else int(np.searchsorted(mjd, end_mjd, side='left'))
+        return start, max(start, stop)
+
+    def read(self, start_mjd=None, end_mjd=None):
+        start, stop = self.mjd_range(start_mjd, end_mjd)
+        return np.asarray(self.records[start:stop])
+
+
+def timeseries_path(station, signature):
+    mtime_ns, size = signature
+    return cache_path('timeseries', f'{station}-{mtime_ns}-{size}.npy')
+
+
+def write_timeseries(source_path, path):
+    """
+    Convert a .pfiles file to the binary layout at path, removing copies
+    built from earlier versions of the same file.
+    """
+    with open(source_path, 'rb') as file:
+        records = read_pfiles(file)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'wb') as tmp:
+        np.save(tmp, records)
+    os.replace(tmp_path, path)
+
+    station = os.path.basename(path).split('-')[0]
+    for stale in glob.glob(os.path.join(os.path.dirname(path), f'{station}-*.npy')):
+        if stale != path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+_series = {}
+_series_lock = threading.Lock()
+
+
+def load_timeseries(station, static_dir):
+    """
+    Return the StationTimeSeries for static_dir/<station>.pfiles,
+    converting the text file on first use and whenever it changes.
+    Raises FileNotFoundError for unknown stations.
+    """
+    if not STATION_CODE.match(station):
+        raise FileNotFoundError(f"No time series for {station}")
+    source_path = os.path.join(static_dir, f'{station}.pfiles')
+    if not os.path.exists(source_path):
+        raise FileNotFoundError(f"No time series for {station}")
+
+    path = timeseries_path(station, file_signature(source_path))
+    series = _series.get(station)
+    if series is not None and series.path == path:
+        return series
+
+    with _series_lock:
+        series = _series.get(station)
+        if series is None or series.path != path:
+            if not os.path.exists(path):
+                write_timeseries(source_path, path)
+            series = _series[station] = StationTimeSeries(station, path)
+        return series
+
+
+def lttb(x, y, points):
+    """
+    Largest-Triangle-Three-Buckets downsampling: indices of at most
+    points samples that keep the visual shape of y(x). The first and last
+    samples are always kept.
+    """
+    n = len(x)
+    if points >= n or points < 3:
+        return np.arange(n)
+
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, stop = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third vertex
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_x = x[stop:next_stop].mean()
+        next_y = y[stop:next_stop].mean()
+        area = np.abs((x[a] - next_x) * (y[start:stop] - y[a])
+                      - (x[a] - x[start:stop]) * (next_y - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(y, points):
+    """
+    Min/max decimation: split the samples into points // 2 buckets and
+    keep the lowest and highest sample of each, in their original order.
+    Unlike LTTB this never hides an outlier.
+    """
+    n = len(y)
+    if points >= n or points < 2:
+        return np.arange(n)
+    buckets = points // 2
+
+    bucket = np.arange(n) * buckets // n
+    # Within each bucket, sorting by value puts the minimum first and the
+    # maximum last
+    order = np.lexsort((y, bucket))
+    starts = np.searchsorted(bucket[order], np.arange(buckets))
+    stops = np.append(starts[1:], n)
+    return np.unique(np.concatenate([order[starts], order[stops - 1]]))
+
+
+def downsample(records, method, points, field='height'):
+    """
+    Reduce records to about points rows with DOWNSAMPLERS[method],
+    choosing the rows by the values of field.
+    """
+    if method == 'lttb':
+        index = lttb(records['mjd'], records[field], points)
+    else:
+        index = minmax(records[field], points)
+    return records[index]
+
+
+DOWNSAMPLERS = ('lttb', 'minmax')
+
+
+def encode_timeseries(station, count, records):
+    """
+    Encode records as compact columnar JSON: {"station": ..., "count":
+    rows in the requested range, "returned": rows sent, "columns": {name:
+    [...]}}.
+    """
+    columns = ','.join(json.dumps(name) + ':[' + ','.join(encode_column(records[name])) + ']'
+                       for name in PFILES_DTYPE.names)
+    head = json.dumps({'station': station, 'count': count, 'returned': len(records)}, separators=(',', ':'))
+    return (head[:-1] + ',"columns":{' + columns + '}}').encode('utf-8')
@@ -0,0 +1,233 @@
+import bisect
+import cProfile
+import functools
+import io
+import pstats
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from corsheaders.conf import conf as cors_conf
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stage durations (seconds) of the request being handled, by stage name
+_request_timings = ContextVar('request_timings', default=None)
+
+
+class Histogram:
+    """
+    Cumulative latency histogram in the Prometheus layout: a count per
+    bucket upper bound, plus the sum and count of all observations.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Process-wide stage latencies, request latencies and cache outcomes.
+    Each worker process keeps its own; scrape every worker.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stages = defaultdict(Histogram)
+        self.requests = defaultdict(Histogram)
+        self.cache = defaultdict(int)
+
+    def observe_stage(self, name, seconds):
+        with self._lock:
+            self.stages[name].observe(seconds)
+
+    def observe_request(self, route, seconds):
+        with self._lock:
+            self.requests[route].observe(seconds)
+
+    def count_cache(self, cache, result):
+        with self._lock:
+            self.cache[cache, result] += 1
+
+    def clear(self):
+        with self._lock:
+            self.stages.clear()
+            self.requests.clear()
+            self.cache.clear()
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for metric, label, histograms, help_text in (
+                ('cors_stage_seconds', 'stage', self.stages, 'Time spent in each stage of building a response.'),
+                ('cors_request_seconds', 'route', self.requests, 'Time to produce a response, by URL route.'),
+            ):
+                lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} histogram']
+                for name, histogram in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.sum:.6f}')
+                    lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+
+            lines += ['# HELP cors_cache_requests_total Cache lookups by cache and outcome.',
+                      '# TYPE cors_cache_requests_total counter']
+            for (cache, result), count in sorted(self.cache.items()):
+                lines.append(f'cors_cache_requests_total{{cache="{cache}",result="{result}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block as one stage of the current request (reported in its
+    Server-Timing header) and of the process-wide stage histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        metrics.observe_stage(name, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+
+def timed(name):
+    """
+    Decorator form of stage().
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count_cache(cache, hit):
+    """
+    Record a cache lookup; hit is True/False or an outcome name.
+    """
+    metrics.count_cache(cache, {True: 'hit', False: 'miss'}.get(hit, hit))
+
+
+def server_timing(timings, total):
+    """
+    Server-Timing header value for stage durations in seconds.
+    """
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in timings.items()]
+    return ', '.join(entries + [f'total;dur={total * 1000:.1f}'])
+
+
+def profile_report(profiler, response):
+    """
+    Replace a response with the cProfile statistics of producing it.
+    """
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+    report = HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+    report['X-Profiled-Status'] = response.status_code
+    return report
+
+
+def timing_allow_origin(request):
+    """
+    The Origin of a request from an origin CORS allows, or None.
+    """
+    origin = request.headers.get('Origin')
+    if origin is None:
+        return None
+    if (cors_conf.CORS_ALLOW_ALL_ORIGINS or origin in cors_conf.CORS_ALLOWED_ORIGINS
+            or any(re.match(pattern, origin) for pattern in cors_conf.CORS_ALLOWED_ORIGIN_REGEXES)):
+        return origin
+    return None
+
+
+class ServerTimingMiddleware:
+    """
+    Time each request: the stages recorded with stage() are sent back in a
+    Server-Timing header and every request feeds the latency histograms
+    served at metrics/. Browsers only show Server-Timing to another
+    origin with Timing-Allow-Origin, which is set for the origins CORS
+    allows (the header itself is in CORS_EXPOSE_HEADERS).
+
+    With CORS_PROFILING on, adding ?profile to a request returns its
+    cProfile statistics instead of the response. Stages can nest (the
+    to_datetime step is part of "layer"). Streamed bodies are encoded
+    after the headers are sent, so their encoding time is not in
+    Server-Timing.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = _request_timings.set({})
+        started = time.perf_counter()
+        try:
+            if settings.CORS_PROFILING and 'profile' in request.GET:
+                profiler = cProfile.Profile()
+                response = profiler.runcall(self.get_response, request)
+                response = profile_report(profiler, response)
+            else:
+                response = self.get_response(request)
+            return self.finish(request, response, started)
+        finally:
+            _request_timings.reset(token)
+
+    async def __acall__(self, request):
+        token = _request_timings.set({})
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+            return self.finish(request, response, started)
+        finally:
+            _request_timings.reset(token)
+
+    def finish(self, request, response, started):
+        total = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        metrics.observe_request(match.route if match is not None else 'unmatched', total)
+        if settings.CORS_SERVER_TIMING:
+            response['Server-Timing'] = server_timing(_request_timings.get(), total)
+            origin = timing_allow_origin(request)
+            if origin is not None:
+                response['Timing-Allow-Origin'] = origin
+            patch_vary_headers(response, ('Origin',))
+        return response
@@ -1,6 +1,14 @@
 from django.urls import path
-from .views import StacovJsonView
+from .views import DisplacementView, ResidualView, SiteHistoryView, StacovJsonView, StationRangeView, TimeSeriesView, metrics_view, stacov_json_async, vector_tile
 
 urlpatterns = [
     path('api/json/', StacovJsonView.as_view(), name='stacov-json'),
+    path('api/json/async/', stacov_json_async, name='stacov-json-async'),
+    path('api/range/', StationRangeView.as_view(), name='station-range'),
+    path('api/timeseries/', TimeSeriesView.as_view(), name='station-timeseries'),
+    path('api/history/', SiteHistoryView.as_view(), name='site-history'),
+    path('api/displacement/', DisplacementView.as_view(), name='station-displacement'),
+    path('api/residuals/', ResidualView.as_view(), name='mycs2-residuals'),
+    path('tiles/<str:layer>/<str:date>/<int:z>/<int:x>/<int:y>.pbf', vector_tile, name='vector-tile'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
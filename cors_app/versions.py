@@ -0,0 +1,153 @@
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .cache import file_signature, stacov_cache
+from .cube import load_cube, stacov_files
+from .datasets import DATASETS, load_table
+from .registry import SITE_FILES, get_site_registry
+
+logger = logging.getLogger(__name__)
+
+# What requests read from one poll: {dataset: StoredObject carrying its
+# PartitionedTable}, {STACOV path: file signature}, the StationCube built
+# from those files (None without any), the SiteRegistry (None without the
+# site files) and when the poll finished
+DatasetSnapshot = namedtuple('DatasetSnapshot', ['objects', 'stacov', 'cube', 'sites', 'created'])
+
+EMPTY_SNAPSHOT = DatasetSnapshot({}, {}, None, None, 0)
+
+
+class DatasetManager:
+    """
+    Keeps the indexes built from the datasets current while workers run.
+
+    A background thread polls every interval seconds: the CSV datasets
+    through storage (a conditional GET on the S3 ETag, or mtime/size for
+    local files), and the STACOV and SITE_FILES files in static_dir by
+    mtime/size. Only what changed is rebuilt (the table of a replaced
+    CSV, the sidecar of a new or changed STACOV day, the cube when the
+    set of days changes, the process-wide SiteRegistry when a site file
+    changes), then the new DatasetSnapshot is swapped in with a single
+    assignment.
+
+    Requests take the snapshot once and use it throughout, so they see
+    either the old or the new version of everything and never wait for a
+    rebuild. Without a snapshot younger than max_age (the thread is not
+    running, or was frozen with the process as on serverless hosts)
+    current() returns None and requests load data themselves.
+    """
+
+    def __init__(self, storage, static_dir, interval, max_age=None):
+        self.storage = storage
+        self.static_dir = static_dir
+        self.interval = interval
+        self.max_age = max_age if max_age is not None else 3 * interval
+        self.snapshot = None
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        snapshot = self.snapshot
+        if snapshot is None or time.monotonic() - snapshot.created > self.max_age:
+            return None
+        return snapshot
+
+    def dataset(self, name):
+        """
+        The current StoredObject of a CSV dataset, with its table, or None.
+        """
+        snapshot = self.current()
+        return None if snapshot is None else snapshot.objects.get(name)
+
+    def refresh(self):
+        """
+        Poll once, rebuild what changed and swap in the new snapshot.
+        Returns the names of the datasets and STACOV files that changed.
+        """
+        with self._refresh_lock:
+            previous = self.snapshot or EMPTY_SNAPSHOT
+            changed = []
+
+            objects = {}
+            for name, spec in DATASETS.items():
+                old = previous.objects.get(name)
+                try:
+                    obj = self.storage.refresh(spec['file_name'])
+                except FileNotFoundError:
+                    continue
+                except Exception:
+                    # Keep serving the version we have until storage recovers
+                    logger.warning("Could not check %s", spec['file_name'], exc_info=True)
+                    if old is not None:
+                        objects[name] = old
+                    continue
+                if old is not None and old.version == obj.version:
+                    objects[name] = old
+                    continue
+                objects[name] = obj._replace(table=load_table(name, obj.version, lambda: obj.path))
+                changed.append(name)
+
+            stacov = {}
+            for file_path in stacov_files(self.static_dir):
+                try:
+                    stacov[file_path] = file_signature(file_path)
+                except OSError:
+                    continue
+                if previous.stacov.get(file_path) != stacov[file_path]:
+                    changed.append(os.path.basename(file_path))
+                    try:
+                        stacov_cache.load(file_path)
+                    except Exception:
+                        logger.warning("Could not parse %s", file_path, exc_info=True)
+            changed += [os.path.basename(file_path) for file_path in previous.stacov if file_path not in stacov]
+
+            cube = previous.cube
+            if stacov != previous.stacov:
+                cube = load_cube(self.static_dir) if stacov else None
+
+            sites = previous.sites
+            try:
+                # Reloads the registry requests use when a site file changed
+                sites = get_site_registry(self.static_dir)
+            except FileNotFoundError:
+                pass
+            except Exception:
+                logger.warning("Could not load the site files", exc_info=True)
+            if sites is not previous.sites:
+                old_signature = previous.sites.signature if previous.sites is not None else (None,) * len(SITE_FILES)
+                changed += [name for name, old, new in zip(SITE_FILES, old_signature, sites.signature) if old != new]
+
+            self.snapshot = DatasetSnapshot(objects, stacov, cube, sites, time.monotonic())
+            return changed
+
+    def start(self):
+        """
+        Start polling in a daemon thread, unless interval is 0 or polling
+        has already started. The first poll runs interval seconds later,
+        not at start-up: until then requests load what they need on
+        demand, so a cold start does not ingest every dataset first.
+        """
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='cors-datasets', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                changed = self.refresh()
+                if changed:
+                    logger.info("Datasets updated: %s", ', '.join(changed))
+            except Exception:
+                logger.exception("Dataset refresh failed")
@@ -1,115 +1,911 @@
 from django.shortcuts import render
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.conf import settings
-from .models import read_stacov, generate_geojson, generate_CSV_geojson,generate_MYCS2_geojson,generate_OPUSNET_geojson,generate_MYCS_uncertainty_geojson
+from .artifacts import artifact_store
+from .cache import CachedResponse, file_signature, load_stacov, range_cache, response_cache, tile_cache
+from .cube import CUBE_FIELDS, encode_range, load_cube, stacov_files
+from .displacement import DEFAULT_SIGMA, encode_displacement
+from .matching import encode_residuals
+from .timeseries import DOWNSAMPLERS, MJD_UNIX_EPOCH, PFILES_DTYPE, downsample, encode_timeseries, load_timeseries
+from .datasets import DATASETS, day_number, load_table
+from .storage import LocalStorage, S3Storage, get_s3_client
+from .columnar import FORMAT_TYPES, arrow_available, encode_history, encode_layer_body
+from .registry import SITE_FILES, get_site_registry
+from .spatial import parse_viewport
+from .models import layer_geojson, stacov_layer, site_info_layer, mycs2_layer, opusnet_layer, mycs_uncertainty_layer
+from .mvt import encode_layer
+from .timing import METRICS_CONTENT_TYPE, metrics, stage, timed
+from .versions import DatasetManager
 import os
 import json
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import pandas as pd
-import boto3
-from decouple import config
-
-# Set up the S3 connection
-s3 = boto3.resource(
-    service_name='s3',
-    region_name=config('AWS_DEFAULT_REGION'),
-    aws_access_key_id=config('AWS_ACCESS_KEY_ID'),
-    aws_secret_access_key=config('AWS_SECRET_ACCESS_KEY')
-)
+
+# Dataset objects, cached locally when they come from S3. The S3 client
+# itself is only created by the first request that needs it.
+if settings.CORS_STORAGE_BACKEND == 'local':
+    storage = LocalStorage(settings.CORS_STORAGE_ROOT)
+else:
+    storage = S3Storage(settings.CORS_S3_BUCKET, get_s3_client, ttl=settings.CORS_S3_CACHE_TTL)
+
+# Rebuilds dataset tables and the station cube in the background once
+# started (see backend/wsgi.py and asgi.py); requests use its snapshot
+dataset_manager = DatasetManager(storage, os.path.join(settings.BASE_DIR, 'static'),
+                                 settings.CORS_DATASET_POLL_INTERVAL)
+
+# Options served from a CSV dataset, and the dataset each one reads
+OPTION_DATASETS = {
+    'Over All Vs MYCS2': 'mycs2_predictions',
+    'OPUSNET Data': 'opusnet',
+    'MYCS Uncertainty': 'mycs2_uncertainty',
+}
+
+# Bounded pools used by the async endpoint: one for waiting on S3 and
+# disk, one for parsing and encoding. Separate pools keep slow downloads
+# from starving CPU work and vice versa.
+io_executor = ThreadPoolExecutor(max_workers=settings.CORS_ASYNC_IO_WORKERS, thread_name_prefix='cors-io')
+cpu_executor = ThreadPoolExecutor(max_workers=settings.CORS_ASYNC_CPU_WORKERS, thread_name_prefix='cors-cpu')
+
+
+class LayerError(Exception):
+    """
+    A layer request that cannot be served, reported to the client as
+    {"error": message} with the given status.
+    """
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def dataset_object(name):
+    """
+    The current StoredObject of a CSV dataset: from the DatasetManager's
+    snapshot, table included, while it is polling, otherwise fetched
+    from storage in the request.
+    """
+    obj = dataset_manager.dataset(name)
+    if obj is None:
+        with stage('fetch'):
+            obj = storage.fetch(DATASETS[name]['file_name'])
+    return obj
+
+
+def dataset_table(name, obj):
+    """
+    The PartitionedTable for a StoredObject of a CSV dataset: the one it
+    carries, else the table for its version, built if needed.
+    """
+    if obj.table is not None:
+        return obj.table
+    return load_table(name, obj.version, lambda: obj.path)
+
+
+def read_dataset_day(name, input_date, obj=None):
+    """
+    Read one day of a CSV dataset from its date-partitioned local copy.
+    The copy is rebuilt only when the stored object changes, so a request
+    costs at most one conditional GET plus the rows for that day. obj is
+    the already fetched StoredObject, if the caller has one.
+    """
+    if obj is None:
+        obj = dataset_object(name)
+    return dataset_table(name, obj).read_day(input_date)
+
+
+def site_registry(snapshot):
+    """
+    The SiteRegistry of a DatasetManager snapshot, or without one the
+    process-wide registry, reloaded here if a site file changed.
+    """
+    if snapshot is not None and snapshot.sites is not None:
+        return snapshot.sites
+    return get_site_registry()
+
+
+def stacov_solution(file_path, snapshot):
+    """
+    load_stacov for a STACOV file, at the version in snapshot when it has
+    the file, which the poller has already parsed.
+    """
+    signature = snapshot.stacov.get(file_path) if snapshot is not None else None
+    return load_stacov(file_path, signature)
+
+
+def snapshot_versions(snapshot):
+    """
+    {source path: file signature} of the STACOV and site files in a
+    snapshot, so responses built from it are cached under the versions
+    they were built from rather than those now on disk. None without one.
+    """
+    if snapshot is None:
+        return None
+    versions = dict(snapshot.stacov)
+    if snapshot.sites is not None:
+        static_dir = os.path.join(settings.BASE_DIR, 'static')
+        versions.update(zip((os.path.join(static_dir, name) for name in SITE_FILES), snapshot.sites.signature))
+    return versions
+
+
+def accepts_gzip(request):
+    """
+    Whether the request's Accept-Encoding allows gzip, honouring q-values
+    (so "gzip;q=0" refuses it) and the "*" wildcard.
+    """
+    qualities = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, *params = [part.strip() for part in coding.split(';')]
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def cached_json_response(request, entry, content_type='application/json'):
+    """
+    Serve a CachedResponse, answering conditional requests with 304 and
+    sending the pre-compressed body to clients that accept gzip.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        not_modified = '*' in etags or entry.etag in etags
+    else:
+        if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = if_modified_since is not None and entry.last_modified <= if_modified_since
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    elif entry.gzip_body is not None and accepts_gzip(request):
+        response = HttpResponse(entry.gzip_body, content_type=content_type)
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(entry.body, content_type=content_type)
+
+    response['ETag'] = entry.etag
+    response['Last-Modified'] = http_date(entry.last_modified)
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def parse_date(value):
+    # Convert a date string from the frontend to a datetime object
+    return datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def parse_input_date(input_date_str):
+    return parse_date(input_date_str['date'])
+
+
+def stacov_file(input_date):
+    """
+    Return the date part (e.g. '24apr16') and path of the STACOV file for
+    a date, raising LayerError if there is none.
+    """
+    # Format the date part for the filename
+    day = input_date.strftime('%d')
+    month = input_date.strftime('%b').lower()
+    year = input_date.strftime('%y')
+
+    # Construct the correct date part (e.g., '24apr16')
+    date_part = f"{year}{month}{day}"
+    
+    # Construct the full file name
+    file_name = f"{date_part}NOAM4.0_ambres_nfx20.stacov"
+    
+    # Create the full file path
+    file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
+    
+    if not os.path.exists(file_path):
+        raise LayerError("Data not found")
+    return date_part, file_path
+
+
+def response_format(request, input_date_str):
+    """
+    Pick the response format (a FORMAT_TYPES key) from the request's
+    "format" field or, failing that, the first Accept media type that
+    names one. GeoJSON is the default.
+    """
+    requested = input_date_str.get('format')
+    if requested is None:
+        formats = {media_type: name for name, media_type in FORMAT_TYPES.items()}
+        accepted = (media_type.split(';')[0].strip() for media_type in request.META.get('HTTP_ACCEPT', '').split(','))
+        requested = next((formats[media_type] for media_type in accepted if media_type in formats), 'geojson')
+    if requested not in FORMAT_TYPES:
+        raise LayerError(f"Unknown format: {requested}")
+    if requested == 'arrow' and not arrow_available():
+        raise LayerError("Arrow output is not available", status.HTTP_406_NOT_ACCEPTABLE)
+    return requested
+
+
+def layer_http_response(layer, viewport, response_format):
+    """
+    Respond with a freshly built Layer: GeoJSON is streamed, the
+    columnar formats are encoded in one piece.
+    """
+    if layer is None:
+        raise LayerError("Data not found")
+    if response_format == 'geojson':
+        return StreamingHttpResponse(layer_geojson(layer, viewport), content_type='application/json')
+    return HttpResponse(encode_layer_body(layer, viewport, response_format),
+                        content_type=FORMAT_TYPES[response_format])
+
+
+# Most daily solutions compared in one displacement request
+MAX_DISPLACEMENT_DAYS = 31
+
+
+class DisplacementView(APIView):
+    """
+    Day-over-day station displacements between STACOV solutions:
+
+        {"input": {"dates": [...], "stations": [...], "sigma": 3,
+                   "moved_only": false}}
+
+    Consecutive dates (at least two, in date order) are compared station
+    by station. East/north/up displacements and their propagated sigmas
+    are in metres; stations moving more than sigma standard deviations
+    are flagged. stations is optional (all stations). The body is
+    columnar JSON, see displacement.encode_displacement.
+    """
+
+    def post(self, request):
+        try:
+            query = request.data.get('input', '')
+            if not query or not isinstance(query.get('dates'), list) or len(query['dates']) < 2:
+                return Response({"error": "At least two dates are required"}, status=status.HTTP_400_BAD_REQUEST)
+            if len(query['dates']) > MAX_DISPLACEMENT_DAYS:
+                return Response({"error": f"At most {MAX_DISPLACEMENT_DAYS} dates can be compared"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            n_sigma = query.get('sigma', DEFAULT_SIGMA)
+            if isinstance(n_sigma, bool) or not isinstance(n_sigma, (int, float)) or n_sigma <= 0:
+                return Response({"error": "sigma must be a positive number"}, status=status.HTTP_400_BAD_REQUEST)
+            stations = query.get('stations')
+            stations = tuple(sorted(str(station) for station in stations)) if stations else None
+            moved_only = bool(query.get('moved_only', False))
+
+            days = sorted({parse_date(value).date() for value in query['dates']})
+            try:
+                file_paths = [stacov_file(day)[1] for day in days]
+            except LayerError as e:
+                return Response({"error": str(e)}, status=e.status_code)
+
+            snapshot = dataset_manager.current()
+
+            def build():
+                solutions = [stacov_solution(file_path, snapshot)[2] for file_path in file_paths]
+                return encode_displacement([day.isoformat() for day in days], solutions, n_sigma, stations, moved_only)
+
+            key = ('displacement', tuple(days), stations, n_sigma, moved_only)
+            entry = response_cache.get_or_build(key, file_paths, build, snapshot_versions(snapshot))
+            return cached_json_response(request, entry)
+
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class ResidualView(APIView):
+    """
+    One day of MYCS2 predictions matched to the observed sites, with the
+    horizontal residual of each pair and day-level statistics:
+
+        {"input": {"date": ..., "max_distance": 5000}}
+
+    Predictions are paired by station code, or else with the nearest
+    site within max_distance metres (CORS_MATCH_MAX_DISTANCE by
+    default, at most CORS_MATCH_MAX_DISTANCE_LIMIT). The body is
+    columnar JSON, see matching.encode_residuals.
+    """
+
+    def post(self, request):
+        try:
+            query = request.data.get('input', '')
+            if not query or not query.get('date'):
+                return Response({"error": "No date provided"}, status=status.HTTP_400_BAD_REQUEST)
+            input_date = parse_input_date(query)
+            max_distance = query.get('max_distance', settings.CORS_MATCH_MAX_DISTANCE)
+            if (isinstance(max_distance, bool) or not isinstance(max_distance, (int, float))
+                    or not 0 <= max_distance <= settings.CORS_MATCH_MAX_DISTANCE_LIMIT):
+                return Response({"error": "max_distance must be a number from 0 to %g"
+                                 % settings.CORS_MATCH_MAX_DISTANCE_LIMIT}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                obj = dataset_object('mycs2_predictions')
+            except FileNotFoundError:
+                return Response({"error": "Data not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            day = input_date.strftime('%Y-%m-%d')
+            snapshot = dataset_manager.current()
+
+            def build():
+                df = read_dataset_day('mycs2_predictions', input_date, obj)
+                with stage('match'):
+                    return encode_residuals(day, df, site_registry(snapshot), float(max_distance))
+
+            key = ('residuals', obj.version, day, float(max_distance))
+            sources = [obj.path, os.path.join(settings.BASE_DIR, 'static', 'site_id.csv')]
+            entry = response_cache.get_or_build(key, sources, build, snapshot_versions(snapshot))
+            return cached_json_response(request, entry)
+
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Map layers and the dataset each dataset-backed one reads
+TILE_LAYERS = ('stacov', 'sites', 'mycs2', 'opusnet', 'mycs-uncertainty')
+LAYER_DATASETS = {
+    'mycs2': 'mycs2_predictions',
+    'opusnet': 'opusnet',
+    'mycs-uncertainty': 'mycs2_uncertainty',
+}
+
+# The map layer behind each StacovJsonView option
+OPTION_LAYERS = {
+    'Static JSON + STACOV File': 'stacov',
+    'Initial Load': 'stacov',
+    'Over All Site Info': 'sites',
+    'Over All Vs MYCS2': 'mycs2',
+    'OPUSNET Data': 'opusnet',
+    'MYCS Uncertainty': 'mycs-uncertainty',
+}
+
+
+def layer_day(name, input_date):
+    """
+    The day a layer is keyed by in caches and artifacts (YYYY-MM-DD), or
+    None for "sites", which does not change by day.
+    """
+    return None if name == 'sites' else input_date.strftime('%Y-%m-%d')
+
+
+def layer_source(name, input_date, obj=None, snapshot=None):
+    """
+    Return (source files, make_layer) for a map layer on a date, where
+    make_layer() builds the map Layer (or None if the day has no data).
+    obj is the dataset's already fetched StoredObject, if the caller has
+    one; STACOV days and the site registry are read from snapshot, the
+    DatasetManager's current one, when there is one.
+    """
+    static_dir = os.path.join(settings.BASE_DIR, 'static')
+    if name == 'stacov':
+        date_part, file_path = stacov_file(input_date)
+        sources = [file_path, os.path.join(static_dir, 'CORS_All_Site_data.json')]
+
+        def make_stacov_layer():
+            df_xyz = stacov_solution(file_path, snapshot)[2]
+            with stage('layer'):
+                return stacov_layer(df_xyz, site_registry(snapshot))
+
+        return sources, make_stacov_layer
+    if name == 'sites':
+        return [os.path.join(static_dir, 'site_id.csv')], timed('layer')(lambda: site_info_layer(site_registry(snapshot)))
+
+    dataset = LAYER_DATASETS[name]
+    if obj is None:
+        obj = dataset_object(dataset)
+
+    def make_layer():
+        df = read_dataset_day(dataset, input_date, obj)
+        with stage('layer'):
+            if name == 'mycs2':
+                return mycs2_layer(df, input_date, site_registry(snapshot))
+            if name == 'opusnet':
+                return opusnet_layer(df, input_date)
+            return mycs_uncertainty_layer(df, input_date)
+
+    return [obj.path], make_layer
+
+
+def source_versions(obj):
+    """
+    Artifact versions for the sources of a layer built from obj: the
+    dataset's StoredObject version (S3 ETag) in place of the mtime/size
+    of its local copy. None for layers without a dataset.
+    """
+    return None if obj is None else {obj.path: obj.version}
+
+
+def layer_object(name, obj=None):
+    """
+    The StoredObject a map layer is built from (obj if the caller already
+    has it), or None for layers without a dataset.
+    """
+    if obj is None and name in LAYER_DATASETS:
+        obj = dataset_object(LAYER_DATASETS[name])
+    return obj
+
+
+def layer_entry(name, day, viewport, fmt, sources, make_layer, obj=None, snapshot=None):
+    """
+    The CachedResponse for a layer that can be served without building
+    it per request: whole layers with a precomputed artifact, and the
+    "stacov" and "sites" layers, which are kept in memory. None for
+    dataset layers, which are built live. obj is the layer's dataset
+    StoredObject, whose version keys its artifacts; snapshot is the one
+    make_layer reads from.
+    """
+    entry = None
+    if viewport is None:
+        entry = artifact_store.get(name, day, fmt, sources, source_versions(obj))
+    if entry is None and name in ('stacov', 'sites'):
+        # Built once per file version and kept in memory
+        def build():
+            return encode_layer_body(make_layer(), viewport, fmt)
+
+        entry = response_cache.get_or_build((name, day, viewport, fmt), sources, build, snapshot_versions(snapshot))
+    return entry
+
+
+def layer_response(request, input_date_str, obj=None):
+    """
+    Build the response for one {"options": ..., "date": ...} request,
+    optionally limited to a map viewport with "bbox" and "zoom" and in
+    the format chosen by response_format.
+
+    Whole layers are served from precomputed artifacts when there is one
+    for the current inputs (see precompute_layers) and built live
+    otherwise. obj is passed on to layer_source for dataset-backed
+    options. Raises LayerError for requests that cannot be served.
+    """
+    try:
+        viewport = parse_viewport(input_date_str)
+    except (TypeError, ValueError) as e:
+        raise LayerError(str(e))
+    fmt = response_format(request, input_date_str)
+
+    name = OPTION_LAYERS.get(input_date_str['options'])
+    if name is None:
+        raise LayerError("Unknown option")
+    input_date = None if name == 'sites' else parse_input_date(input_date_str)
+    day = layer_day(name, input_date)
+    obj = layer_object(name, obj)
+    snapshot = dataset_manager.current()
+    sources, make_layer = layer_source(name, input_date, obj, snapshot)
+
+    entry = layer_entry(name, day, viewport, fmt, sources, make_layer, obj, snapshot)
+    if entry is not None:
+        response = cached_json_response(request, entry, FORMAT_TYPES[fmt])
+    else:
+        # Dataset days are read from the partitioned copy of the CSV
+        response = layer_http_response(make_layer(), viewport, fmt)
+
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def layer_query(payload):
+    """
+    The {"input": ...} member of a layer request body, raising LayerError
+    if it is missing or not an object.
+    """
+    query = payload.get('input', '') if isinstance(payload, dict) else payload
+    if not query:
+        raise LayerError("No date input provided")
+    if not isinstance(query, dict):
+        raise LayerError("Input must be an object")
+    return query
+
+
+def parse_batch(request, query):
+    """
+    Validate a batched request, {"options": [...], "date": ...} plus the
+    "bbox", "zoom" and "format" members of a single layer request, which
+    apply to every layer. Returns (layers, input_date, viewport, format),
+    where layers maps each distinct option to its layer name. Raises
+    LayerError or ValueError for requests that cannot be served.
+    """
+    options = query['options']
+    if not options or not all(isinstance(option, str) for option in options):
+        raise LayerError("options must be a list of option names")
+    layers = {}
+    for option in options:
+        if option not in OPTION_LAYERS:
+            raise LayerError(f"Unknown option: {option}")
+        layers[option] = OPTION_LAYERS[option]
+    try:
+        viewport = parse_viewport(query)
+    except (TypeError, ValueError) as e:
+        raise LayerError(str(e))
+    fmt = response_format(request, query)
+    if fmt == 'arrow':
+        raise LayerError("Arrow output is only available for single layers", status.HTTP_406_NOT_ACCEPTABLE)
+    needs_date = any(name != 'sites' for name in layers.values())
+    input_date = parse_input_date(query) if needs_date else None
+    return layers, input_date, viewport, fmt
+
+
+def batch_layer(name, input_date, viewport, fmt, fetch=None, snapshot=None):
+    """
+    Build one layer of a batch: returns (encoded body, source files).
+    fetch, if given, returns the dataset's StoredObject (e.g. the result
+    of a fetch on the I/O pool); snapshot is the batch's DatasetManager
+    snapshot. Errors are returned as an {"error": ...} body rather than
+    raised.
+    """
+    try:
+        obj = layer_object(name, fetch() if fetch is not None else None)
+        sources, make_layer = layer_source(name, input_date, obj, snapshot)
+        entry = layer_entry(name, layer_day(name, input_date), viewport, fmt, sources, make_layer, obj, snapshot)
+        if entry is not None:
+            return entry.body, sources
+        layer = make_layer()
+        if layer is None:
+            raise LayerError("Data not found")
+        return encode_layer_body(layer, viewport, fmt), sources
+    except LayerError as e:
+        message = str(e)
+    except FileNotFoundError:
+        message = "Data not found"
+    except Exception as e:
+        message = str(e)
+    return json.dumps({"error": message}).encode('utf-8'), []
+
+
+def batch_response(request, results, fmt):
+    """
+    Respond with {"layers": {option: layer}} from the (body, sources)
+    pairs batch_layer returned for each option. The combined body gets
+    an ETag like cached responses, and is compressed only for clients
+    that accept gzip.
+    """
+    body = b'{"layers":{' + b','.join(
+        json.dumps(option).encode('utf-8') + b':' + layer_body for option, (layer_body, _) in results.items()
+    ) + b'}}'
+    mtimes = [file_signature(source)[0] for _, sources in results.values() for source in sources]
+    last_modified = max(mtimes) // 10**9 if mtimes else int(time.time())
+    compress = settings.RESPONSE_CACHE_GZIP and accepts_gzip(request)
+    with stage('compress'):
+        entry = CachedResponse(body, None, last_modified, compress)
+    response = cached_json_response(request, entry, FORMAT_TYPES[fmt])
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+def submit_in_context(executor, func, *args):
+    # Run in a copy of this context so stage timings reach Server-Timing
+    return executor.submit(contextvars.copy_context().run, func, *args)
+
+
+def start_batch(layers, input_date, viewport, fmt):
+    """
+    Start a batch from parse_batch: the datasets its layers read are
+    fetched concurrently on the I/O pool, and every layer is built and
+    encoded on the CPU pool as soon as its dataset is there; numpy,
+    pandas and zlib release the GIL for most of that work. Returns
+    {option: Future of batch_layer's result}.
+    """
+    datasets = {LAYER_DATASETS[name] for name in layers.values() if name in LAYER_DATASETS}
+    fetches = {dataset: submit_in_context(io_executor, dataset_object, dataset) for dataset in datasets}
+    snapshot = dataset_manager.current()
+    builds = {}
+    for option, name in layers.items():
+        fetch = fetches.get(LAYER_DATASETS.get(name))
+        builds[option] = submit_in_context(cpu_executor, batch_layer, name, input_date, viewport, fmt,
+                                           fetch.result if fetch is not None else None, snapshot)
+    return builds
+
+
+def layers_response(request, query):
+    """
+    Several layers for one date in one response (see parse_batch).
+    """
+    layers, input_date, viewport, fmt = parse_batch(request, query)
+    builds = start_batch(layers, input_date, viewport, fmt)
+    return batch_response(request, {option: future.result() for option, future in builds.items()}, fmt)
+
 
 class StacovJsonView(APIView):
+    def perform_content_negotiation(self, request, force=False):
+        # Columnar/Arrow Accept types are served by layer_response rather
+        # than DRF renderers, so never reject them here
+        return super().perform_content_negotiation(request, force=True)
+
     def post(self, request):
         try:
             # Extract the date input from the frontend
-            input_date_str = request.data.get('input', '')
-            if not input_date_str:
-                return Response({"error": "No date input provided"}, status=status.HTTP_400_BAD_REQUEST)
-            if input_date_str['options'] == 'Static JSON + STACOV File' or input_date_str['options'] == 'Initial Load':
-
-                # Convert the input date string to a datetime object
-                input_date = datetime.strptime(input_date_str['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-
-                # Format the date part for the filename
-                day = input_date.strftime('%d')
-                month = input_date.strftime('%b').lower()
-                year = input_date.strftime('%y')
-
-                # Construct the correct date part (e.g., '24apr16')
-                date_part = f"{year}{month}{day}"
-                
-                # Construct the full file name
-                file_name = f"{date_part}NOAM4.0_ambres_nfx20.stacov"
-                
-                
-                # Create the full file path
-                file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
-                
-                if not os.path.exists(file_path):
-                    
-                    return Response({"error": "Data not found"}, status=status.HTTP_400_BAD_REQUEST)
-                    
-                
-                # Open and process the STACOV file
-                with open(file_path, 'rb') as file:
-                    cdate, nsta, df_xyz = read_stacov(file)
-                    geojson_str = generate_geojson(df_xyz)
-                    geojson_data = json.loads(geojson_str)
-
-                # Return the processed GeoJSON data
-                return Response(geojson_data, status=status.HTTP_200_OK)
-            elif input_date_str['options'] ==  'Over All Site Info':
-                file_name = 'site_id.csv'
-                file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
-                with open(file_path, 'rb') as file:
-                    df = pd.read_csv(file)
-                    geojson_csv_str = generate_CSV_geojson(df)
-                    geojson_csv_data = json.loads(geojson_csv_str)
-                return Response(geojson_csv_data,status=status.HTTP_200_OK)
-            elif input_date_str['options'] == 'Over All Vs MYCS2':
-                file_name_1 = 'site_id.csv'
-                file_path_1 = os.path.join(settings.BASE_DIR, 'static', file_name_1)
-                with open(file_path_1, 'rb') as file:
-                    df_1 = pd.read_csv(file)
-                input_date = datetime.strptime(input_date_str['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                file_name = 'mycs2_predictions.csv'
-                # Fetch the MYCS2 predictions CSV from S3
-                obj = s3.Bucket('cors-dashboard-dataset').Object(file_name).get()
-                df = pd.read_csv(obj['Body'])
-                geojson_MYCS2_str = generate_MYCS2_geojson(df,input_date,df_1)
-                geojson_MYCS2_data = json.loads(geojson_MYCS2_str)
-                return Response(geojson_MYCS2_data,status=status.HTTP_200_OK)
-            elif input_date_str['options'] == 'OPUSNET Data':
-                # Convert the input date string to a datetime object
-                input_date = datetime.strptime(input_date_str['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                file_name = 'opusnet_converted_corrected.csv'
-                # file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
-                # with open(file_path, 'rb') as file:
-                #     df = pd.read_csv(file)
-                # df = fetch_all_opusnet_data()
-                # Fetch the MYCS2 predictions CSV from S3
-                obj = s3.Bucket('cors-dashboard-dataset').Object(file_name).get()
-                df = pd.read_csv(obj['Body'])
-                geojson_OPUSNET_str = generate_OPUSNET_geojson(df,input_date)
-                geojson_OPUSNET_data = json.loads(geojson_OPUSNET_str)
-                return Response(geojson_OPUSNET_data,status=status.HTTP_200_OK)
-            elif input_date_str['options'] ==  'MYCS Uncertainty':
-                # Convert the input date string to a datetime object
-                input_date = datetime.strptime(input_date_str['date'], '%Y-%m-%dT%H:%M:%S.%fZ')
-                file_name = 'mycs2_uncertainty.csv'
-                # file_path = os.path.join(settings.BASE_DIR, 'static', file_name)
-                # with open(file_path, 'rb') as file:
-                #     df = pd.read_csv(file)
-                obj = s3.Bucket('cors-dashboard-dataset').Object(file_name).get()
-                df = pd.read_csv(obj['Body'])
-                geojson_MYCS_str = generate_MYCS_uncertainty_geojson(df,input_date)
-                geojson_MYCS2_uncertainty_data = json.loads(geojson_MYCS_str)
-                return Response(geojson_MYCS2_uncertainty_data,status=status.HTTP_200_OK)
-        
+            input_date_str = layer_query(request.data)
+            if isinstance(input_date_str.get('options'), list):
+                return layers_response(request, input_date_str)
+            return layer_response(request, input_date_str)
+
+        except LayerError as e:
+            return Response({"error": str(e)}, status=e.status_code)
+
         except ValueError:
             return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
         
         except Exception as e:
             # Handle any errors that occur during processing
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+# Cube fields returned when a range request does not name any
+DEFAULT_RANGE_FIELDS = ('latitude', 'longitude', 'height')
+
+
+class StationRangeView(APIView):
+    """
+    All STACOV solutions between two dates in one response, read from the
+    station x day cube:
+
+        {"input": {"start": ..., "end": ..., "stations": [...], "fields": [...]}}
+
+    stations and fields are optional (all stations; DEFAULT_RANGE_FIELDS).
+    The body is columnar JSON, see cube.encode_range.
+    """
+
+    def post(self, request):
+        try:
+            query = request.data.get('input', '')
+            if not query or not query.get('start') or not query.get('end'):
+                return Response({"error": "No date range provided"}, status=status.HTTP_400_BAD_REQUEST)
+            start_day = day_number(parse_date(query['start']))
+            end_day = day_number(parse_date(query['end']))
+            if end_day < start_day:
+                return Response({"error": "End date is before start date"}, status=status.HTTP_400_BAD_REQUEST)
+
+            fields = tuple(query.get('fields') or DEFAULT_RANGE_FIELDS)
+            unknown = [field for field in fields if field not in CUBE_FIELDS]
+            if unknown:
+                return Response({"error": f"Unknown field: {', '.join(map(str, unknown))}"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            stations = query.get('stations')
+            stations = tuple(str(station) for station in stations) if stations else None
+
+            # The polled cube, if there is one, otherwise the files on disk
+            static_dir = os.path.join(settings.BASE_DIR, 'static')
+            snapshot = dataset_manager.current()
+            cube = snapshot.cube if snapshot is not None else None
+            file_paths = list(snapshot.stacov) if cube is not None else stacov_files(static_dir)
+            if not file_paths:
+                return Response({"error": "Data not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            def build():
+                current = cube if cube is not None else load_cube(static_dir)
+                return encode_range(*current.query(start_day, end_day, stations, fields))
+
+            key = ('range', cube.path if cube is not None else None, start_day, end_day, stations, fields)
+            versions = snapshot_versions(snapshot) if cube is not None else None
+            entry = range_cache.get_or_build(key, file_paths, build, versions)
+            return cached_json_response(request, entry)
+
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class TimeSeriesView(APIView):
+    """
+    One station's .pfiles time series as columnar JSON:
+
+        {"input": {"station": "CLGO", "start": ..., "end": ...,
+                   "points": 1000, "method": "lttb", "field": "height"}}
+
+    start/end are optional and inclusive. With points, the range is
+    downsampled server-side by method ("lttb" or "minmax"), choosing rows
+    by field.
+    """
+
+    def post(self, request):
+        try:
+            query = request.data.get('input', '')
+            if not query or not query.get('station'):
+                return Response({"error": "No station provided"}, status=status.HTTP_400_BAD_REQUEST)
+            station = str(query['station']).upper()
+            start_mjd = day_number(parse_date(query['start'])) + MJD_UNIX_EPOCH if query.get('start') else None
+            end_mjd = day_number(parse_date(query['end'])) + MJD_UNIX_EPOCH + 1 if query.get('end') else None
+
+            points = query.get('points')
+            if points is not None and (not isinstance(points, int) or points < 3):
+                return Response({"error": "points must be an integer of at least 3"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            method = query.get('method', 'lttb')
+            field = query.get('field', 'height')
+            if method not in DOWNSAMPLERS:
+                return Response({"error": f"Unknown method: {method}"}, status=status.HTTP_400_BAD_REQUEST)
+            if field not in PFILES_DTYPE.names:
+                return Response({"error": f"Unknown field: {field}"}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                series = load_timeseries(station, os.path.join(settings.BASE_DIR, 'static'))
+            except FileNotFoundError:
+                return Response({"error": "Data not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            def build():
+                records = series.read(start_mjd, end_mjd)
+                count = len(records)
+                if points:
+                    records = downsample(records, method, points, field)
+                return encode_timeseries(station, count, records)
+
+            key = ('timeseries', station, start_mjd, end_mjd, points, method if points else None, field if points else None)
+            source = os.path.join(settings.BASE_DIR, 'static', f'{station}.pfiles')
+            entry = response_cache.get_or_build(key, [source], build)
+            return cached_json_response(request, entry)
+
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+class SiteHistoryView(APIView):
+    """
+    Every row of one site in a CSV dataset, in date order, as columnar
+    JSON (see columnar.encode_history):
+
+        {"input": {"dataset": "opusnet", "site": "1LSU",
+                   "start": ..., "end": ...}}
+
+    start/end are optional and inclusive. Rows are found through the
+    table's site index, so the cost does not grow with the dataset.
+    """
+
+    def post(self, request):
+        try:
+            query = request.data.get('input', '')
+            if not query or not query.get('site'):
+                return Response({"error": "No site provided"}, status=status.HTTP_400_BAD_REQUEST)
+            name = query.get('dataset', 'opusnet')
+            if name not in DATASETS:
+                return Response({"error": f"Unknown dataset: {name}"}, status=status.HTTP_400_BAD_REQUEST)
+            site = str(query['site'])
+            start = parse_date(query['start']).date() if query.get('start') else None
+            end = parse_date(query['end']).date() if query.get('end') else None
+            if start is not None and end is not None and end < start:
+                return Response({"error": "End date is before start date"}, status=status.HTTP_400_BAD_REQUEST)
+
+            try:
+                obj = dataset_object(name)
+            except FileNotFoundError:
+                return Response({"error": "Data not found"}, status=status.HTTP_400_BAD_REQUEST)
+
+            def build():
+                table = dataset_table(name, obj)
+                return encode_history(name, site, table.read_site(site, start, end), table.meta['date_column'])
+
+            key = ('history', name, obj.version, site, start, end)
+            entry = response_cache.get_or_build(key, [obj.path], build)
+            return cached_json_response(request, entry)
+
+        except ValueError:
+            return Response({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+MAX_TILE_ZOOM = 22
+MVT_CONTENT_TYPE = 'application/vnd.mapbox-vector-tile'
+
+
+@require_GET
+def vector_tile(request, layer, date, z, x, y):
+    """
+    One Mapbox Vector Tile of a map layer on a date (YYYY-MM-DD; ignored
+    for "sites"). Tiles are encoded from the same arrays as the GeoJSON
+    responses and cached per tile, so pans only fetch new tiles.
+    """
+    if layer not in TILE_LAYERS:
+        return JsonResponse({"error": "Unknown layer"}, status=status.HTTP_404_NOT_FOUND)
+    if z > MAX_TILE_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        return JsonResponse({"error": "Tile out of range"}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        input_date = None if layer == 'sites' else datetime.strptime(date, '%Y-%m-%d')
+        snapshot = dataset_manager.current()
+        sources, make_layer = layer_source(layer, input_date, snapshot=snapshot)
+
+        def build():
+            map_layer = make_layer()
+            if map_layer is None:
+                return b''
+            return encode_layer(layer, map_layer.groups, z, x, y)
+
+        key = (layer, layer_day(layer, input_date), z, x, y)
+        entry = tile_cache.get_or_build(key, sources, build, snapshot_versions(snapshot))
+        return cached_json_response(request, entry, content_type=MVT_CONTENT_TYPE)
+
+    except (LayerError, FileNotFoundError):
+        return JsonResponse({"error": "Data not found"}, status=status.HTTP_404_NOT_FOUND)
+
+    except ValueError:
+        return JsonResponse({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+def render_layer(request, input_date_str, obj=None):
+    """
+    layer_response with streamed bodies collected, for running on an
+    executor thread so no encoding happens on the event loop.
+    """
+    response = layer_response(request, input_date_str, obj)
+    if response.streaming:
+        body = b''.join(response.streaming_content)
+        response = HttpResponse(body, content_type=response['Content-Type'])
+    return response
+
+
+@csrf_exempt
+@require_POST
+async def stacov_json_async(request):
+    """
+    Async counterpart of StacovJsonView for the ASGI application. S3
+    revalidation/downloads run on the I/O pool; parsing and encoding run
+    on the CPU pool, so the event loop never blocks on either.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        payload = json.loads(request.body or b'{}')
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON body"}, status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        input_date_str = layer_query(payload)
+        if isinstance(input_date_str.get('options'), list):
+            layers, input_date, viewport, fmt = parse_batch(request, input_date_str)
+            builds = start_batch(layers, input_date, viewport, fmt)
+            results = await asyncio.gather(*(asyncio.wrap_future(future) for future in builds.values()))
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(cpu_executor, context.run, batch_response, request,
+                                              dict(zip(builds, results)), fmt)
+
+        obj = None
+        dataset = OPTION_DATASETS.get(input_date_str['options'])
+        if dataset is not None:
+            obj = dataset_manager.dataset(dataset)
+        if dataset is not None and obj is None:
+            # Bring the object up to date on the I/O pool; the CPU stage
+            # then reads the local copy without another round trip
+            with stage('fetch'):
+                obj = await loop.run_in_executor(io_executor, storage.fetch, DATASETS[dataset]['file_name'])
+
+        # Run in a copy of this context so stage timings reach Server-Timing
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(cpu_executor, context.run, render_layer, request, input_date_str, obj)
+
+    except LayerError as e:
+        return JsonResponse({"error": str(e)}, status=e.status_code)
+
+    except ValueError:
+        return JsonResponse({"error": "Invalid date format"}, status=status.HTTP_400_BAD_REQUEST)
+
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@require_GET
+def metrics_view(request):
+    """
+    Stage and request latency histograms and cache outcomes of this
+    process, in the Prometheus text format.
+    """
+    return HttpResponse(metrics.render(), content_type=METRICS_CONTENT_TYPE)